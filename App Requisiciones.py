@@ -1,19 +1,21 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
+import altair as alt
+from streamlit.errors import StreamlitAPIException
 import time
-import re
-import io
-import os
 import uuid
-from pandas.errors import ParserError
-from filelock import FileLock
-import glob
 
-st.set_page_config(page_title="Sistema de Requisiciones", layout="wide")
+import almacenamiento
+import historico
+import metricas
+import respaldos
+import exportaciones
+import importacion
+import sincronizacion
+import acumulados
+import operaciones
 
-def df_to_csv_bytes(df):
-    return df.to_csv(index=False, encoding="utf-8-sig").encode()
+st.set_page_config(page_title="Sistema de Requisiciones", layout="wide")
 
 ALMACEN_PASSWORD = st.secrets["ALMACEN_PASSWORD"]
 
@@ -21,184 +23,47 @@ ALMACEN_PASSWORD = st.secrets["ALMACEN_PASSWORD"]
 # CONFIGURACIÓN GENERAL
 # ============================================================
 
-CSV_PATH = "data/requisiciones.csv"
-LOCK_PATH = CSV_PATH + ".lock"
-BACKUP_DIR = "data/backups"
+BACKUP_DIR = almacenamiento.BACKUP_DIR
 
-# ==========================
-# CSV LOCAL (FUENTE DE VERDAD)
-# ==========================
+# Motor de almacenamiento: "csv" (default) o "sqlite" (WAL, recomendado en producción)
+almacen = almacenamiento.obtener_almacen(st.secrets.get("MOTOR_ALMACEN"))
 
-COLUMNAS_BASE = [
-    "ID", "uuid", "fecha_hora", "cuarto", "work_order", "numero_parte", "numero_lote",
-    "cantidad", "motivo", "status", "almacenista", "issue", "min_final"
-]
+# Respaldos incrementales comprimidos en un hilo de fondo (uno por proceso)
+gestor_respaldos = respaldos.obtener_gestor(almacen)
 
-def asegurar_directorio_csv():
-    carpeta = os.path.dirname(CSV_PATH)
-    if carpeta and not os.path.exists(carpeta):
-        os.makedirs(carpeta, exist_ok=True)
+# Aviso de cambios: un hilo por proceso publica la versión de los datos
+vigilante = almacenamiento.obtener_vigilante(almacen)
 
-def crear_backup_csv(motivo="auto"):
-    if not os.path.exists(CSV_PATH):
-        return
+# Indicadores pre-agregados (tab Indicadores), mantenidos por un hilo de fondo
+kpis = acumulados.obtener_acumulados(almacen)
 
-    os.makedirs(BACKUP_DIR, exist_ok=True)
+# Sincronización con Smartsheet en un hilo de fondo (si hay token y hoja)
+sincronizador = None
+if sincronizacion.disponible() and st.secrets.get("SMARTSHEET_TOKEN") and st.secrets.get("SMARTSHEET_SHEET_ID"):
+    sincronizador = sincronizacion.obtener_sincronizador(
+        almacen, st.secrets["SMARTSHEET_TOKEN"], st.secrets["SMARTSHEET_SHEET_ID"]
+    )
 
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    backup_path = f"{BACKUP_DIR}/requisiciones_backup_{timestamp}_{motivo}.csv"
+# Tiempos del almacenamiento: se vuelcan a data/metricas/ (JSON + Prometheus) cada minuto
+metricas.iniciar_volcado()
 
-    try:
-        import shutil
-        shutil.copy2(CSV_PATH, backup_path)
-    except Exception as e:
-        st.warning(f"⚠️ No se pudo crear respaldo del CSV: {e}")
-
-def _read_csv_seguro():
-    """
-    Lee CSV con fallback si hay líneas dañadas.
-    No usa lock; el lock se maneja fuera cuando se necesita.
-    """
-    if not os.path.exists(CSV_PATH):
-        return pd.DataFrame(columns=COLUMNAS_BASE)
+def mostrar_avisos():
+    for aviso in almacenamiento.tomar_avisos():
+        st.warning(aviso)
 
+def recargar_seccion():
+    # Vuelve a correr solo el fragmento; si esto viene de una ejecución completa
+    # (p. ej. la recarga de vigilar_cambios) Streamlit no lo permite y se recarga todo
     try:
-        df = pd.read_csv(CSV_PATH, dtype=str, encoding="utf-8-sig").fillna("")
-        return df
-    except ParserError:
-        crear_backup_csv("corrupto")
-
-        df = pd.read_csv(
-            CSV_PATH,
-            dtype=str,
-            encoding="utf-8-sig",
-            engine="python",
-            on_bad_lines="skip"
-        ).fillna("")
-
-        st.warning(
-            "⚠️ El archivo de requisiciones estaba dañado. "
-            "Se creó un respaldo automático y se omitieron líneas inválidas."
-        )
-        return df
-
-def cargar_desde_csv():
-    """
-    Lee con lock para no leer a mitad de una escritura.
-    """
-    asegurar_directorio_csv()
-
-    # Si no existe aún, regresa estructura vacía
-    if not os.path.exists(CSV_PATH):
-        return pd.DataFrame(columns=COLUMNAS_BASE)
-
-    with FileLock(LOCK_PATH, timeout=10):
-        df = _read_csv_seguro()
-
-    # Normalizaciones
-    if "issue" in df.columns:
-        df["issue"] = df["issue"].astype(str).str.lower().isin(["true", "1", "yes", "si", "sí"])
-
-    if "cantidad" in df.columns:
-        df["cantidad"] = pd.to_numeric(df["cantidad"], errors="coerce").fillna(0).astype(int)
-
-    # fecha_hora_dt para orden y cálculo
-    df["fecha_hora_dt"] = pd.to_datetime(df.get("fecha_hora", ""), errors="coerce")
-
-    # Garantizar columnas
-    for c in COLUMNAS_BASE:
-        if c not in df.columns:
-            df[c] = "" if c not in ["issue"] else False
-
-    return df
-
-def guardar_a_csv(df):
-    """
-    Escritura atómica: escribe a .tmp y luego reemplaza.
-    Usa lock para evitar corrupción.
-    """
-    asegurar_directorio_csv()
-    df_out = df.copy()
-
-    # Evitar guardar columnas internas
-    df_out = df_out.drop(columns=["fecha_hora_dt"], errors="ignore")
-
-    # Asegurar orden de columnas (si faltan, se crean)
-    for c in COLUMNAS_BASE:
-        if c not in df_out.columns:
-            df_out[c] = "" if c not in ["issue"] else False
-    df_out = df_out[COLUMNAS_BASE]
-
-    with FileLock(LOCK_PATH, timeout=10):
-        crear_backup_csv("pre_guardado")
-        
-        tmp_path = CSV_PATH + ".tmp"
-        df_out.to_csv(tmp_path, index=False, encoding="utf-8-sig")
-        os.replace(tmp_path, CSV_PATH)
-
-def siguiente_id(df):
-    # REQ-00001...
-    ids = df["ID"].astype(str).tolist() if "ID" in df.columns else []
-    nums = []
-    for v in ids:
-        if v.startswith("REQ-"):
-            try:
-                nums.append(int(v.replace("REQ-", "")))
-            except:
-                pass
-    nuevo = (max(nums) + 1) if nums else 1
-    return f"REQ-{nuevo:05d}"
-
-def ya_existe_uuid(df, u):
-    if "uuid" not in df.columns:
-        return False
-    return (df["uuid"].astype(str) == str(u)).any()
-
-def agregar_requisicion_csv(nueva_fila):
-    """
-    Inserta arriba y guarda.
-    Anti-duplicado: si uuid ya existe, no inserta.
-
-    OJO IMPORTANTE: se hace TODO dentro de lock (leer -> checar -> insertar -> guardar)
-    para evitar que 2 usuarios se pisen y se pierdan registros.
-    """
-    asegurar_directorio_csv()
-
-    with FileLock(LOCK_PATH, timeout=10):
-        df = _read_csv_seguro()
-
-        # Garantizar columnas mínimas si CSV venía vacío/dañado
-        for c in COLUMNAS_BASE:
-            if c not in df.columns:
-                df[c] = "" if c not in ["issue"] else False
-
-        # Normalizaciones básicas para comparar uuid
-        if "uuid" not in df.columns:
-            df["uuid"] = ""
-
-        if ya_existe_uuid(df, nueva_fila["uuid"]):
-            return cargar_desde_csv(), False
-
-        df_nueva = pd.DataFrame([nueva_fila])
-        df = pd.concat([df_nueva, df], ignore_index=True)
-
-        # Orden por fecha desc
-        df["fecha_hora_dt"] = pd.to_datetime(df.get("fecha_hora", ""), errors="coerce")
-        df = df.sort_values(by="fecha_hora_dt", ascending=False)
-
-        # Guardado atómico (sin salir del lock)
-        df_out = df.drop(columns=["fecha_hora_dt"], errors="ignore")
-        for c in COLUMNAS_BASE:
-            if c not in df_out.columns:
-                df_out[c] = "" if c not in ["issue"] else False
-        df_out = df_out[COLUMNAS_BASE]
-
-        tmp_path = CSV_PATH + ".tmp"
-        df_out.to_csv(tmp_path, index=False, encoding="utf-8-sig")
-        os.replace(tmp_path, CSV_PATH)
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
-    # Devuelve el df ya normalizado con fecha_hora_dt
-    return cargar_desde_csv(), True
+@st.fragment(run_every=almacenamiento.INTERVALO_VIGILANCIA)
+def vigilar_cambios():
+    # Solo compara versiones; la página se recarga únicamente si alguien escribió
+    if vigilante.version() != st.session_state.get("version_vista"):
+        st.rerun()
 
 # =============================
 # ENCABEZADO CORPORATIVO
@@ -284,24 +149,30 @@ st.markdown(
 # TABS
 # ============================================================
 
-tab1, tab2 = st.tabs(["➕ Registrar Requisición", "📦 Almacén"])
+tab1, tab2, tab3 = st.tabs(["➕ Registrar Requisición", "📦 Almacén", "📊 Indicadores"])
+
+# Cada sección es un fragmento: un clic o una tecla dentro de ella solo vuelve
+# a ejecutar esa sección, no todo el script (los demás tabs, estilos, tabla...).
 
 # ==========================================================
 # TAB 1 → Registrar Requisición
 # ==========================================================
-with tab1:
-    st.header("Registrar Requisición")
 
+def limpiar_formulario():
+    st.session_state.form_cuarto = ""
+    st.session_state.form_work = ""
+    st.session_state.form_parte = ""
+    st.session_state.form_lote = ""
+    st.session_state.form_cantidad = 1
+    st.session_state.form_motivo = "Proceso"
+
+@st.fragment
+def formulario_registro():
     # -----------------------------
     # 1. Inicializar estado
     # -----------------------------
     if "form_cuarto" not in st.session_state:
-        st.session_state.form_cuarto = ""
-        st.session_state.form_work = ""
-        st.session_state.form_parte = ""
-        st.session_state.form_lote = ""
-        st.session_state.form_cantidad = 1
-        st.session_state.form_motivo = "Proceso"
+        limpiar_formulario()
 
     if "msg_ok" not in st.session_state:
         st.session_state.msg_ok = False
@@ -311,35 +182,23 @@ with tab1:
 
     # Si viene de un guardado anterior, limpiar antes de crear widgets
     if st.session_state.reset_form:
-        st.session_state.form_cuarto = ""
-        st.session_state.form_work = ""
-        st.session_state.form_parte = ""
-        st.session_state.form_lote = ""
-        st.session_state.form_cantidad = 1
-        st.session_state.form_motivo = "Proceso"
+        limpiar_formulario()
         st.session_state.reset_form = False
 
-    lista_cuartos = [
-        "INTRODUCER","PU1","PU2","PU3","PU4","PVC1","PVC2","PVC3A","PVC3B",
-        "PVC6","PVC7","PVC8","PVC9","PVCS","PAK1","MGLY","MASM1","MMCL",
-        "MM MOLD","MMFP","MIXING","RESORTES"
-    ]
-    lista_motivos = ["Proceso","Extra","Scrap","Navajas","Tooling"]
-
     # -----------------------------
     # 2. Formulario
     # -----------------------------
     col1, col2 = st.columns(2)
 
     with col1:
-        st.selectbox("Cuarto", lista_cuartos, key="form_cuarto")
+        st.selectbox("Cuarto", almacenamiento.CUARTOS, key="form_cuarto")
         st.text_input("Work Order", key="form_work")
         st.text_input("Número de Parte", key="form_parte")
 
     with col2:
         st.text_input("Número de Lote", key="form_lote")
         st.number_input("Cantidad", min_value=1, step=1, key="form_cantidad")
-        st.selectbox("Motivo", lista_motivos, key="form_motivo")
+        st.selectbox("Motivo", almacenamiento.MOTIVOS, key="form_motivo")
 
     # -----------------------------
     # 3. Mensaje de éxito
@@ -348,13 +207,14 @@ with tab1:
         if "msg_timestamp" not in st.session_state:
             st.session_state.msg_timestamp = time.time()
 
-        folio = st.session_state.get("ultimo_id", "???")
-        st.success(f"✔ Requisición {folio} enviada correctamente.")
-
         if time.time() - st.session_state.msg_timestamp > 4:
+            # Vencido: ya no se pinta. Sin st.rerun(): en una ejecución completa
+            # se perdería el clic que la provocó (p. ej. "Guardar cambios" en Almacén)
             st.session_state.msg_ok = False
             del st.session_state.msg_timestamp
-            st.rerun()
+        else:
+            folio = st.session_state.get("ultimo_id", "???")
+            st.success(f"✔ Requisición {folio} enviada correctamente.")
 
     # -----------------------------
     # 4. Guardar requisición (botón con texto dinámico)
@@ -375,42 +235,30 @@ with tab1:
 
     if st.session_state.guardando:
 
-        # Generar ID local (sin internet)
-        df_actual = cargar_desde_csv()
-        ID = siguiente_id(df_actual)
-        st.session_state.ultimo_id = ID
-
-        # Hora local (UTC-7)
-        hora_local = datetime.utcnow() - timedelta(hours=7)
-
         # Anti-duplicado fuerte: uuid por intento
         if "pending_uuid" not in st.session_state:
             st.session_state.pending_uuid = str(uuid.uuid4())
 
-        nueva_fila = {
-            "ID": ID,
-            "uuid": st.session_state.pending_uuid,
-            "fecha_hora": hora_local.strftime("%Y-%m-%d %H:%M:%S"),
-            "cuarto": st.session_state.form_cuarto,
-            "work_order": st.session_state.form_work,
-            "numero_parte": st.session_state.form_parte,
-            "numero_lote": st.session_state.form_lote,
-            "cantidad": int(st.session_state.form_cantidad),
-            "motivo": st.session_state.form_motivo,
-            "status": "Pendiente",
-            "almacenista": "",
-            "issue": False,
-            "min_final": "",
-        }
+        nueva_fila = operaciones.nueva_requisicion(
+            st.session_state.form_cuarto,
+            st.session_state.form_work,
+            st.session_state.form_parte,
+            st.session_state.form_lote,
+            st.session_state.form_cantidad,
+            st.session_state.form_motivo,
+            uuid_val=st.session_state.pending_uuid,
+        )
 
-        # Guardar en CSV (con lock)
+        # Guardar (con lock / transacción)
         try:
-            _, inserted = agregar_requisicion_csv(nueva_fila)
+            ID, inserted = operaciones.registrar(almacen, nueva_fila)
+            st.session_state.ultimo_id = ID or "???"
             if not inserted:
                 st.warning("⚠️ Esta requisición ya estaba registrada (evité duplicado).")
         except Exception as e:
             st.error("❌ Error al guardar en CSV.")
             st.write(e)
+        mostrar_avisos()
 
         # Limpiar bandera de intento
         st.session_state.pop("pending_uuid", None)
@@ -419,159 +267,267 @@ with tab1:
         st.session_state.guardando = False
         st.session_state.msg_ok = True
         st.session_state.reset_form = True
-        st.rerun()
+        recargar_seccion()
+
+@st.fragment
+def importacion_masiva():
+    with st.expander("📥 Importar varias requisiciones (CSV / Excel)"):
+        st.caption(
+            "Columnas: cuarto, numero_parte, cantidad, motivo y opcionales work_order, numero_lote "
+            "(también se aceptan los encabezados del formulario). "
+            "Si un renglón tiene error no se importa ninguno."
+        )
+        archivo = st.file_uploader(
+            "Archivo", type=importacion.formatos_disponibles(), key="importar_archivo"
+        )
+
+        if archivo is not None and st.button("Importar requisiciones", key="importar_boton"):
+            try:
+                resultado = importacion.importar(almacen, archivo.getvalue(), archivo.name)
+            except Exception as e:
+                st.error("❌ No se pudo leer / importar el archivo.")
+                st.write(e)
+            else:
+                errores = resultado["errores"]
+                folios = resultado["folios"]
+                if len(errores):
+                    st.error(f"❌ {len(errores)} renglones con error; no se importó nada.")
+                    st.dataframe(errores, hide_index=True, use_container_width=True)
+                if folios:
+                    gestor_respaldos.solicitar("importacion")
+                    st.success(f"✔ {len(folios)} requisiciones importadas: {folios[0]} a {folios[-1]}.")
+                if resultado["ya_registradas"]:
+                    st.warning(f"⚠️ {resultado['ya_registradas']} ya estaban registradas (evité duplicados).")
+                if resultado["repetidas"]:
+                    st.warning(f"⚠️ {resultado['repetidas']} filas repetidas en el archivo.")
+            mostrar_avisos()
+
+with tab1:
+    st.header("Registrar Requisición")
+    formulario_registro()
+    importacion_masiva()
 
 # ============================================================
-# TAB 2 — PANEL DE ALMACÉN
+# TAB 3 — INDICADORES (antes del Almacén: ese tab hace st.stop() sin contraseña)
 # ============================================================
 
-with tab2:
+@st.fragment
+def tablero_indicadores():
+    # Solo lee los acumulados (tablas chicas); el hilo de fondo los mantiene al día
+    ahora_kpi = almacenamiento.hora_local()
+    semaforo_kpi = kpis.semaforo_abiertas(ahora_kpi)
+    entregas_kpi = kpis.entregas_por_dia(dias=30, ahora=ahora_kpi)
+    hoy_kpi = entregas_kpi[entregas_kpi["dia"] == pd.Timestamp(ahora_kpi.date())]
+
+    c1, c2, c3, c4, c5 = st.columns(5)
+    c1.metric("🟢 Abiertas", semaforo_kpi["🟢"])
+    c2.metric("🟡 Abiertas", semaforo_kpi["🟡"])
+    c3.metric("🔴 Abiertas", semaforo_kpi["🔴"])
+    c4.metric("Entregadas hoy", int(hoy_kpi["entregadas"].sum()))
+    c5.metric(
+        "Min. promedio hoy",
+        f"{hoy_kpi['promedio_min'].iloc[0]:.1f}" if len(hoy_kpi) and pd.notna(hoy_kpi["promedio_min"].iloc[0]) else "—",
+    )
 
-    st.markdown("<div class='titulo-seccion'>Panel de Almacén</div>", unsafe_allow_html=True)
+    volumen_kpi = kpis.volumen_por_hora(horas=48, ahora=ahora_kpi)
+    st.markdown("**Requisiciones por hora y cuarto (últimas 48 h)**")
+    if volumen_kpi.empty:
+        st.caption("Sin requisiciones en las últimas 48 horas.")
+    else:
+        st.altair_chart(
+            alt.Chart(volumen_kpi).mark_bar().encode(
+                x=alt.X("hora:T", title="Hora"),
+                y=alt.Y("sum(altas):Q", title="Requisiciones"),
+                color=alt.Color("cuarto:N", title="Cuarto"),
+                tooltip=["hora:T", "cuarto:N", "altas:Q"],
+            ),
+            use_container_width=True,
+        )
 
-    if "almacen_autenticando" not in st.session_state:
-        st.session_state.almacen_autenticando = False
+    colK1, colK2 = st.columns(2)
+    with colK1:
+        st.markdown("**Entregas por día y semáforo (30 días)**")
+        if entregas_kpi.empty:
+            st.caption("Sin entregas en los últimos 30 días.")
+        else:
+            por_color = entregas_kpi.melt(
+                id_vars=["dia"], value_vars=["verde", "amarillo", "rojo"], var_name="semaforo", value_name="n"
+            )
+            st.altair_chart(
+                alt.Chart(por_color).mark_bar().encode(
+                    x=alt.X("dia:T", title="Día"),
+                    y=alt.Y("n:Q", title="Entregadas"),
+                    color=alt.Color(
+                        "semaforo:N", title="Semáforo",
+                        scale=alt.Scale(domain=["verde", "amarillo", "rojo"], range=["#2e7d32", "#f9a825", "#c62828"]),
+                    ),
+                    tooltip=["dia:T", "semaforo:N", "n:Q"],
+                ),
+                use_container_width=True,
+            )
+    with colK2:
+        st.markdown("**Tiempo de entrega (min)**")
+        tiempos_kpi = kpis.tiempos_entrega()
+        if tiempos_kpi.empty:
+            st.caption("Todavía no hay entregas con tiempo registrado.")
+        else:
+            st.altair_chart(
+                alt.Chart(tiempos_kpi).mark_bar().encode(
+                    x=alt.X("cubeta:O", title=f"Minutos (cada {acumulados.ANCHO_CUBETA})"),
+                    y=alt.Y("n:Q", title="Entregadas"),
+                    tooltip=["cubeta:O", "n:Q"],
+                ),
+                use_container_width=True,
+            )
 
-    if not st.session_state.almacen_autenticando:
+    st.markdown("**Tasa de issue por almacenista (cerradas)**")
+    almacenistas_kpi = kpis.por_almacenista()
+    if almacenistas_kpi.empty:
+        st.caption("Todavía no hay requisiciones cerradas con almacenista.")
+    else:
+        st.altair_chart(
+            alt.Chart(almacenistas_kpi).mark_bar().encode(
+                x=alt.X("tasa_issue:Q", title="Con issue", axis=alt.Axis(format="%")),
+                y=alt.Y("almacenista:N", title=None, sort="-x"),
+                tooltip=["almacenista:N", "cerradas:Q", "con_issue:Q", alt.Tooltip("tasa_issue:Q", format=".1%")],
+            ),
+            use_container_width=True,
+        )
 
-        pwd = st.text_input("Ingrese contraseña:", type="password", key="pwd_input")
+    if kpis.ultimo_error:
+        st.caption(f"⚠️ Los indicadores no se pudieron actualizar: {kpis.ultimo_error}")
 
-        if pwd:
-            if pwd == ALMACEN_PASSWORD:
-                st.session_state.almacen_autenticando = True
-                st.rerun()
-            else:
-                st.warning("🚫 Acceso restringido.")
-                st.stop()
-
-        st.stop()
+with tab3:
+    st.markdown("<div class='titulo-seccion'>Indicadores del almacén</div>", unsafe_allow_html=True)
+    # Mismo acceso que el Almacén (hay datos por almacenista); la contraseña se captura allá
+    if st.session_state.get("almacen_autenticando"):
+        tablero_indicadores()
+    else:
+        st.info("🔒 Ingresa la contraseña en la pestaña 📦 Almacén para ver los indicadores.")
 
-    st.success("🔓 Acceso concedido.")
+# ============================================================
+# TAB 2 — PANEL DE ALMACÉN
+# ============================================================
 
-    # ==========================
-    # 🔐 ADMIN: DESCARGA BACKUPS (oculto)
-    # ==========================
+# ==========================
+# 🔐 ADMIN: DESCARGA BACKUPS (oculto)
+# ==========================
 
+@st.fragment
+def panel_admin():
     with st.expander("🛠️ Admin (Backups)", expanded=False):
-        # Lista de backups disponibles
-        backups = sorted(
-            glob.glob(f"{BACKUP_DIR}/requisiciones_backup_*.csv"),
-            reverse=True
-        )
+        # Catálogo de respaldos (solo metadata; los archivos se leen al descargar)
+        catalogo = respaldos.leer_catalogo(BACKUP_DIR)
 
-        if not backups:
+        if catalogo.empty:
             st.info("No hay respaldos todavía.")
         else:
-            st.caption(f"Respaldos encontrados: {len(backups)}")
-
-            # Descargar el más reciente
-            ultimo = backups[0]
-            with open(ultimo, "rb") as f:
-                st.download_button(
-                    label="⬇️ Descargar respaldo MÁS RECIENTE",
-                    data=f.read(),
-                    file_name=os.path.basename(ultimo),
-                    mime="text/csv",
-                    use_container_width=True
-                )
+            st.caption(f"Respaldos encontrados: {len(catalogo)}")
+
+            paginas = operaciones.total_paginas(len(catalogo), operaciones.RESPALDOS_POR_PAGINA)
+            pagina = st.number_input(
+                "Página", min_value=1, max_value=paginas, value=1, step=1, key="pagina_respaldos"
+            )
+            pagina_df = operaciones.pagina_respaldos(catalogo, pagina)
+
+            st.dataframe(pagina_df, hide_index=True, use_container_width=True)
 
-            # (Opcional) elegir uno específico
-            st.markdown("**O elegir un respaldo específico:**")
             seleccionado = st.selectbox(
                 "Selecciona un respaldo",
-                backups,
-                format_func=lambda p: os.path.basename(p)
+                pagina_df["archivo"].tolist(),
+                key="respaldo_seleccionado",
             )
 
-            with open(seleccionado, "rb") as f:
-                st.download_button(
-                    label="⬇️ Descargar respaldo seleccionado",
-                    data=f.read(),
-                    file_name=os.path.basename(seleccionado),
-                    mime="text/csv",
-                    use_container_width=True
-                )
-
-    st.markdown("""
-    <style>
-    input[type="password"] {display:none;}
-    label[for="pwd_input"] {display:none;}
-    </style>
-    """, unsafe_allow_html=True)
+            # Los bytes solo se leen en la ejecución en que se pide la descarga
+            if st.button("📦 Preparar descarga", use_container_width=True):
+                ruta = operaciones.ruta_respaldo(seleccionado, BACKUP_DIR)
+                try:
+                    if ruta is None:
+                        raise FileNotFoundError(seleccionado)
+                    with open(ruta, "rb") as f:
+                        st.download_button(
+                            label=f"⬇️ Descargar {seleccionado}",
+                            data=f,
+                            file_name=seleccionado,
+                            mime=operaciones.mime_respaldo(seleccionado),
+                            use_container_width=True
+                        )
+                except FileNotFoundError:
+                    st.warning("⚠️ Ese respaldo ya no existe (se depuró). Elige otro.")
+
+        if gestor_respaldos.ultimo_error:
+            st.warning(f"⚠️ Último respaldo fallido: {gestor_respaldos.ultimo_error}")
+        if gestor_respaldos.ultimo_error_archivo:
+            st.warning(f"⚠️ Último archivado automático fallido: {gestor_respaldos.ultimo_error_archivo}")
+
+        # Memoria del frame compartido por todas las sesiones
+        st.markdown("**Memoria del frame en cache:**")
+        frame_cache = almacenamiento.obtener_cache(almacen).frame_actual()
+        if frame_cache is None:
+            st.caption("No hay frame en memoria (el motor consulta directo a la base).")
+        else:
+            st.dataframe(almacenamiento.reporte_memoria(frame_cache), hide_index=True, use_container_width=True)
 
+        # Tiempos del almacenamiento (este proceso, desde que arrancó)
+        st.markdown("**Tiempos del almacenamiento:**")
+        duraciones, contadores = metricas.resumen()
+        if not duraciones:
+            st.caption("Todavía no hay operaciones medidas.")
+        else:
+            st.dataframe(pd.DataFrame(duraciones), hide_index=True, use_container_width=True)
+            st.caption(
+                "lock_espera = esperando el lock; lock_retenido = trabajo dentro del lock. "
+                "p50 / p95 / p99 de las últimas mediciones."
+            )
+        if contadores:
+            st.caption(" · ".join(f"{nombre}: {valor}" for nombre, valor in contadores.items()))
+        if st.button("📈 Guardar métricas ahora", use_container_width=True):
+            ruta_json, ruta_prom = metricas.volcar()
+            st.success(f"Métricas guardadas en {ruta_json} y {ruta_prom}")
+
+        # Archivo histórico: cerradas con más de historico.DIAS_ARCHIVO días (también corre solo una vez al día)
+        st.markdown("**Archivo histórico:**")
+        meses = historico.meses_archivados()
+        st.caption(
+            f"Meses archivados: {meses[0]} a {meses[-1]} ({len(meses)})" if meses
+            else "Todavía no hay meses archivados."
+        )
+        if not historico.disponible():
+            st.caption("Falta pyarrow: no se puede archivar.")
+        elif st.button("🗄️ Archivar cerradas ahora", use_container_width=True):
+            archivadas = almacen.archivar()
+            st.success(f"Se archivaron {archivadas} requisiciones cerradas.")
+
+        # Sincronización con Smartsheet (hilo de fondo; solo si hay token y hoja configurados)
+        st.markdown("**Smartsheet:**")
+        if sincronizador is None:
+            st.caption("Sin configurar (SMARTSHEET_TOKEN y SMARTSHEET_SHEET_ID en secrets).")
+        else:
+            estado_sync = sincronizador.resumen()
+            st.caption(
+                f"Sincronizadas: {estado_sync['sincronizadas']} · "
+                f"Pendientes: {estado_sync['pendientes']} · Atascadas: {estado_sync['atascadas']}"
+            )
+            if estado_sync["ultimo_error"]:
+                st.caption(f"Último error: {estado_sync['ultimo_error']}")
+            if estado_sync["atascadas"] and st.button("🔁 Reintentar atascadas", use_container_width=True):
+                sincronizador.reintentar_atascadas()
+                st.success("Se reintentarán en el siguiente ciclo.")
+
+# -------------------------------------------
+# TABLA (filtros + descarga + página) Y EDICIÓN
+# -------------------------------------------
+
+@st.fragment
+def tabla_almacen():
     # Botón refresh
     colR1, colR2 = st.columns([1, 5])
     with colR1:
         if st.button("🔄 Refrescar", use_container_width=True):
-            st.session_state.forzar_recarga = True
-            st.rerun()
+            almacen.refrescar()
+            recargar_seccion()
     with colR2:
-        st.caption("Actualiza la tabla sin recargar toda la página.")
-
-    # Cache
-    if "df_cache" not in st.session_state:
-        st.session_state.df_cache = None
-        st.session_state.last_reload = 0
-
-    TTL = 15
-
-    def cargar_cache():
-        ahora = time.time()
-
-        if (
-            st.session_state.df_cache is None
-            or (ahora - st.session_state.last_reload) > TTL
-            or st.session_state.get("forzar_recarga", False)
-        ):
-            df_nuevo = cargar_desde_csv().fillna("")
-
-            if "min_final" not in df_nuevo.columns:
-                df_nuevo["min_final"] = None
-
-            def normalizar_min_final(x):
-                s = str(x).strip().lower()
-                if s in ["", "none", "nan"]:
-                    return None
-                try:
-                    return int(float(x))
-                except:
-                    return None
-
-            df_nuevo["min_final"] = df_nuevo["min_final"].apply(normalizar_min_final)
-
-            df_nuevo["fecha_hora_dt"] = pd.to_datetime(df_nuevo["fecha_hora"], errors="coerce")
-
-            ahora_local = datetime.utcnow() - timedelta(hours=7)
-
-            minutos = pd.Series(0, index=df_nuevo.index, dtype="int64")
-            mask_valid = df_nuevo["fecha_hora_dt"].notna()
-
-            diffs = ((ahora_local - df_nuevo.loc[mask_valid, "fecha_hora_dt"]).dt.total_seconds() / 60).astype(int)
-            minutos.loc[mask_valid] = diffs.values
-
-            mask_frozen = df_nuevo["min_final"].notna()
-            minutos.loc[mask_frozen] = df_nuevo.loc[mask_frozen, "min_final"].astype(int)
-
-            df_nuevo["minutos"] = minutos
-
-            def semaforo(m):
-                if m >= 35:
-                    return "🔴"
-                if m >= 20:
-                    return "🟡"
-                return "🟢"
-
-            df_nuevo["semaforo"] = df_nuevo["minutos"].apply(semaforo)
-
-            df_nuevo = df_nuevo.sort_values(by="fecha_hora_dt", ascending=False)
-
-            st.session_state.df_cache = df_nuevo
-            st.session_state.last_reload = ahora
-            st.session_state.forzar_recarga = False
-
-        return st.session_state.df_cache.copy()
-
-    df = cargar_cache()
+        st.caption("La tabla se actualiza sola cuando alguien guarda cambios.")
 
     # -------------------------------------------
     # FILTROS
@@ -584,60 +540,89 @@ with tab2:
     if "filtro_issue" not in st.session_state:
         st.session_state.filtro_issue = ["Todos"]
 
-    opciones_issue = ["Todos", "Sí", "No"]
-
     colA, colB, colC = st.columns(3)
 
     with colA:
         st.session_state.filtro_cuarto = st.multiselect(
             "Filtrar por cuarto",
-            df["cuarto"].unique(),
+            almacenamiento.CUARTOS,
             default=st.session_state.filtro_cuarto,
         )
 
     with colB:
         st.session_state.filtro_status = st.multiselect(
             "Filtrar por status",
-            df["status"].unique(),
+            almacenamiento.ESTADOS,
             default=st.session_state.filtro_status,
         )
 
     with colC:
         st.session_state.filtro_issue = st.multiselect(
             "Filtrar por issue",
-            opciones_issue,
+            operaciones.OPCIONES_ISSUE,
             default=st.session_state.filtro_issue,
         )
 
-    df_filtrado = df.copy()
-
-    if st.session_state.filtro_cuarto:
-        df_filtrado = df_filtrado[df_filtrado["cuarto"].isin(st.session_state.filtro_cuarto)]
+    colD, colE, colF, colG = st.columns(4)
+
+    with colD:
+        st.date_input("Desde", value=None, key="filtro_desde")
+    with colE:
+        st.date_input("Hasta", value=None, key="filtro_hasta")
+    with colF:
+        orden = st.selectbox("Ordenar por", almacenamiento.ORDENABLES, key="orden_tabla")
+    with colG:
+        descendente = st.toggle("Descendente", value=True, key="orden_desc")
+
+    incluir_historico = st.checkbox(
+        "Incluir archivo histórico",
+        value=False,
+        key="filtro_historico",
+        help=f"Agrega las requisiciones cerradas con más de {historico.DIAS_ARCHIVO} días. "
+             "Con rango de fechas solo se leen esos meses.",
+    )
 
-    if st.session_state.filtro_status:
-        df_filtrado = df_filtrado[df_filtrado["status"].isin(st.session_state.filtro_status)]
+    # Los filtros se resuelven en el almacenamiento; aquí solo viaja una página
+    filtros = operaciones.armar_filtros(
+        st.session_state.filtro_cuarto,
+        st.session_state.filtro_status,
+        st.session_state.filtro_issue,
+        st.session_state.filtro_desde,
+        st.session_state.filtro_hasta,
+        incluir_historico,
+    )
 
-    f_issue = st.session_state.filtro_issue
-    if "Todos" not in f_issue:
-        if "Sí" in f_issue and "No" not in f_issue:
-            df_filtrado = df_filtrado[df_filtrado["issue"] == True]
-        elif "No" in f_issue and "Sí" not in f_issue:
-            df_filtrado = df_filtrado[df_filtrado["issue"] == False]
+    # Cambiar filtros u orden regresa a la primera página
+    firma_filtros = (repr(filtros), orden, descendente)
+    if st.session_state.get("firma_filtros") != firma_filtros:
+        st.session_state.firma_filtros = firma_filtros
+        st.session_state.pagina_tabla = 1
 
     # -------------------------------------------
-    # DESCARGAR "EXCEL" (CSV) - historial visible (respeta filtros)
+    # DESCARGAR - historial visible (respeta filtros)
+    # Se genera solo al pedirlo y queda en cache por (versión, minuto, filtros);
+    # el archivo solo se lee en la ejecución en que se pide la descarga
     # -------------------------------------------
-    df_export = df_filtrado.drop(columns=["fecha_hora_dt"], errors="ignore").copy()
-
-    csv_bytes = df_to_csv_bytes(df_export)
+    colX1, colX2 = st.columns([1, 2])
+    with colX1:
+        formato_export = st.selectbox("Formato", exportaciones.formatos_disponibles(), key="formato_export")
 
-    st.download_button(
-        label="📥 Descargar Excel",
-        data=csv_bytes,
-        file_name=f"requisiciones_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv",
-        mime="text/csv",
-        use_container_width=True
-    )
+    with colX2:
+        if st.button("📦 Preparar descarga", key="preparar_export", use_container_width=True):
+            try:
+                with st.spinner("Generando archivo..."):
+                    ruta_export = exportaciones.generar(almacen, filtros, orden, descendente, formato_export)
+                with open(ruta_export, "rb") as f:
+                    st.download_button(
+                        label=f"📥 Descargar {formato_export}",
+                        data=f,
+                        file_name=exportaciones.nombre_descarga(formato_export),
+                        mime=exportaciones.mime_de(formato_export),
+                        use_container_width=True
+                    )
+            except FileNotFoundError:
+                # Otra sesión depuró EXPORT_DIR entre generar y abrir
+                st.warning("⚠️ La exportación se borró antes de descargarla. Vuelve a prepararla.")
 
     # -------------------------------------------
     # TABLA PRINCIPAL (solo lectura)
@@ -645,16 +630,40 @@ with tab2:
 
     st.markdown("<div class='subtitulo-seccion'>Requisiciones registradas</div>", unsafe_allow_html=True)
 
-    # Ocultar columnas internas + uuid
-    columnas_ocultas = ["fecha_hora_dt", "min_final", "uuid"]
-    df_visible = df_filtrado.drop(columns=columnas_ocultas, errors="ignore")
+    colP1, colP2 = st.columns([1, 1])
+    with colP1:
+        por_pagina = st.selectbox("Filas por página", operaciones.POR_PAGINA_OPCIONES, index=1, key="por_pagina")
+
+    # Versión de los datos que muestra esta tabla (ver vigilar_cambios)
+    st.session_state.version_vista = vigilante.version()
 
-    st.dataframe(df_visible, hide_index=True, use_container_width=True)
+    # minutos / semaforo dependen solo de la hora: se recalculan en cada render (solo la página)
+    df, total, pagina = operaciones.consultar_pagina(
+        almacen, filtros, orden, descendente, st.session_state.pagina_tabla, por_pagina
+    )
+    # Los datos (o filtros) cambiaron y la página ya no existe
+    st.session_state.pagina_tabla = pagina
+    mostrar_avisos()
+
+    with colP2:
+        st.number_input(
+            "Página", min_value=1, max_value=operaciones.total_paginas(total, por_pagina), step=1, key="pagina_tabla"
+        )
+
+    inicio = (pagina - 1) * por_pagina
+    st.caption(f"Mostrando {min(inicio + 1, total)}–{min(inicio + por_pagina, total)} de {total}")
+
+    st.dataframe(operaciones.para_mostrar(df), hide_index=True, use_container_width=True)
+
+    # La edición usa las filas de esta página; su fragmento se vuelve a pintar con la tabla
+    formulario_edicion(df)
 
-    # ----------------------------------------------
-    # FORMULARIO DE EDICIÓN (por ID, estable)
-    # ----------------------------------------------
+# ----------------------------------------------
+# FORMULARIO DE EDICIÓN (por ID, estable)
+# ----------------------------------------------
 
+@st.fragment
+def formulario_edicion(df):
     st.markdown("<a id='form_anchor'></a>", unsafe_allow_html=True)
 
     if "mostrar_edicion" not in st.session_state:
@@ -680,92 +689,90 @@ with tab2:
     </style>
     """, unsafe_allow_html=True)
 
-    if st.session_state.mostrar_edicion:
-        with form_container:
+    if not st.session_state.mostrar_edicion:
+        return
+
+    with form_container:
+
+        # IDs de la página visible (en el orden de la tabla)
+        lista_ids = df["ID"].astype(str).unique().tolist()
+
+        lista_ids_con_vacio = ["-- Seleccione --"] + lista_ids
+        id_editar = st.selectbox("Seleccione ID a editar:", lista_ids_con_vacio)
+
+        if id_editar == "-- Seleccione --":
+            return
+
+        fila = df[df["ID"].astype(str) == str(id_editar)].iloc[0]
 
-            # Lista de IDs en orden (más recientes primero)
-            df_ids = df.copy() if "df" in locals() else df_filtrado.copy()
-            if "fecha_hora_dt" in df_ids.columns:
-                df_ids = df_ids.sort_values(by="fecha_hora_dt", ascending=False)
-            lista_ids = df_ids["ID"].astype(str).unique().tolist()
+        nuevo_status = st.selectbox(
+            "Nuevo status:",
+            almacenamiento.ESTADOS,
+            index=almacenamiento.ESTADOS.index(str(fila["status"])),
+        )
 
-            lista_ids_con_vacio = ["-- Seleccione --"] + lista_ids
-            id_editar = st.selectbox("Seleccione ID a editar:", lista_ids_con_vacio)
+        nuevo_almacenista = st.text_input("Almacenista:", str(fila.get("almacenista", "")))
+        nuevo_issue = st.checkbox("Issue", value=(fila.get("issue", False) is True))
 
-            if id_editar != "-- Seleccione --":
-                fila = df_ids[df_ids["ID"].astype(str) == str(id_editar)].iloc[0]
+        if st.button("Guardar cambios"):
 
-                nuevo_status = st.selectbox(
-                    "Nuevo status:",
-                    ["Pendiente", "En proceso", "Entregado", "Cancelado", "No encontrado"],
-                    index=["Pendiente", "En proceso", "Entregado", "Cancelado", "No encontrado"].index(str(fila["status"])),
+            try:
+                encontrado = operaciones.editar(
+                    almacen, fila, id_editar, nuevo_status, nuevo_almacenista, nuevo_issue
                 )
+                mostrar_avisos()
+
+                if not encontrado:
+                    st.error("No encontré ese ID en el CSV.")
+                    return
+
+                st.success("✅ Cambios guardados correctamente.")
+
+                # Cerrar editor + recargar la tabla (la única vez que se vuelve a pintar todo)
+                st.session_state.mostrar_edicion = False
+                st.rerun()
+
+            except Exception as e:
+                st.error("❌ Error al guardar cambios.")
+                st.write(e)
+
+with tab2:
+
+    st.markdown("<div class='titulo-seccion'>Panel de Almacén</div>", unsafe_allow_html=True)
+
+    if "almacen_autenticando" not in st.session_state:
+        st.session_state.almacen_autenticando = False
+
+    if not st.session_state.almacen_autenticando:
+
+        pwd = st.text_input("Ingrese contraseña:", type="password", key="pwd_input")
+
+        if pwd:
+            if pwd == ALMACEN_PASSWORD:
+                st.session_state.almacen_autenticando = True
+                st.rerun()
+            else:
+                st.warning("🚫 Acceso restringido.")
+                st.stop()
+
+        st.stop()
+
+    st.success("🔓 Acceso concedido.")
+
+    # Versión de los datos que muestra este render (la tabla la actualiza al repintarse sola)
+    st.session_state.version_vista = vigilante.version()
+    vigilar_cambios()
+    panel_admin()
+
+    st.markdown("""
+    <style>
+    input[type="password"] {display:none;}
+    label[for="pwd_input"] {display:none;}
+    </style>
+    """, unsafe_allow_html=True)
+
+    tabla_almacen()
 
-                nuevo_almacenista = st.text_input("Almacenista:", str(fila.get("almacenista", "")))
-                nuevo_issue = st.checkbox("Issue", value=(fila.get("issue", False) is True))
-
-                if st.button("Guardar cambios"):
-
-                    try:
-                        with FileLock(LOCK_PATH, timeout=10):
-                            df_all = _read_csv_seguro()
-
-                            # Garantizar columnas
-                            for c in COLUMNAS_BASE:
-                                if c not in df_all.columns:
-                                    df_all[c] = "" if c != "issue" else False
-
-                            # Normalizar issue
-                            df_all["issue"] = df_all["issue"].astype(str).str.lower().isin(["true", "1", "yes", "si", "sí"])
-
-                            # Encontrar fila por uuid si existe, si no por ID
-                            uuid_val = str(fila.get("uuid", "")).strip() if "uuid" in fila.index else ""
-                            if uuid_val and "uuid" in df_all.columns:
-                                idx = df_all.index[df_all["uuid"].astype(str) == uuid_val]
-                            else:
-                                idx = df_all.index[df_all["ID"].astype(str) == str(id_editar)]
-
-                            if len(idx) == 0:
-                                st.error("No encontré ese ID en el CSV.")
-                                st.stop()
-
-                            j = idx[0]
-
-                            # min_final: congelar si status final
-                            estados_finales = ["Entregado", "Cancelado", "No encontrado"]
-                            if nuevo_status in estados_finales:
-                                min_final_actual = str(df_all.loc[j, "min_final"]).strip()
-                                if min_final_actual in ["", "None", "nan"]:
-                                    fecha_dt = pd.to_datetime(df_all.loc[j, "fecha_hora"], errors="coerce")
-                                    if pd.notna(fecha_dt):
-                                        ahora_local = datetime.utcnow() - timedelta(hours=7)
-                                        df_all.loc[j, "min_final"] = str(int((ahora_local - fecha_dt).total_seconds() / 60))
-                            else:
-                                df_all.loc[j, "min_final"] = ""
-
-                            # Aplicar cambios
-                            df_all.loc[j, "status"] = nuevo_status
-                            df_all.loc[j, "almacenista"] = str(nuevo_almacenista).strip()
-                            df_all.loc[j, "issue"] = bool(nuevo_issue)
-
-                            # Guardado atómico
-                            crear_backup_csv("pre_edicion")
-                            
-                            tmp_path = CSV_PATH + ".tmp"
-                            df_all.to_csv(tmp_path, index=False, encoding="utf-8-sig")
-                            os.replace(tmp_path, CSV_PATH)
-
-                        st.success("✅ Cambios guardados correctamente.")
-
-                        # Cerrar editor + recargar
-                        st.session_state.mostrar_edicion = False
-                        st.session_state.forzar_recarga = True
-                        st.rerun()
-
-                    except Exception as e:
-                        st.error("❌ Error al guardar cambios.")
-                        st.write(e)
-                    
 # ============================================
 # 🔒 EVITAR QUE STREAMLIT SUBA EL SCROLL AL EDITAR
 # ============================================
@@ -795,13 +802,3 @@ observer.observe(document.body, { childList: true, subtree: true });
 window.addEventListener('load', restoreScroll);
 </script>
 """, unsafe_allow_html=True)
-
-
-
-
-
-
-
-
-
-
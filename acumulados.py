@@ -0,0 +1,393 @@
+"""
+Indicadores pre-agregados para el tablero (KPIs de servicio del almacén).
+
+Un hilo por proceso toma los cambios del almacén con la recarga
+incremental (altas y cambios de status) y actualiza tablas de conteos en
+SQLite (ACUMULADOS_DIR): volumen por cuarto y hora, requisiciones por
+status, entregas por día de entrega (fecha_hora + min_final, que se
+congela al entregar) con su semáforo y tiempos, y cerradas / con issue
+por almacenista. Para cada uuid se guarda con qué contribuyó la
+última vez: una edición resta lo anterior y suma lo nuevo, así que el
+costo es por cambio y no por tamaño del historial.
+
+El tablero solo lee estas tablas (acotadas por ventana de tiempo) y las
+requisiciones abiertas, que son pocas; su semáforo depende de la hora
+actual y se calcula al pintar. Si el almacén se reescribe completo
+(compactación, archivo, importación de respaldo) los acumulados se
+recalculan desde cero en segundo plano. Lo que ya está en el archivo
+histórico no cuenta.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from filelock import FileLock, Timeout
+
+import metricas
+from almacenamiento import ESTADOS_FINALES, hora_local, obtener_vigilante
+from indicadores import UMBRAL_AMARILLO, UMBRAL_ROJO, calcular_minutos, calcular_semaforo
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+ACUMULADOS_DIR = "data/acumulados"
+INTERVALO_REVISION = 60          # segundos; también despierta con cada cambio
+ANCHO_CUBETA = 5                 # minutos por barra del histograma de entrega
+MAX_CUBETA = 240                 # 4 h o más van en la última barra
+
+# Se sube cuando cambia lo que se acumula: las tablas se tiran y se recalculan
+VERSION_ESQUEMA = 2
+
+# tabla -> (llaves, medidas). Las medidas son conteos / sumas que se pueden restar.
+AGREGADOS = {
+    "volumen": (["hora", "cuarto"], ["altas"]),
+    "estados": (["status"], ["n"]),
+    "entregas": (["dia", "cuarto"], ["n", "suma_min", "verde", "amarillo", "rojo"]),
+    "tiempos": (["cubeta"], ["n"]),
+    "almacenistas": (["almacenista"], ["cerradas", "con_issue"]),
+}
+
+def _esquema():
+    tablas = [
+        f"CREATE TABLE IF NOT EXISTS {tabla} ("
+        + ", ".join([f"{c} TEXT NOT NULL" if c != "cubeta" else f"{c} INTEGER NOT NULL" for c in llaves]
+                    + [f"{m} INTEGER NOT NULL DEFAULT 0" for m in medidas])
+        + f", PRIMARY KEY ({', '.join(llaves)}));"
+        for tabla, (llaves, medidas) in AGREGADOS.items()
+    ]
+    return "\n".join(tablas) + """
+CREATE TABLE IF NOT EXISTS contribuciones (
+    uuid TEXT PRIMARY KEY,
+    hora TEXT NOT NULL,
+    cuarto TEXT NOT NULL,
+    almacenista TEXT NOT NULL,
+    status TEXT NOT NULL,
+    issue INTEGER NOT NULL,
+    min_final INTEGER,
+    dia_entrega TEXT NOT NULL DEFAULT ''
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS abiertas (
+    uuid TEXT PRIMARY KEY,
+    fecha_hora TEXT NOT NULL,
+    cuarto TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS estado (
+    nombre TEXT PRIMARY KEY,
+    valor TEXT NOT NULL
+);
+"""
+
+# ==========================
+# CONTRIBUCIÓN POR FILA
+# ==========================
+
+_COLUMNAS_CONTRIBUCION = ["uuid", "hora", "cuarto", "almacenista", "status", "issue", "min_final", "dia_entrega"]
+
+def contribuciones(df):
+    """
+    Lo que aporta cada requisición a los acumulados (una fila por uuid).
+    """
+    fechas = df["fecha_hora_dt"] if "fecha_hora_dt" in df.columns else pd.to_datetime(df["fecha_hora"], errors="coerce")
+    # strftime solo de las horas distintas (unos miles), no de cada fila
+    codigos, horas = pd.factorize(fechas.dt.floor("h"))
+    hora = np.append(horas.strftime("%Y-%m-%d %H:00").to_numpy(dtype=object), "")[codigos]
+    issue = df["issue"]
+    if issue.dtype != bool:
+        issue = issue.astype(str).str.lower().isin(["true", "1", "yes", "si", "sí"])
+    min_final = np.trunc(pd.to_numeric(df["min_final"], errors="coerce")).astype("Int64")
+    # min_final se congela al cerrar: fecha_hora + min_final es el momento de la entrega
+    entrega = (fechas + pd.to_timedelta(min_final.astype("float64"), unit="min")).dt.normalize()
+    codigos, dias = pd.factorize(entrega)
+    dia_entrega = np.append(dias.strftime("%Y-%m-%d").to_numpy(dtype=object), "")[codigos]
+    return pd.DataFrame({
+        "uuid": df["uuid"].astype(str).to_numpy(),
+        "hora": hora,
+        "cuarto": df["cuarto"].astype(str).to_numpy(),
+        "almacenista": df["almacenista"].astype(str).str.strip().to_numpy(),
+        "status": df["status"].astype(str).to_numpy(),
+        "issue": issue.astype(int).to_numpy(),
+        "min_final": min_final.to_numpy(),
+        "dia_entrega": dia_entrega,
+    })
+
+def _deltas(c):
+    """
+    Filas a sumar en cada tabla a partir de contribuciones con columna
+    `signo` (+1 lo nuevo, -1 lo que se reemplaza). Todo con groupby.
+    """
+    signo = c["signo"]
+    yield "volumen", c.assign(altas=signo).groupby(["hora", "cuarto"], as_index=False)[["altas"]].sum()
+    yield "estados", c.assign(n=signo).groupby(["status"], as_index=False)[["n"]].sum()
+
+    entregadas = c[c["status"].eq("Entregado") & c["min_final"].notna() & c["dia_entrega"].ne("")]
+    minutos = entregadas["min_final"].astype("int64")
+    entregas = entregadas.assign(
+        dia=entregadas["dia_entrega"],
+        n=entregadas["signo"],
+        suma_min=minutos * entregadas["signo"],
+        verde=(minutos < UMBRAL_AMARILLO) * entregadas["signo"],
+        amarillo=((minutos >= UMBRAL_AMARILLO) & (minutos < UMBRAL_ROJO)) * entregadas["signo"],
+        rojo=(minutos >= UMBRAL_ROJO) * entregadas["signo"],
+        cubeta=np.minimum(minutos // ANCHO_CUBETA * ANCHO_CUBETA, MAX_CUBETA),
+    )
+    yield "entregas", entregas.groupby(["dia", "cuarto"], as_index=False)[AGREGADOS["entregas"][1]].sum()
+    yield "tiempos", entregas.groupby(["cubeta"], as_index=False)[["n"]].sum()
+
+    cerradas = c[c["status"].isin(ESTADOS_FINALES) & c["almacenista"].ne("")]
+    yield "almacenistas", cerradas.assign(
+        cerradas=cerradas["signo"], con_issue=cerradas["issue"] * cerradas["signo"]
+    ).groupby(["almacenista"], as_index=False)[["cerradas", "con_issue"]].sum()
+
+def _filas_sql(df, columnas):
+    # Por columna con tolist() (tipos de Python) y <NA> -> NULL; sin recorrer celda por celda
+    valores = []
+    for c in columnas:
+        serie = df[c]
+        if serie.hasnans:
+            serie = serie.astype(object).where(serie.notna(), None)
+        valores.append(serie.tolist())
+    return list(zip(*valores))
+
+def _estado_de_json(valor):
+    # Las firmas de archivo del motor CSV son tuplas; JSON las regresa como listas
+    if isinstance(valor, list):
+        return tuple(_estado_de_json(v) for v in valor)
+    if isinstance(valor, dict):
+        return {k: _estado_de_json(v) for k, v in valor.items()}
+    return valor
+
+# ============================================================
+# ALMACÉN DE ACUMULADOS
+# ============================================================
+
+class AcumuladosKPI:
+    """
+    Tablas de acumulados de un almacén y el hilo que las mantiene al día.
+    El estado de la recarga incremental se guarda junto con las tablas
+    (misma transacción), así cualquier proceso retoma desde ahí.
+    """
+
+    def __init__(self, almacen, acumulados_dir=ACUMULADOS_DIR):
+        self.almacen = almacen
+        self.acumulados_dir = acumulados_dir
+        self.db_path = os.path.join(acumulados_dir, f"kpis_{almacen.nombre}.sqlite")
+        self._hilo = None
+        self._lock_hilo = threading.Lock()
+        self.ultimo_error = None
+
+        os.makedirs(acumulados_dir, exist_ok=True)
+        with FileLock(self.db_path + ".init.lock", timeout=30):
+            conn = self._conn()
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] != VERSION_ESQUEMA:
+                    # Sin estado de recarga la siguiente actualización recalcula todo
+                    for tabla in list(AGREGADOS) + ["contribuciones", "abiertas", "estado"]:
+                        conn.execute(f"DROP TABLE IF EXISTS {tabla}")
+                    conn.execute(f"PRAGMA user_version = {VERSION_ESQUEMA}")
+                conn.executescript(_esquema())
+            finally:
+                conn.close()
+
+    def _conn(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def iniciar(self):
+        with self._lock_hilo:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ciclo, name="acumulados-kpi", daemon=True)
+                self._hilo.start()
+        return self
+
+    def _ciclo(self):
+        vigilante = obtener_vigilante(self.almacen)
+        version = None
+        while True:
+            try:
+                self.actualizar()
+                self.ultimo_error = None
+            except Exception as e:
+                # Se reintenta con el siguiente cambio; el tablero muestra el error
+                self.ultimo_error = str(e)
+            version = vigilante.esperar_cambio(version, INTERVALO_REVISION)
+
+    # --------------------------
+    # Actualización
+    # --------------------------
+
+    def actualizar(self):
+        """
+        Aplica los cambios desde la última vez. Solo un proceso a la vez
+        (los demás lo omiten). Regresa cuántas filas cambiaron, o None si
+        otro proceso lo está haciendo.
+        """
+        try:
+            with FileLock(os.path.join(self.acumulados_dir, ".acumulados.lock"), timeout=0):
+                return self._actualizar()
+        except Timeout:
+            return None
+
+    @metricas.cronometrado("kpis.actualizar")
+    def _actualizar(self):
+        conn = self._conn()
+        try:
+            fila = conn.execute("SELECT valor FROM estado WHERE nombre = 'recarga'").fetchone()
+            estado = _estado_de_json(json.loads(fila[0])) if fila else None
+
+            df, estado_nuevo, es_delta = self.almacen.cargar_cambios(estado)
+            nuevas = contribuciones(df[df["uuid"].astype(str).ne("")])
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if es_delta:
+                    previas = self._contribuciones_previas(conn, nuevas["uuid"].tolist())
+                else:
+                    for tabla in list(AGREGADOS) + ["contribuciones", "abiertas"]:
+                        conn.execute(f"DELETE FROM {tabla}")
+                    previas = nuevas.iloc[:0]
+
+                self._aplicar(conn, previas, nuevas)
+                self._abiertas(conn, df, es_delta)
+                conn.execute(
+                    "INSERT OR REPLACE INTO estado (nombre, valor) VALUES ('recarga', ?)",
+                    (json.dumps(estado_nuevo),),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        return len(nuevas)
+
+    @staticmethod
+    def _contribuciones_previas(conn, uuids):
+        partes = []
+        for i in range(0, len(uuids), 500):
+            bloque = uuids[i:i + 500]
+            partes.append(pd.read_sql_query(
+                f"SELECT {', '.join(_COLUMNAS_CONTRIBUCION)} FROM contribuciones "
+                f"WHERE uuid IN ({', '.join('?' for _ in bloque)})",
+                conn, params=bloque,
+            ))
+        if not partes:
+            return pd.DataFrame(columns=_COLUMNAS_CONTRIBUCION)
+        previas = pd.concat(partes, ignore_index=True)
+        previas["min_final"] = previas["min_final"].astype("Int64")
+        return previas
+
+    @staticmethod
+    def _aplicar(conn, previas, nuevas):
+        c = pd.concat(
+            [previas.assign(signo=-1), nuevas.assign(signo=1)], ignore_index=True
+        )
+        if c.empty:
+            return
+        c["issue"] = c["issue"].astype(int)
+        c["min_final"] = c["min_final"].astype("Int64")
+
+        for tabla, filas in _deltas(c):
+            llaves, medidas = AGREGADOS[tabla]
+            filas = filas[(filas[medidas] != 0).any(axis=1)]
+            if filas.empty:
+                continue
+            conn.executemany(
+                f"INSERT INTO {tabla} ({', '.join(llaves + medidas)}) "
+                f"VALUES ({', '.join('?' for _ in llaves + medidas)}) "
+                f"ON CONFLICT({', '.join(llaves)}) DO UPDATE SET "
+                + ", ".join(f"{m} = {m} + excluded.{m}" for m in medidas),
+                _filas_sql(filas, llaves + medidas),
+            )
+            conn.execute(f"DELETE FROM {tabla} WHERE {' AND '.join(f'{m} = 0' for m in medidas)}")
+
+        conn.executemany(
+            f"INSERT OR REPLACE INTO contribuciones ({', '.join(_COLUMNAS_CONTRIBUCION)}) "
+            f"VALUES ({', '.join('?' for _ in _COLUMNAS_CONTRIBUCION)})",
+            # En orden de llave el B-tree se llena por el final (la mitad de tiempo en una recarga completa)
+            _filas_sql(nuevas.sort_values("uuid"), _COLUMNAS_CONTRIBUCION),
+        )
+
+    @staticmethod
+    def _abiertas(conn, df, es_delta):
+        # Solo las abiertas: su semáforo depende de la hora y se calcula al pintar
+        df = df[df["uuid"].astype(str).ne("")]
+        if es_delta:
+            conn.executemany("DELETE FROM abiertas WHERE uuid = ?", [(u,) for u in df["uuid"].astype(str)])
+        abiertas = df[~df["status"].isin(ESTADOS_FINALES)]
+        conn.executemany(
+            "INSERT OR REPLACE INTO abiertas (uuid, fecha_hora, cuarto, status) VALUES (?, ?, ?, ?)",
+            _filas_sql(abiertas.astype({c: str for c in ["uuid", "fecha_hora", "cuarto", "status"]}),
+                       ["uuid", "fecha_hora", "cuarto", "status"]),
+        )
+
+    # --------------------------
+    # Lectura para el tablero
+    # --------------------------
+
+    def _leer(self, sql, params=()):
+        conn = self._conn()
+        try:
+            return pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+
+    def volumen_por_hora(self, horas=48, ahora=None):
+        desde = ((ahora or hora_local()) - timedelta(hours=horas)).strftime("%Y-%m-%d %H:00")
+        df = self._leer("SELECT hora, cuarto, altas FROM volumen WHERE hora >= ? ORDER BY hora", (desde,))
+        df["hora"] = pd.to_datetime(df["hora"])
+        return df
+
+    def entregas_por_dia(self, dias=30, ahora=None):
+        desde = ((ahora or hora_local()) - timedelta(days=dias)).strftime("%Y-%m-%d")
+        df = self._leer(
+            "SELECT dia, SUM(n) AS entregadas, SUM(suma_min) AS suma_min, SUM(verde) AS verde, "
+            "SUM(amarillo) AS amarillo, SUM(rojo) AS rojo FROM entregas WHERE dia >= ? "
+            "GROUP BY dia ORDER BY dia",
+            (desde,),
+        )
+        df["promedio_min"] = (df["suma_min"] / df["entregadas"].where(df["entregadas"] > 0)).round(1)
+        df["dia"] = pd.to_datetime(df["dia"])
+        return df
+
+    def tiempos_entrega(self):
+        return self._leer("SELECT cubeta, n FROM tiempos ORDER BY cubeta")
+
+    def por_status(self):
+        return self._leer("SELECT status, n FROM estados ORDER BY n DESC")
+
+    def por_almacenista(self):
+        df = self._leer("SELECT almacenista, cerradas, con_issue FROM almacenistas ORDER BY cerradas DESC")
+        df["tasa_issue"] = (df["con_issue"] / df["cerradas"].where(df["cerradas"] > 0)).fillna(0.0)
+        return df
+
+    def semaforo_abiertas(self, ahora=None):
+        """
+        Conteo 🟢 / 🟡 / 🔴 de las abiertas a la hora `ahora`.
+        """
+        df = self._leer("SELECT fecha_hora, cuarto, status FROM abiertas")
+        minutos = calcular_minutos(
+            pd.to_datetime(df["fecha_hora"], errors="coerce"), pd.Series([pd.NA] * len(df), dtype="Int64"), ahora
+        )
+        conteo = pd.Series(calcular_semaforo(minutos)).value_counts()
+        return {color: int(conteo.get(color, 0)) for color in ["🟢", "🟡", "🔴"]}
+
+_acumulados = {}
+_acumulados_lock = threading.Lock()
+
+def obtener_acumulados(almacen):
+    """
+    Acumulados únicos por proceso para el almacén (arranca su hilo la primera vez).
+    """
+    with _acumulados_lock:
+        if almacen.nombre not in _acumulados:
+            _acumulados[almacen.nombre] = AcumuladosKPI(almacen).iniciar()
+        return _acumulados[almacen.nombre]
@@ -0,0 +1,2416 @@
+"""
+Capa de almacenamiento de requisiciones.
+
+Dos motores intercambiables con la misma interfaz:
+- AlmacenCSV: CSV ordenado + journal append-only (modo original).
+- AlmacenSQLite: base embebida en modo WAL con índices; el CSV queda
+  como formato de exportación / importación.
+
+No depende de Streamlit; los avisos para el usuario se acumulan y la
+app los muestra con tomar_avisos().
+"""
+
+import os
+import io
+import csv
+import json
+import contextlib
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from pandas.errors import ParserError
+from filelock import FileLock, Timeout
+
+import historico
+import metricas
+
+# ============================================================
+# CONFIGURACIÓN GENERAL
+# ============================================================
+
+CSV_PATH = "data/requisiciones.csv"
+SQLITE_PATH = "data/requisiciones.sqlite"
+BACKUP_DIR = "data/backups"
+
+# Modo append-only: cada alta se anexa al journal (1 línea + fsync) y
+# la compactación lo integra al CSV ordenado cada JOURNAL_MAX_REGISTROS.
+USAR_JOURNAL = True
+JOURNAL_MAX_REGISTROS = 500
+
+# Cola de escritura (group commit): un hilo por almacén junta las altas /
+# ediciones que llegan mientras se guarda el lote anterior y las escribe
+# juntas. Con False cada llamada escribe sola en el hilo que la hace.
+ESCRITURA_EN_GRUPO = True
+MAX_LOTE = 200
+
+# Cada cuántos segundos se revisa si los datos cambiaron (ver VigilanteCambios)
+INTERVALO_VIGILANCIA = 1.0
+
+COLUMNAS_BASE = [
+    "ID", "uuid", "fecha_hora", "cuarto", "work_order", "numero_parte", "numero_lote",
+    "cantidad", "motivo", "status", "almacenista", "issue", "min_final"
+]
+
+ESTADOS = ["Pendiente", "En proceso", "Entregado", "Cancelado", "No encontrado"]
+ESTADOS_FINALES = ["Entregado", "Cancelado", "No encontrado"]
+
+CUARTOS = [
+    "INTRODUCER","PU1","PU2","PU3","PU4","PVC1","PVC2","PVC3A","PVC3B",
+    "PVC6","PVC7","PVC8","PVC9","PVCS","PAK1","MGLY","MASM1","MMCL",
+    "MM MOLD","MMFP","MIXING","RESORTES"
+]
+MOTIVOS = ["Proceso","Extra","Scrap","Navajas","Tooling"]
+
+# Cada fila del CSV principal termina con el CRC32 del resto de la línea
+COLUMNA_CRC = "crc"
+FILAS_POR_BLOQUE = 100_000       # filas por bloque al escribir el CSV
+# Si más de esta fracción de registros no cuadra (y son al menos
+# MIN_DANADOS_MASIVO) no es daño de unas líneas sino otro formato (p. ej. el
+# CSV se abrió y guardó en Excel): no se aparta nada, se vuelve a firmar
+MAX_FRACCION_DANADA = 0.1
+MIN_DANADOS_MASIVO = 20
+
+# Columnas por las que se puede ordenar una consulta
+ORDENABLES = ["fecha_hora", "ID", "cuarto", "status", "cantidad"]
+
+# ==========================
+# AVISOS PARA LA UI
+# ==========================
+
+_avisos = []
+_avisos_lock = threading.Lock()
+
+def _avisar(mensaje):
+    with _avisos_lock:
+        _avisos.append(mensaje)
+
+def tomar_avisos():
+    """
+    Regresa y limpia los avisos pendientes (respaldo fallido, CSV dañado...).
+    """
+    with _avisos_lock:
+        pendientes = list(_avisos)
+        _avisos.clear()
+    return pendientes
+
+# ==========================
+# UTILIDADES COMUNES
+# ==========================
+
+def asegurar_directorio(ruta):
+    carpeta = os.path.dirname(ruta)
+    if carpeta and not os.path.exists(carpeta):
+        os.makedirs(carpeta, exist_ok=True)
+
+def hora_local():
+    # Hora local (UTC-7)
+    return datetime.utcnow() - timedelta(hours=7)
+
+def completar_uuids(df):
+    """
+    Asigna uuid a filas antiguas que no lo tenían, para que toda fila
+    tenga una llave estable (ediciones y recargas incrementales).
+    """
+    if "uuid" not in df.columns:
+        df["uuid"] = ""
+    faltantes = df["uuid"].astype(str).str.strip().isin(["", "nan", "None"])
+    if faltantes.any():
+        df.loc[faltantes, "uuid"] = [str(uuid.uuid4()) for _ in range(int(faltantes.sum()))]
+    return df
+
+def asegurar_columnas(df):
+    for c in COLUMNAS_BASE:
+        if c not in df.columns:
+            df[c] = "" if c not in ["issue"] else False
+    return df
+
+def normalizar(df):
+    """
+    Tipos que espera la app: issue bool, cantidad int y fecha_hora_dt.
+    """
+    if "issue" in df.columns:
+        df["issue"] = df["issue"].astype(str).str.lower().isin(["true", "1", "yes", "si", "sí"])
+
+    if "cantidad" in df.columns:
+        df["cantidad"] = pd.to_numeric(df["cantidad"], errors="coerce").fillna(0).astype(int)
+
+    # fecha_hora_dt para orden y cálculo
+    df["fecha_hora_dt"] = pd.to_datetime(df.get("fecha_hora", ""), errors="coerce")
+
+    return asegurar_columnas(df)
+
+def calcular_min_final(status, fecha_hora, min_final_actual):
+    """
+    min_final: se congela al pasar a un status final y se limpia si se reabre.
+    """
+    if status in ESTADOS_FINALES:
+        actual = str(min_final_actual).strip()
+        if actual in ["", "None", "nan"]:
+            fecha_dt = pd.to_datetime(fecha_hora, errors="coerce")
+            if pd.notna(fecha_dt):
+                return str(int((hora_local() - fecha_dt).total_seconds() / 60))
+            return ""
+        return actual
+    return ""
+
+def formatear_folio(n):
+    # REQ-00001...
+    return f"REQ-{n:05d}"
+
+def max_folio(df):
+    """
+    Mayor número REQ-xxxx en el df. Recorre todo: solo se usa para
+    inicializar / resincronizar la secuencia, nunca en cada alta.
+    """
+    if "ID" not in df.columns or df.empty:
+        return 0
+    nums = pd.to_numeric(
+        df["ID"].astype(str).str.extract(r"^REQ-(\d+)$", expand=False), errors="coerce"
+    )
+    return int(nums.max()) if nums.notna().any() else 0
+
+def siguiente_id(df):
+    return formatear_folio(max_folio(df) + 1)
+
+def _firma(ruta):
+    try:
+        st_archivo = os.stat(ruta)
+    except FileNotFoundError:
+        return None
+    return (st_archivo.st_ino, st_archivo.st_mtime_ns, st_archivo.st_size)
+
+def leer_generacion(ruta):
+    """
+    Contador de generación que cada escritor incrementa al cambiar datos.
+    Leerlo cuesta una lectura de pocos bytes.
+    """
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def escribir_generacion(ruta, valor):
+    asegurar_directorio(ruta)
+    tmp_path = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(valor))
+    os.replace(tmp_path, ruta)
+
+# ==========================
+# CONSULTAS (FILTROS + PÁGINA)
+# ==========================
+
+def filtrar_frame(df, filtros=None):
+    """
+    Aplica a un frame ya normalizado los mismos filtros que las consultas SQL:
+    cuartos, estados, issue (True / False / None) y rango desde / hasta (date).
+    """
+    filtros = filtros or {}
+    mask = pd.Series(True, index=df.index)
+
+    if filtros.get("cuartos"):
+        mask &= _en_valores(df["cuarto"], filtros["cuartos"])
+    if filtros.get("estados"):
+        mask &= _en_valores(df["status"], filtros["estados"])
+    if filtros.get("issue") is not None:
+        mask &= df["issue"] == bool(filtros["issue"])
+    if filtros.get("desde"):
+        mask &= df["fecha_hora_dt"] >= pd.Timestamp(filtros["desde"])
+    if filtros.get("hasta"):
+        mask &= df["fecha_hora_dt"] < pd.Timestamp(filtros["hasta"]) + pd.Timedelta(days=1)
+
+    return df[mask]
+
+def _en_valores(serie, valores):
+    # En columnas categóricas compara códigos enteros en lugar de textos
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        codigos = serie.cat.categories.get_indexer(list(valores))
+        return np.isin(serie.cat.codes.to_numpy(), codigos[codigos >= 0])
+    return serie.isin(valores)
+
+def paginar(df, orden="fecha_hora", descendente=True, pagina=1, por_pagina=50):
+    """
+    Ordena y recorta un frame filtrado. por_pagina=None regresa todo.
+    El frame base ya viene por fecha desc, así que ese caso no reordena.
+    """
+    if orden not in ORDENABLES:
+        raise ValueError(f"No se puede ordenar por {orden}")
+
+    if orden != "fecha_hora" or not descendente:
+        columna = "fecha_hora_dt" if orden == "fecha_hora" else orden
+        # Categóricas se ordenan por texto (igual que SQLite), no por orden de categoría
+        llave = (lambda s: s.astype(str)) if isinstance(df[columna].dtype, pd.CategoricalDtype) else None
+        df = df.sort_values(by=columna, ascending=not descendente, kind="stable", key=llave)
+
+    if por_pagina:
+        inicio = (max(int(pagina), 1) - 1) * por_pagina
+        df = df.iloc[inicio: inicio + por_pagina]
+    return df
+
+# ==========================
+# REGISTROS CON CRC
+# ==========================
+
+def crc_registro(cuerpo):
+    """
+    CRC32 (8 hex, bytes) de un registro sin el campo crc ni el salto de línea.
+    """
+    return b"%08x" % zlib.crc32(cuerpo)
+
+def _unir_comillas(lineas):
+    # Un campo entre comillas puede traer saltos de línea: se une hasta cerrar las comillas
+    registros, pendiente = [], None
+    for linea in lineas:
+        pendiente = linea if pendiente is None else pendiente + "\n" + linea
+        if pendiente.count('"') % 2 == 0:
+            registros.append(pendiente)
+            pendiente = None
+    if pendiente is not None:
+        registros.append(pendiente)
+    return registros
+
+def escribir_csv_con_crc(df, f):
+    """
+    Escribe df en `f` (texto, newline="") con la columna crc al final de
+    cada registro. Por bloques de FILAS_POR_BLOQUE: nunca todo el CSV
+    como un solo string.
+    """
+    f.write(",".join(list(df.columns) + [COLUMNA_CRC]) + "\n")
+    for inicio in range(0, len(df), FILAS_POR_BLOQUE):
+        texto = df.iloc[inicio: inicio + FILAS_POR_BLOQUE].to_csv(index=False, header=False, lineterminator="\n")
+        lineas = texto.split("\n")[:-1]
+        if '"' in texto:
+            lineas = _unir_comillas(lineas)
+        f.write("".join(
+            f"{linea},{crc_registro(linea.encode('utf-8')).decode('ascii')}\n" for linea in lineas
+        ))
+
+def _registros(datos, desde):
+    """
+    Registros (bytes, sin salto de línea) de datos[desde:], sin líneas vacías.
+    Solo se busca el fin de registro fuera de comillas si hay comillas.
+    """
+    if b'"' not in datos:
+        lineas = datos[desde:].split(b"\n")
+    else:
+        arr = np.frombuffer(datos, dtype=np.uint8)
+        saltos = np.flatnonzero(arr == ord("\n"))
+        comillas = np.flatnonzero(arr == ord('"'))
+        fines = saltos[(saltos >= desde) & (np.searchsorted(comillas, saltos) % 2 == 0)].tolist()
+        inicios = [desde] + [fin + 1 for fin in fines]
+        lineas = [datos[a:b] for a, b in zip(inicios, fines + [len(datos)])]
+
+    if b"\r" in datos:
+        lineas = [linea.rstrip(b"\r") for linea in lineas]
+    return [linea for linea in lineas if linea]
+
+def _danados_por_crc(registros):
+    # Camino rápido: CRC calculados vs. los 8 hex del final de cada registro, comparados con numpy
+    calculados = np.fromiter((zlib.crc32(r[:-9]) for r in registros), dtype=np.uint32, count=len(registros))
+    try:
+        esperados = np.frombuffer(bytes.fromhex(b"".join([r[-8:] for r in registros]).decode("ascii")), dtype=">u4")
+    except (ValueError, UnicodeDecodeError):
+        esperados = None
+    if esperados is not None and len(esperados) == len(registros):
+        return np.flatnonzero(calculados != esperados).tolist()
+
+    # Algún campo crc no es hex de 8 dígitos: registro por registro
+    danados = []
+    for i, registro in enumerate(registros):
+        coma = len(registro) - 9
+        if coma < 0 or registro[coma] != ord(",") or crc_registro(registro[:coma]) != registro[coma + 1:]:
+            danados.append(i)
+    return danados
+
+def _danados_por_campos(registros, n_columnas):
+    # CSV anterior al crc: solo se puede revisar que cada registro tenga todas sus columnas
+    danados = []
+    for i, registro in enumerate(registros):
+        campos = next(csv.reader([registro.decode("utf-8", errors="replace")]), [])
+        if len(campos) != n_columnas:
+            danados.append(i)
+    return danados
+
+def _parsear_csv(datos):
+    df = pd.read_csv(io.BytesIO(datos), dtype=str, encoding="utf-8-sig").fillna("")
+    return df.drop(columns=[COLUMNA_CRC], errors="ignore")
+
+def leer_csv_verificado(ruta):
+    """
+    Lee el CSV con el parser de C y regresa (df, danados, ajenos).
+    `danados` son los registros que no pasaron la verificación
+    ({"registro", "texto"}) y que NO vienen en df:
+    - CSV con columna crc: registros cuyo CRC no cuadra.
+    - CSV anterior al crc: solo si el parser falla, los registros con
+      otro número de columnas.
+    `ajenos` es cuántos registros no cuadran con su CRC cuando son tantos
+    que parece una edición a mano: entonces df trae todo y danados va vacío.
+    Las líneas buenas se vuelven a parsear con el parser de C desde
+    memoria (nunca engine="python").
+    """
+    with open(ruta, "rb") as f:
+        datos = f.read()
+
+    fin_encabezado = datos.find(b"\n")
+    if not datos.strip():
+        return pd.DataFrame(columns=COLUMNAS_BASE), [], 0
+    if fin_encabezado < 0:
+        fin_encabezado = len(datos)
+    encabezado = datos[:fin_encabezado].rstrip(b"\r")
+    columnas = next(csv.reader([encabezado.decode("utf-8-sig", errors="replace")]))
+
+    if columnas[-1] == COLUMNA_CRC:
+        registros = _registros(datos, fin_encabezado + 1)
+        danados = _danados_por_crc(registros)
+        if len(danados) >= MIN_DANADOS_MASIVO and len(danados) > MAX_FRACCION_DANADA * len(registros):
+            return _parsear_csv(datos), [], len(danados)
+    else:
+        try:
+            return _parsear_csv(datos), [], 0
+        except ParserError:
+            registros = _registros(datos, fin_encabezado + 1)
+            danados = _danados_por_campos(registros, len(columnas))
+
+    if not danados:
+        return _parsear_csv(datos), [], 0
+
+    malos = set(danados)
+    limpio = b"\n".join([encabezado] + [r for i, r in enumerate(registros) if i not in malos]) + b"\n"
+    apartados = [{"registro": i + 1, "texto": registros[i].decode("utf-8", errors="replace")} for i in danados]
+    return _parsear_csv(limpio), apartados, 0
+
+def leer_csv_seguro(ruta, motivo_respaldo=None):
+    """
+    Lee CSV omitiendo registros dañados (ver leer_csv_verificado).
+    No usa lock; el lock se maneja fuera cuando se necesita.
+    """
+    if not os.path.exists(ruta):
+        return pd.DataFrame(columns=COLUMNAS_BASE)
+
+    df, danados, ajenos = leer_csv_verificado(ruta)
+    if ajenos:
+        _avisar(
+            f"⚠️ {os.path.basename(ruta)}: {ajenos} registros no coinciden con sus CRC (¿se editó a mano?). "
+            "Se leyó completo sin apartar registros."
+        )
+    if danados:
+        if motivo_respaldo:
+            motivo_respaldo("corrupto")
+        _avisar(
+            f"⚠️ El archivo {os.path.basename(ruta)} tenía {len(danados)} registros dañados. "
+            "Se creó un respaldo automático y se omitieron."
+        )
+    return df
+
+def crc_journal(registro):
+    """
+    CRC de un registro del journal: JSON canónico (llaves ordenadas) sin el campo crc.
+    """
+    cuerpo = {k: v for k, v in registro.items() if k != COLUMNA_CRC}
+    return crc_registro(json.dumps(cuerpo, ensure_ascii=False, sort_keys=True).encode("utf-8")).decode("ascii")
+
+def registro_journal(linea):
+    """
+    Línea del journal -> dict, o None si está dañada (JSON incompleto o
+    CRC que no cuadra). Los registros anteriores al crc se aceptan.
+    """
+    try:
+        registro = json.loads(linea)
+    except ValueError:
+        return None
+    if not isinstance(registro, dict):
+        return None
+    if COLUMNA_CRC in registro and registro[COLUMNA_CRC] != crc_journal(registro):
+        return None
+    return registro
+
+# ============================================================
+# MOTOR CSV (CSV ORDENADO + JOURNAL)
+# ============================================================
+
+class AlmacenCSV:
+    nombre = "csv"
+
+    def __init__(self, csv_path=CSV_PATH, backup_dir=BACKUP_DIR):
+        self.csv_path = csv_path
+        self.lock_path = csv_path + ".lock"
+        self.journal_path = csv_path + ".journal"
+        self.seq_path = csv_path + ".seq"
+        self.gen_path = csv_path + ".gen"
+        self.cuarentena_path = csv_path + ".cuarentena"
+        self.backup_dir = backup_dir
+        # (firma del CSV, registros dañados) de la última lectura que los encontró
+        self._danados = None
+        # (firma del CSV, cuántos registros) si no cuadra con sus CRC en masa
+        self._crc_ajeno = None
+        self._cola = ColaEscritura(self._aplicar_lote, nombre="csv")
+        self._indice = IndiceCSV(self)
+
+    def _lock(self, operacion):
+        # Espera y retención del lock quedan en metricas como csv.<operacion>.lock_*
+        return metricas.con_lock(FileLock(self.lock_path, timeout=10), f"csv.{operacion}")
+
+    # --------------------------
+    # Respaldos
+    # --------------------------
+
+    @metricas.cronometrado("csv.respaldo")
+    def crear_respaldo(self, motivo="auto"):
+        if not os.path.exists(self.csv_path):
+            return
+
+        os.makedirs(self.backup_dir, exist_ok=True)
+
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        backup_path = f"{self.backup_dir}/requisiciones_backup_{timestamp}_{motivo}.csv"
+
+        try:
+            shutil.copy2(self.csv_path, backup_path)
+            if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > 0:
+                shutil.copy2(self.journal_path, backup_path + ".journal")
+        except Exception as e:
+            _avisar(f"⚠️ No se pudo crear respaldo del CSV: {e}")
+
+    # --------------------------
+    # Journal
+    # --------------------------
+
+    @metricas.cronometrado("csv.journal")
+    def _anexar_journal(self, registros):
+        """
+        Anexa registros al journal (una línea JSON por registro) y hace fsync.
+        Si la última línea quedó incompleta por una caída, se cierra antes de escribir.
+        """
+        asegurar_directorio(self.journal_path)
+
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > 0:
+            with open(self.journal_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                necesita_salto = f.read(1) != b"\n"
+        else:
+            necesita_salto = False
+
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            if necesita_salto:
+                f.write("\n")
+            for r in registros:
+                r = dict(r, crc=crc_journal(r))
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _leer_journal(self):
+        """
+        Regresa las filas del journal (más antiguas primero).
+        Líneas dañadas (escritura interrumpida) se ignoran.
+        """
+        return self._leer_journal_desde(0)[0]
+
+    def _leer_journal_desde(self, offset, archivo=None):
+        """
+        Lee el journal a partir del byte `offset` hasta la última línea completa.
+        Regresa (filas, offset_final) para poder continuar en la siguiente lectura.
+        `archivo` es el journal ya abierto por el lector; sin él se abre la ruta.
+        """
+        if archivo is None:
+            if not os.path.exists(self.journal_path):
+                return [], 0
+            with open(self.journal_path, "rb") as f:
+                return self._leer_journal_desde(offset, f)
+
+        archivo.seek(offset)
+        datos = archivo.read()
+
+        fin = datos.rfind(b"\n") + 1
+        filas = []
+        for linea in datos[:fin].decode("utf-8", errors="replace").splitlines():
+            linea = linea.strip()
+            if not linea:
+                continue
+            registro = registro_journal(linea)
+            if registro is None:
+                continue
+            # I = alta, U = edición (fila completa ya modificada)
+            if registro.get("op") in ("I", "U") and isinstance(registro.get("fila"), dict):
+                filas.append(registro["fila"])
+        return filas, offset + fin
+
+    @staticmethod
+    def _journal_a_df(filas):
+        """
+        Filas del journal -> frame, más recientes primero. Si una requisición
+        aparece varias veces (alta + ediciones) queda solo su última versión.
+        """
+        df = pd.DataFrame(filas[::-1])
+        for c in COLUMNAS_BASE:
+            if c not in df.columns:
+                df[c] = ""
+        df = df[COLUMNAS_BASE].fillna("").astype(str)
+        return df[~(df["uuid"].ne("") & df.duplicated(subset=["uuid"], keep="first"))]
+
+    def _rotar_journal(self):
+        """
+        Deja el journal vacío con un archivo nuevo + os.replace, no truncando
+        en sitio: un lector que ya tenía abierto el anterior lo sigue leyendo
+        completo (ver cargar_cambios). Las líneas dañadas del journal que se
+        descarta pasan a la cuarentena.
+        """
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb") as f:
+                lineas = f.read().decode("utf-8", errors="replace").splitlines()
+            danadas = [
+                {"registro": i + 1, "texto": linea} for i, linea in enumerate(lineas)
+                if linea.strip() and registro_journal(linea) is None
+            ]
+            if danadas:
+                self._a_cuarentena("journal", danadas)
+
+            tmp_path = self.journal_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.journal_path)
+
+    # --------------------------
+    # Versión de los datos
+    # --------------------------
+
+    def version(self):
+        """
+        Identifica el estado actual de los datos sin leerlos: generación que
+        suben los escritores + firma (mtime, tamaño) de CSV y journal, para
+        detectar también cambios hechos a mano sobre el archivo.
+        """
+        return (leer_generacion(self.gen_path), _firma(self.csv_path), _firma(self.journal_path))
+
+    def _marcar_cambio(self):
+        # Debe llamarse dentro del lock
+        escribir_generacion(self.gen_path, leer_generacion(self.gen_path) + 1)
+
+    # --------------------------
+    # Secuencia de folios
+    # --------------------------
+
+    def _leer_secuencia(self):
+        """
+        Último folio asignado. Si el archivo no existe (primera vez) se
+        inicializa con el mayor ID que ya haya en los datos.
+        Debe llamarse dentro del lock.
+        """
+        try:
+            with open(self.seq_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return max(max_folio(self._leer_todo()), historico.max_folio())
+
+    def _escribir_secuencia(self, valor):
+        asegurar_directorio(self.seq_path)
+        tmp_path = self.seq_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(valor))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.seq_path)
+
+    def _reservar_folios(self, cantidad=1):
+        """
+        Reserva `cantidad` folios consecutivos y regresa el primero.
+        Debe llamarse dentro del lock, junto con el alta que los usa.
+        """
+        ultimo = self._leer_secuencia()
+        self._escribir_secuencia(ultimo + cantidad)
+        return ultimo + 1
+
+    def _sincronizar_secuencia(self, df):
+        # Tras reemplazar / importar datos la secuencia nunca queda por debajo del mayor folio
+        maximo = max_folio(df)
+        if maximo > self._leer_secuencia():
+            self._escribir_secuencia(maximo)
+
+    # --------------------------
+    # Lectura / escritura
+    # --------------------------
+
+    @metricas.cronometrado("csv.parsear")
+    def _read_csv_seguro(self):
+        """
+        CSV principal verificado con su CRC por registro. Los dañados se
+        omiten y quedan en self._danados hasta que reparar() (o la siguiente
+        reescritura) los aparta: el costo de recuperar se paga una vez. Un
+        CSV editado a mano (CRC que no cuadran en masa) se lee completo y
+        queda en self._crc_ajeno hasta que reparar() lo vuelve a firmar.
+        """
+        if not os.path.exists(self.csv_path):
+            return pd.DataFrame(columns=COLUMNAS_BASE)
+
+        firma = _firma(self.csv_path)
+        df, danados, ajenos = leer_csv_verificado(self.csv_path)
+        self._danados = (firma, danados) if danados else None
+        self._crc_ajeno = (firma, ajenos) if ajenos else None
+        return df
+
+    def _leer_todo(self, filas=None):
+        """
+        CSV principal + altas pendientes del journal, sin normalizar.
+        No usa lock; el lock se maneja fuera cuando se necesita.
+        """
+        df = self._read_csv_seguro()
+        if filas is None:
+            filas = self._leer_journal()
+        if not filas:
+            return df
+
+        df_journal = self._journal_a_df(filas)
+        df = pd.concat([df_journal, df], ignore_index=True).fillna("")
+
+        # Las ediciones del journal reemplazan a la fila del CSV; si una compactación
+        # se interrumpió, el journal también puede repetir filas ya integradas
+        if "uuid" in df.columns:
+            dup = df["uuid"].astype(str).ne("") & df.duplicated(subset=["uuid"], keep="first")
+            df = df[~dup]
+
+        with metricas.medir("csv.ordenar"):
+            df = df.assign(_dt=pd.to_datetime(df.get("fecha_hora", ""), errors="coerce"))
+            df = df.sort_values(by="_dt", ascending=False, kind="stable").drop(columns=["_dt"])
+        return df.reset_index(drop=True).fillna("")
+
+    @metricas.cronometrado("csv.snapshot")
+    def _escribir_snapshot(self, df_out):
+        """
+        Escritura atómica del CSV completo (.tmp + fsync + replace).
+        El df ya incluye lo que hubiera en el journal, así que éste se vacía.
+        Debe llamarse dentro del lock.
+        """
+        asegurar_directorio(self.csv_path)
+        df_out = completar_uuids(df_out.drop(columns=[COLUMNA_CRC], errors="ignore").copy())
+        self._apartar_danados()
+        tmp_path = self.csv_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8-sig", newline="") as f:
+            escribir_csv_con_crc(df_out, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.csv_path)
+        self._rotar_journal()
+        # El escritor ya pagó O(n) al reescribir; así la siguiente edición no lo paga
+        self._indice.reconstruir()
+
+    # --------------------------
+    # Registros dañados
+    # --------------------------
+
+    def _a_cuarentena(self, origen, registros):
+        # Una línea JSON por registro apartado, con su texto tal cual
+        fecha = hora_local().strftime("%Y-%m-%d %H:%M:%S")
+        with open(self.cuarentena_path, "a", encoding="utf-8") as f:
+            for r in registros:
+                f.write(json.dumps({"fecha": fecha, "origen": origen, **r}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _apartar_danados(self):
+        # Dentro del lock, antes de reemplazar el CSV: sus registros dañados no se pierden
+        danados = self._danados
+        if danados and danados[0] == _firma(self.csv_path):
+            self._a_cuarentena("csv", danados[1])
+        self._danados = None
+
+    def reparar(self):
+        """
+        Si el CSV principal tiene registros dañados: respalda el archivo,
+        aparta esos registros en <csv>.cuarentena y lo reescribe limpio.
+        Si no cuadra con sus CRC en masa (editado a mano) lo respalda y lo
+        reescribe tal cual con CRC nuevos, para no volver a leerlo ni avisar
+        en cada carga. Regresa cuántos registros se apartaron (0 si ya estaba
+        bien, p. ej. porque otro proceso lo reparó primero).
+        """
+        with self._lock("reparar"):
+            df = self._leer_todo()
+            ajeno = self._crc_ajeno
+            if not self._danados and not ajeno:
+                return 0
+            apartados = len(self._danados[1]) if self._danados else 0
+            self.crear_respaldo("corrupto" if apartados else "crc_ajeno")
+            self._escribir_snapshot(asegurar_columnas(df)[COLUMNAS_BASE])
+            self._crc_ajeno = None
+            self._marcar_cambio()
+
+        if ajeno:
+            _avisar(
+                f"⚠️ {ajeno[1]} registros del CSV de requisiciones no coincidían con sus CRC (¿se editó a mano?). "
+                "Se respaldó y se volvió a firmar tal como estaba; si no fue una edición intencional, "
+                "revisa el respaldo crc_ajeno."
+            )
+            return 0
+
+        _avisar(
+            f"⚠️ El archivo de requisiciones tenía {apartados} registros dañados. "
+            f"Se respaldó, se apartaron en {os.path.basename(self.cuarentena_path)} y se reescribió limpio."
+        )
+        return apartados
+
+    def compactar_journal(self):
+        """
+        Integra el journal al CSV principal ordenado por fecha desc.
+        """
+        with self._lock("compactar"):
+            if not self._leer_journal():
+                return
+            self._escribir_snapshot(asegurar_columnas(self._leer_todo())[COLUMNAS_BASE])
+
+    def cargar(self):
+        """
+        Lectura completa sin lock (ver cargar_cambios).
+        """
+        asegurar_directorio(self.csv_path)
+
+        # Si no existe aún, regresa estructura vacía
+        if not os.path.exists(self.csv_path) and not os.path.exists(self.journal_path):
+            return normalizar(pd.DataFrame(columns=COLUMNAS_BASE))
+
+        return self.cargar_cambios()[0]
+
+    @metricas.cronometrado("csv.cargar")
+    def cargar_cambios(self, estado=None):
+        """
+        Recarga incremental. `estado` es lo que regresó la llamada anterior.
+        Si el CSV principal y el journal son los mismos archivos solo se
+        parsean las líneas nuevas del journal; si no (compactación /
+        edición) se lee todo. Regresa (df, estado_nuevo, es_delta).
+
+        No toma el lock de escritura: los escritores publican el CSV con
+        os.replace y rotan el journal (nunca lo truncan en sitio), así que
+        cada archivo abierto es una foto inmutable salvo por altas al final.
+        El journal se abre ANTES de leer el CSV: si en medio hubo una
+        compactación, el CSV nuevo ya trae esas filas y se descartan por uuid.
+        """
+        asegurar_directorio(self.csv_path)
+
+        try:
+            archivo = open(self.journal_path, "rb")
+        except FileNotFoundError:
+            archivo = None
+
+        try:
+            journal = os.fstat(archivo.fileno()).st_ino if archivo else None
+            firma_csv = _firma(self.csv_path)
+
+            if estado and estado["csv"] == firma_csv and estado.get("journal") == journal:
+                filas, offset = self._leer_journal_desde(estado["offset"], archivo) if archivo else ([], 0)
+                df = self._journal_a_df(filas) if filas else pd.DataFrame(columns=COLUMNAS_BASE)
+                return normalizar(df), {"csv": firma_csv, "journal": journal, "offset": offset}, True
+
+            filas, offset = self._leer_journal_desde(0, archivo) if archivo else ([], 0)
+            df = self._leer_todo(filas)
+        finally:
+            if archivo is not None:
+                archivo.close()
+
+        if self._danados or self._crc_ajeno:
+            # Se reparan una vez; las lecturas siguientes ya encuentran el CSV limpio
+            try:
+                self.reparar()
+            except Timeout:
+                pass
+
+        return normalizar(df), {"csv": firma_csv, "journal": journal, "offset": offset}, False
+
+    @metricas.cronometrado("csv.consultar")
+    def consultar(self, filtros=None, orden="fecha_hora", descendente=True, pagina=1, por_pagina=50):
+        """
+        Una página de requisiciones + total de filas que cumplen los filtros.
+        El CSV no se puede consultar por partes: filtra el frame compartido
+        del proceso (una sola lectura por cambio, no por sesión).
+        Con filtros["historico"] se agregan los meses archivados del rango.
+        """
+        df = filtrar_frame(obtener_cache(self).obtener(), filtros)
+        if (filtros or {}).get("historico"):
+            df = con_historico(a_formato_externo(df), filtros)
+        return a_formato_externo(paginar(df, orden, descendente, pagina, por_pagina)), len(df)
+
+    def iterar_consulta(self, filtros=None, orden="fecha_hora", descendente=True, tamano=50_000):
+        """
+        Todas las filas que cumplen los filtros, en bloques de `tamano`.
+        Se filtra y ordena una sola vez la foto actual del frame compartido;
+        solo cada bloque se expande a columnas de texto.
+        """
+        df = filtrar_frame(obtener_cache(self).obtener(), filtros)
+        if (filtros or {}).get("historico"):
+            df = con_historico(a_formato_externo(df), filtros)
+        df = paginar(df, orden, descendente, por_pagina=None)
+        for inicio in range(0, len(df), tamano):
+            yield a_formato_externo(df.iloc[inicio: inicio + tamano])
+
+    def refrescar(self):
+        obtener_cache(self).obtener(forzar=True)
+
+    def guardar_todo(self, df):
+        """
+        Escritura atómica: escribe a .tmp y luego reemplaza.
+        Usa lock para evitar corrupción.
+        """
+        df_out = df.copy()
+
+        # Evitar guardar columnas internas
+        df_out = df_out.drop(columns=["fecha_hora_dt"], errors="ignore")
+
+        # Asegurar orden de columnas (si faltan, se crean)
+        df_out = asegurar_columnas(df_out)[COLUMNAS_BASE]
+
+        # Copia de seguridad antes de reemplazar todo, pero fuera del lock
+        self.crear_respaldo("pre_guardado")
+
+        with self._lock("guardar_todo"):
+            self._escribir_snapshot(df_out)
+            self._sincronizar_secuencia(df_out)
+            self._marcar_cambio()
+
+    def agregar(self, nueva_fila):
+        """
+        Inserta y guarda. Regresa (folio, insertada).
+        Anti-duplicado: si uuid ya existe, no inserta.
+        Si la fila no trae ID se le asigna el siguiente de la secuencia.
+
+        La escritura la hace la cola de escritura del proceso: las altas y
+        ediciones que llegan mientras se guarda un lote se juntan en el
+        siguiente (un lock, una escritura durable) y cada quien recibe su
+        resultado al terminar.
+        """
+        return self._cola.enviar("alta", dict(nueva_fila))
+
+    def agregar_lote(self, filas):
+        """
+        Alta masiva (importación): todas las filas en un solo lote, con un
+        lock, un bloque de folios consecutivos y una escritura durable.
+        No pasa por la cola (que parte en lotes de MAX_LOTE). Regresa un
+        (folio, insertada) por fila, en orden.
+        """
+        if not filas:
+            return []
+        return self._aplicar_lote([("alta", dict(fila)) for fila in filas])
+
+    def actualizar_requisicion(self, uuid_val, id_val, status, almacenista, issue):
+        """
+        Cambia status / almacenista / issue de una requisición (y congela min_final).
+        Busca por uuid si existe, si no por ID. Regresa False si no la encontró.
+        Pasa por la misma cola de escritura que las altas. Si ya estaba en el
+        archivo histórico primero se regresa al almacén.
+        """
+        datos = (uuid_val, id_val, status, almacenista, issue)
+        encontrada = self._cola.enviar("edicion", datos)
+        if not encontrada and reactivar_archivada(self, uuid_val, id_val):
+            encontrada = self._cola.enviar("edicion", datos)
+        return encontrada
+
+    @metricas.cronometrado("csv.lote")
+    def _aplicar_lote(self, comandos):
+        """
+        Aplica un lote de la cola de escritura. `comandos` = [(tipo, datos)]
+        con tipo "alta" (datos = fila) o "edicion" (datos = argumentos de
+        actualizar_requisicion). Regresa un resultado por comando, en orden.
+
+        OJO IMPORTANTE: se hace TODO dentro de lock (leer -> checar -> folio -> insertar -> guardar)
+        para evitar que 2 procesos se pisen, se pierdan registros o reciban el mismo folio.
+
+        Con USAR_JOURNAL el lote se anexa al journal (un fsync): las altas
+        como registros "I" y las ediciones como registros "U" con la fila
+        completa ya modificada. El índice persistente resuelve ambas cosas
+        sin leer el historial: los uuid repetidos de las altas y la fila
+        vigente de cada edición. La compactación reescribe el CSV cada
+        JOURNAL_MAX_REGISTROS registros; si falla, el lote ya está a salvo
+        en el journal y el siguiente lote la vuelve a intentar. Sin journal,
+        o si el CSV aún tiene filas sin uuid, se reescribe el CSV una sola vez.
+        """
+        resultados = [None] * len(comandos)
+        hay_altas = any(tipo == "alta" for tipo, _ in comandos)
+        hay_ediciones = any(tipo == "edicion" for tipo, _ in comandos)
+
+        with self._lock("lote"):
+            pendientes = self._leer_journal()
+
+            por_registro = USAR_JOURNAL
+            if USAR_JOURNAL:
+                self._indice.al_dia()
+                por_registro = self._indice.completo()
+
+            df = None
+            if not por_registro:
+                df = asegurar_columnas(self._leer_todo(pendientes))
+                previas = dict(zip(df["uuid"].astype(str), df["ID"]))
+            elif hay_altas:
+                # Solo los uuid del lote, contra el índice (CSV + journal)
+                previas = self._indice.folios(str(fila.get("uuid", "")) for tipo, fila in comandos if tipo == "alta")
+            else:
+                previas = {}
+            previas.pop("", None)
+
+            # Altas: duplicados contra lo guardado y contra el mismo lote
+            altas, repetidas = [], {}
+            for i, (tipo, fila) in enumerate(comandos):
+                if tipo != "alta":
+                    continue
+                u = str(fila.get("uuid", ""))
+                if u in previas:
+                    resultados[i] = (previas[u], False)
+                elif u and u in repetidas:
+                    repetidas[u].append(i)
+                else:
+                    altas.append((i, fila))
+                    if u:
+                        repetidas[u] = []
+
+            # Un solo bloque de folios consecutivos para todo el lote
+            sin_folio = [fila for _, fila in altas if not fila.get("ID")]
+            if sin_folio:
+                primero = self._reservar_folios(len(sin_folio))
+                for n, fila in enumerate(sin_folio):
+                    fila["ID"] = formatear_folio(primero + n)
+
+            for i, fila in altas:
+                resultados[i] = (fila["ID"], True)
+                for j in repetidas.get(str(fila.get("uuid", "")), []):
+                    resultados[j] = (fila["ID"], False)
+
+            if df is None:
+                registros = [{"op": "I", "fila": fila} for _, fila in altas]
+                if hay_ediciones:
+                    registros += self._ediciones_por_registro(comandos, altas, resultados)
+                if registros:
+                    self._anexar_journal(registros)
+                    with _despues_de_escribir():
+                        if len(pendientes) + len(registros) >= JOURNAL_MAX_REGISTROS:
+                            try:
+                                self._escribir_snapshot(asegurar_columnas(self._leer_todo())[COLUMNAS_BASE])
+                            except Exception:
+                                # El lote ya quedó en el journal; el siguiente lote vuelve a compactar
+                                metricas.contar("csv.compactacion_fallida")
+                        self._marcar_cambio()
+                return resultados
+
+            if altas:
+                df_nuevas = asegurar_columnas(pd.DataFrame([fila for _, fila in altas][::-1]))
+                df = pd.concat([df_nuevas, df], ignore_index=True).fillna("")
+
+                # Orden por fecha desc
+                df["fecha_hora_dt"] = pd.to_datetime(df.get("fecha_hora", ""), errors="coerce")
+                df = df.sort_values(by="fecha_hora_dt", ascending=False, kind="stable")
+                df = df.drop(columns=["fecha_hora_dt"]).reset_index(drop=True)
+
+            if hay_ediciones:
+                # Normalizar issue
+                df["issue"] = df["issue"].astype(str).str.lower().isin(["true", "1", "yes", "si", "sí"])
+                for i, (tipo, datos) in enumerate(comandos):
+                    if tipo == "edicion":
+                        resultados[i] = self._editar_fila(df, *datos)
+
+            if altas or any(r is True for r in resultados):
+                # Guardado atómico (el respaldo lo toma respaldos.GestorRespaldos en segundo plano)
+                self._escribir_snapshot(df[COLUMNAS_BASE])
+                with _despues_de_escribir():
+                    self._marcar_cambio()
+
+        return resultados
+
+    def _ediciones_por_registro(self, comandos, altas, resultados):
+        """
+        Registros "U" para las ediciones del lote. La fila vigente sale del
+        mismo lote (altas / ediciones anteriores) o del índice persistente.
+        """
+        del_lote = {str(fila["uuid"]): fila for _, fila in altas if str(fila.get("uuid", ""))}
+        registros = []
+
+        for i, (tipo, datos) in enumerate(comandos):
+            if tipo != "edicion":
+                continue
+            uuid_val, id_val, status, almacenista, issue = datos
+            uuid_val = str(uuid_val or "").strip()
+
+            if uuid_val:
+                fila = del_lote.get(uuid_val)
+            else:
+                fila = next((f for f in del_lote.values() if str(f.get("ID")) == str(id_val)), None)
+            if fila is None:
+                fila = self._indice.buscar(uuid_val, id_val)
+            if fila is None:
+                resultados[i] = False
+                continue
+
+            fila = dict(fila)
+            fila["min_final"] = calcular_min_final(status, fila.get("fecha_hora", ""), fila.get("min_final", ""))
+            fila["status"] = status
+            fila["almacenista"] = str(almacenista).strip()
+            fila["issue"] = bool(issue)
+
+            del_lote[str(fila["uuid"])] = fila
+            registros.append({"op": "U", "fila": fila})
+            resultados[i] = True
+
+        return registros
+
+    @staticmethod
+    def _editar_fila(df_all, uuid_val, id_val, status, almacenista, issue):
+        uuid_val = str(uuid_val or "").strip()
+        if uuid_val:
+            idx = df_all.index[df_all["uuid"].astype(str) == uuid_val]
+        else:
+            idx = df_all.index[df_all["ID"].astype(str) == str(id_val)]
+
+        if len(idx) == 0:
+            return False
+
+        j = idx[0]
+
+        df_all.loc[j, "min_final"] = calcular_min_final(
+            status, df_all.loc[j, "fecha_hora"], df_all.loc[j, "min_final"]
+        )
+
+        # Aplicar cambios
+        df_all.loc[j, "status"] = status
+        df_all.loc[j, "almacenista"] = str(almacenista).strip()
+        df_all.loc[j, "issue"] = bool(issue)
+        return True
+
+    # --------------------------
+    # Archivo histórico
+    # --------------------------
+
+    @metricas.cronometrado("csv.archivar")
+    def archivar(self, dias=None):
+        """
+        Mueve al archivo histórico (Parquet por mes) las requisiciones
+        cerradas con más de `dias` días (historico.DIAS_ARCHIVO). Primero se
+        escriben las partes y después se quitan del CSV: si algo falla en
+        medio la fila queda en ambos lados y vale la del CSV.
+        Regresa cuántas se archivaron.
+        """
+        if not historico.disponible():
+            return 0
+
+        with self._lock("archivar"):
+            df = asegurar_columnas(self._leer_todo())
+            frias = filas_archivables(df, dias)
+            if not frias.any():
+                return 0
+
+            historico.escribir(para_archivo(df[frias]))
+            self._escribir_snapshot(df[~frias][COLUMNAS_BASE])
+            self._marcar_cambio()
+
+        return int(frias.sum())
+
+    # --------------------------
+    # Exportar / importar
+    # --------------------------
+
+    def exportar_csv(self, ruta):
+        df = self.cargar().drop(columns=["fecha_hora_dt"], errors="ignore")
+        df[COLUMNAS_BASE].to_csv(ruta, index=False, encoding="utf-8-sig")
+
+    def importar_csv(self, ruta):
+        self.guardar_todo(leer_csv_seguro(ruta))
+
+# ============================================================
+# ÍNDICE PERSISTENTE DEL CSV (uuid / ID -> posición)
+# ============================================================
+
+_TABLA_INDICE = """
+CREATE TABLE IF NOT EXISTS indice (
+    uuid    TEXT PRIMARY KEY,
+    ID      TEXT NOT NULL DEFAULT '',
+    archivo INTEGER NOT NULL,
+    offset  INTEGER NOT NULL,
+    largo   INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+_ESQUEMA_INDICE = _TABLA_INDICE + """
+CREATE INDEX IF NOT EXISTS idx_indice_id ON indice(ID);
+CREATE TABLE IF NOT EXISTS estado (
+    clave TEXT PRIMARY KEY,
+    valor TEXT NOT NULL
+);
+"""
+
+def _posiciones_csv(ruta, bloque=1 << 24):
+    """
+    (inicios, largos) en bytes de cada fila del CSV, sin encabezado ni
+    líneas vacías. Un salto de línea cierra la fila solo si va fuera de
+    comillas (número par de '"' antes de él). Vectorizado por bloques.
+    """
+    saltos, comillas, base = [], [], 0
+    with open(ruta, "rb") as f:
+        while True:
+            datos = f.read(bloque)
+            if not datos:
+                break
+            arr = np.frombuffer(datos, dtype=np.uint8)
+            saltos.append(np.flatnonzero(arr == ord("\n")) + base)
+            comillas.append(np.flatnonzero(arr == ord('"')) + base)
+            base += len(datos)
+
+    saltos = np.concatenate(saltos) if saltos else np.zeros(0, dtype=np.int64)
+    comillas = np.concatenate(comillas) if comillas else np.zeros(0, dtype=np.int64)
+
+    fines = saltos[np.searchsorted(comillas, saltos) % 2 == 0] + 1
+    if base and (len(fines) == 0 or fines[-1] < base):
+        fines = np.append(fines, base)
+    inicios = np.concatenate([[0], fines[:-1]]).astype(np.int64)
+    largos = fines - inicios
+
+    # "\n" o "\r\n" solos son líneas vacías; la primera fila es el encabezado
+    llenas = largos > 2
+    return inicios[llenas][1:], largos[llenas][1:]
+
+class IndiceCSV:
+    """
+    Índice persistente del motor CSV en un SQLite aparte (<csv>.idx.sqlite):
+    uuid / ID -> archivo (CSV o journal), byte donde empieza la fila y largo.
+    Checar si un uuid ya existe (anti-duplicado de las altas) cuesta una
+    búsqueda por llave y editar una requisición además leer una línea,
+    sin importar el tamaño del historial.
+
+    Solo lo usa el escritor, dentro del lock. Se puede tirar y reconstruir
+    desde los archivos en cualquier momento: guarda la firma del CSV y hasta
+    qué byte del journal indexó para saber si está al día.
+    """
+
+    CSV = 0
+    JOURNAL = 1
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        self.ruta = almacen.csv_path + ".idx.sqlite"
+        self._conexion = None
+
+    def _conn(self):
+        if self._conexion is None:
+            asegurar_directorio(self.ruta)
+            # Escritores serializados por el FileLock, no por hilo
+            conn = sqlite3.connect(self.ruta, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Si se pierde lo último basta con volver a indexar la cola del journal
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.executescript(_ESQUEMA_INDICE)
+            self._conexion = conn
+        return self._conexion
+
+    def _estado(self):
+        filas = self._conn().execute("SELECT clave, valor FROM estado").fetchall()
+        return {clave: json.loads(valor) for clave, valor in filas}
+
+    def _guardar_estado(self, conn, **valores):
+        conn.executemany(
+            "INSERT OR REPLACE INTO estado (clave, valor) VALUES (?, ?)",
+            [(clave, json.dumps(valor)) for clave, valor in valores.items()],
+        )
+
+    # --------------------------
+    # Mantenimiento
+    # --------------------------
+
+    def al_dia(self):
+        """
+        Deja el índice igual a los archivos: si el CSV o el journal se
+        reemplazaron se reconstruye; si no, solo se indexa lo que se anexó
+        al journal desde la última vez. Debe llamarse dentro del lock.
+        """
+        estado = self._estado()
+        firma_csv = _firma(self.almacen.csv_path)
+        firma_journal = _firma(self.almacen.journal_path)
+
+        if estado.get("csv") != (list(firma_csv) if firma_csv else None):
+            return self.reconstruir()
+
+        journal = firma_journal[0] if firma_journal else None
+        if estado.get("journal") != journal or (firma_journal and firma_journal[2] < estado.get("offset", 0)):
+            return self.reconstruir()
+
+        if firma_journal and firma_journal[2] > estado.get("offset", 0):
+            conn = self._conn()
+            conn.execute("BEGIN")
+            try:
+                offset = self._indexar_journal(conn, estado.get("offset", 0))
+                self._guardar_estado(conn, offset=offset)
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @metricas.cronometrado("csv.indice")
+    def reconstruir(self):
+        """
+        Indexa el CSV completo y el journal desde cero.
+        """
+        conn = self._conn()
+        firma_csv = _firma(self.almacen.csv_path)
+        firma_journal = _firma(self.almacen.journal_path)
+
+        conn.execute("BEGIN")
+        try:
+            # Tabla nueva y el índice por ID al final: cargar en bloque es mucho más rápido
+            conn.execute("DROP TABLE IF EXISTS indice")
+            conn.execute(_TABLA_INDICE)
+            sin_uuid = False
+            if firma_csv:
+                sin_uuid = not self._indexar_csv(conn)
+
+            offset = self._indexar_journal(conn, 0) if firma_journal else 0
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_indice_id ON indice(ID)")
+            self._guardar_estado(
+                conn,
+                csv=list(firma_csv) if firma_csv else None,
+                journal=firma_journal[0] if firma_journal else None,
+                offset=offset,
+                completo=not sin_uuid,
+            )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _indexar_csv(self, conn):
+        """
+        Posiciones de las filas del CSV + sus uuid / ID (solo esas columnas
+        con el parser de pandas). Regresa False si no se pudo indexar todo:
+        filas sin uuid o un CSV que no cuadra con el conteo de líneas.
+        """
+        try:
+            llaves = pd.read_csv(
+                self.almacen.csv_path, dtype=str, encoding="utf-8-sig", keep_default_na=False,
+                usecols=lambda c: c in ("uuid", "ID"),
+            )
+        except (ParserError, ValueError):
+            return False
+        if "uuid" not in llaves.columns or "ID" not in llaves.columns:
+            return False
+
+        inicios, largos = _posiciones_csv(self.almacen.csv_path)
+        if len(inicios) != len(llaves):
+            return False
+
+        filas = llaves.assign(archivo=self.CSV, offset=inicios, largo=largos)
+        filas = filas[filas["uuid"].ne("")]
+        # En orden de uuid cada inserción cae al final del árbol de la llave primaria
+        filas = filas.sort_values("uuid")
+        conn.executemany(
+            "INSERT OR REPLACE INTO indice VALUES (?, ?, ?, ?, ?)",
+            zip(*(filas[c].tolist() for c in ("uuid", "ID", "archivo", "offset", "largo"))),
+        )
+        return len(filas) == len(llaves)
+
+    def _indexar_journal(self, conn, desde):
+        with open(self.almacen.journal_path, "rb") as f:
+            f.seek(desde)
+            datos = f.read()
+
+        fin = datos.rfind(b"\n") + 1
+        filas, offset = [], desde
+        for linea in datos[:fin].splitlines(keepends=True):
+            registro = registro_journal(linea)
+            fila = registro.get("fila") if registro else None
+            if isinstance(fila, dict) and str(fila.get("uuid", "")):
+                filas.append((str(fila["uuid"]), str(fila.get("ID", "")), self.JOURNAL, offset, len(linea)))
+            offset += len(linea)
+
+        conn.executemany("INSERT OR REPLACE INTO indice VALUES (?, ?, ?, ?, ?)", filas)
+        return desde + fin
+
+    # --------------------------
+    # Consulta
+    # --------------------------
+
+    def completo(self):
+        """
+        False si el CSV tiene filas sin uuid (no indexables): esas solo se
+        pueden editar reescribiendo el archivo, que de paso les asigna uuid.
+        """
+        return bool(self._estado().get("completo"))
+
+    def folios(self, uuids):
+        """
+        {uuid: ID} de los uuid que ya están guardados (búsqueda por llave,
+        en bloques de 500 para no pasar el límite de parámetros de SQLite).
+        """
+        uuids = list(set(uuids) - {""})
+        encontrados = {}
+        for i in range(0, len(uuids), 500):
+            bloque = uuids[i:i + 500]
+            encontrados.update(self._conn().execute(
+                f"SELECT uuid, ID FROM indice WHERE uuid IN ({', '.join('?' for _ in bloque)})", bloque
+            ).fetchall())
+        return encontrados
+
+    def buscar(self, uuid_val, id_val):
+        """
+        Fila vigente (dict) de la requisición por uuid, o por ID si no hay uuid.
+        """
+        uuid_val = str(uuid_val or "").strip()
+        if uuid_val:
+            ubicacion = self._conn().execute(
+                "SELECT archivo, offset, largo FROM indice WHERE uuid = ?", (uuid_val,)
+            ).fetchone()
+        else:
+            ubicacion = self._conn().execute(
+                # Folios repetidos (datos viejos): la primera en el orden del CSV, la más reciente
+                "SELECT archivo, offset, largo FROM indice WHERE ID = ? ORDER BY archivo, offset LIMIT 1",
+                (str(id_val),)
+            ).fetchone()
+        if ubicacion is None:
+            return None
+
+        archivo, offset, largo = ubicacion
+        ruta = self.almacen.csv_path if archivo == self.CSV else self.almacen.journal_path
+        with open(ruta, "rb") as f:
+            if archivo == self.CSV:
+                encabezado = next(csv.reader([f.readline().decode("utf-8-sig")]))
+            f.seek(offset)
+            datos = f.read(largo).decode("utf-8", errors="replace")
+
+        if archivo == self.JOURNAL:
+            registro = registro_journal(datos)
+            return dict(registro["fila"]) if registro else None
+        if encabezado[-1] == COLUMNA_CRC:
+            cuerpo = datos.rstrip("\r\n").encode("utf-8")
+            if crc_registro(cuerpo[:-9]) != cuerpo[-8:]:
+                return None
+        fila = dict(zip(encabezado, next(csv.reader(io.StringIO(datos)))))
+        fila.pop(COLUMNA_CRC, None)
+        return fila
+
+# ============================================================
+# MOTOR SQLITE (WAL)
+# ============================================================
+
+_ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS requisiciones (
+    rid          INTEGER PRIMARY KEY AUTOINCREMENT,
+    ID           TEXT NOT NULL DEFAULT '',
+    uuid         TEXT NOT NULL DEFAULT '',
+    fecha_hora   TEXT NOT NULL DEFAULT '',
+    cuarto       TEXT NOT NULL DEFAULT '',
+    work_order   TEXT NOT NULL DEFAULT '',
+    numero_parte TEXT NOT NULL DEFAULT '',
+    numero_lote  TEXT NOT NULL DEFAULT '',
+    cantidad     INTEGER NOT NULL DEFAULT 0,
+    motivo       TEXT NOT NULL DEFAULT '',
+    status       TEXT NOT NULL DEFAULT '',
+    almacenista  TEXT NOT NULL DEFAULT '',
+    issue        INTEGER NOT NULL DEFAULT 0,
+    min_final    INTEGER,
+    gen          INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_req_uuid ON requisiciones(uuid) WHERE uuid <> '';
+CREATE INDEX IF NOT EXISTS idx_req_id ON requisiciones(ID);
+CREATE INDEX IF NOT EXISTS idx_req_status ON requisiciones(status);
+CREATE INDEX IF NOT EXISTS idx_req_cuarto ON requisiciones(cuarto);
+CREATE INDEX IF NOT EXISTS idx_req_fecha ON requisiciones(fecha_hora);
+CREATE TABLE IF NOT EXISTS secuencias (
+    nombre TEXT PRIMARY KEY,
+    valor  INTEGER NOT NULL
+);
+"""
+
+# Generación vigente de la transacción en curso (se sube al iniciarla)
+_SQL_GENERACION = "(SELECT valor FROM secuencias WHERE nombre = 'generacion')"
+
+_SQL_MAX_FOLIO = (
+    "SELECT COALESCE(MAX(CAST(SUBSTR(ID, 5) AS INTEGER)), 0) FROM requisiciones "
+    "WHERE ID LIKE 'REQ-%'"
+)
+
+def _a_entero_o_none(x):
+    s = str(x).strip().lower()
+    if s in ["", "none", "nan"]:
+        return None
+    try:
+        return int(float(x))
+    except:
+        return None
+
+def _fila_sqlite(fila):
+    """
+    dict de requisición -> tupla en el orden de COLUMNAS_BASE con tipos SQL.
+    """
+    valores = []
+    for c in COLUMNAS_BASE:
+        v = fila.get(c, "")
+        if c == "cantidad":
+            v = _a_entero_o_none(v) or 0
+        elif c == "issue":
+            v = int(str(v).lower() in ["true", "1", "yes", "si", "sí"])
+        elif c == "min_final":
+            v = _a_entero_o_none(v)
+        else:
+            v = "" if v is None or (isinstance(v, float) and pd.isna(v)) else str(v)
+        valores.append(v)
+    return tuple(valores)
+
+class AlmacenSQLite:
+    nombre = "sqlite"
+
+    def __init__(self, db_path=SQLITE_PATH, backup_dir=BACKUP_DIR, csv_inicial=CSV_PATH):
+        self.db_path = db_path
+        self.gen_path = db_path + ".gen"
+        self.backup_dir = backup_dir
+        # Una conexión por hilo (Streamlit atiende cada sesión en su propio hilo)
+        self._local = threading.local()
+        self._cola = ColaEscritura(self._aplicar_lote, nombre="sqlite")
+
+        asegurar_directorio(db_path)
+        with FileLock(db_path + ".init.lock", timeout=30):
+            conn = self._conn()
+            conn.executescript(_ESQUEMA_SQLITE)
+            columnas = {c[1] for c in conn.execute("PRAGMA table_info(requisiciones)")}
+            if "gen" not in columnas:
+                conn.execute("ALTER TABLE requisiciones ADD COLUMN gen INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_req_gen ON requisiciones(gen)")
+            conn.execute(
+                "INSERT OR IGNORE INTO secuencias (nombre, valor) "
+                "VALUES ('generacion', 0), ('reinicio', 0)"
+            )
+            vacia = conn.execute("SELECT COUNT(*) FROM requisiciones").fetchone()[0] == 0
+            if vacia and csv_inicial and os.path.exists(csv_inicial):
+                self.importar_csv(csv_inicial)
+            with self._escribir() as conn:
+                self._sincronizar_secuencia(conn)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _escribir(self):
+        """
+        Transacción de escritura: BEGIN IMMEDIATE toma el único escritor de WAL
+        desde el inicio, así dos altas no se cruzan entre el chequeo y el insert.
+        """
+        return _TransaccionSQLite(self._conn(), self.gen_path)
+
+    def version(self):
+        # La generación se publica en un archivo al confirmar cada transacción
+        return leer_generacion(self.gen_path)
+
+    @metricas.cronometrado("sqlite.respaldo")
+    def crear_respaldo(self, motivo="auto"):
+        os.makedirs(self.backup_dir, exist_ok=True)
+
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        backup_path = f"{self.backup_dir}/requisiciones_backup_{timestamp}_{motivo}.sqlite"
+
+        try:
+            destino = sqlite3.connect(backup_path)
+            with destino:
+                self._conn().backup(destino)
+            destino.close()
+        except Exception as e:
+            _avisar(f"⚠️ No se pudo crear respaldo de la base: {e}")
+
+    @staticmethod
+    def _sql_lectura(where="", orden="fecha_hora DESC, rid DESC", limite=""):
+        columnas = ", ".join(
+            "CAST(min_final AS TEXT) AS min_final" if c == "min_final" else c
+            for c in COLUMNAS_BASE
+        )
+        return f"SELECT {columnas} FROM requisiciones {where} ORDER BY {orden} {limite}"
+
+    def _leer_sql(self, where="", params=(), orden="fecha_hora DESC, rid DESC", limite=""):
+        df = pd.read_sql_query(self._sql_lectura(where, orden, limite), self._conn(), params=params)
+        df["min_final"] = df["min_final"].fillna("")
+        return df
+
+    @staticmethod
+    def _where_filtros(filtros):
+        filtros = filtros or {}
+        condiciones, params = [], []
+
+        for clave, columna in (("cuartos", "cuarto"), ("estados", "status")):
+            valores = list(filtros.get(clave) or [])
+            if valores:
+                condiciones.append(f"{columna} IN ({', '.join('?' for _ in valores)})")
+                params.extend(valores)
+        if filtros.get("issue") is not None:
+            condiciones.append("issue = ?")
+            params.append(int(bool(filtros["issue"])))
+        # fecha_hora es texto 'YYYY-MM-DD HH:MM:SS': el orden de texto es el cronológico
+        if filtros.get("desde"):
+            condiciones.append("fecha_hora >= ?")
+            params.append(pd.Timestamp(filtros["desde"]).strftime("%Y-%m-%d"))
+        if filtros.get("hasta"):
+            condiciones.append("fecha_hora < ?")
+            params.append((pd.Timestamp(filtros["hasta"]) + pd.Timedelta(days=1)).strftime("%Y-%m-%d"))
+
+        where = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+        return where, params
+
+    @metricas.cronometrado("sqlite.consultar")
+    def consultar(self, filtros=None, orden="fecha_hora", descendente=True, pagina=1, por_pagina=50):
+        """
+        Una página de requisiciones + total de filas que cumplen los filtros.
+        Filtros, orden y LIMIT / OFFSET se resuelven en SQLite con los índices.
+        Con filtros["historico"] se agregan los meses archivados del rango
+        (el archivo no está en la base: se combina y pagina en memoria).
+        """
+        if orden not in ORDENABLES:
+            raise ValueError(f"No se puede ordenar por {orden}")
+
+        if (filtros or {}).get("historico"):
+            df = con_historico(self._filtradas(filtros), filtros)
+            return paginar(df, orden, descendente, pagina, por_pagina), len(df)
+
+        where, params = self._where_filtros(filtros)
+        sentido = "DESC" if descendente else "ASC"
+        limite = ""
+        if por_pagina:
+            limite = f"LIMIT {int(por_pagina)} OFFSET {(max(int(pagina), 1) - 1) * int(por_pagina)}"
+
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            total = conn.execute(f"SELECT COUNT(*) FROM requisiciones {where}", params).fetchone()[0]
+            df = self._leer_sql(where, params, f"{orden} {sentido}, rid {sentido}", limite)
+        finally:
+            conn.execute("COMMIT")
+
+        df["issue"] = df["issue"].astype(bool)
+        return preparar_base(normalizar(df), ordenar=False), total
+
+    def iterar_consulta(self, filtros=None, orden="fecha_hora", descendente=True, tamano=50_000):
+        """
+        Todas las filas que cumplen los filtros, en bloques de `tamano`.
+        Un solo SELECT dentro de una transacción de lectura: en WAL todos
+        los bloques ven la misma foto aunque otros escriban mientras tanto.
+        Usa su propia conexión y la cierra al terminar o al cerrar el
+        generador, así una exportación abandonada no deja la transacción
+        abierta en la conexión del hilo.
+        """
+        if orden not in ORDENABLES:
+            raise ValueError(f"No se puede ordenar por {orden}")
+
+        if (filtros or {}).get("historico"):
+            df = paginar(con_historico(self._filtradas(filtros), filtros), orden, descendente, por_pagina=None)
+            for inicio in range(0, len(df), tamano):
+                yield df.iloc[inicio: inicio + tamano]
+            return
+
+        where, params = self._where_filtros(filtros)
+        sentido = "DESC" if descendente else "ASC"
+        sql = self._sql_lectura(where, f"{orden} {sentido}, rid {sentido}")
+
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        with contextlib.closing(conn):
+            conn.execute("BEGIN")
+            try:
+                for df in pd.read_sql_query(sql, conn, params=params, chunksize=tamano):
+                    df["min_final"] = df["min_final"].fillna("")
+                    df["issue"] = df["issue"].astype(bool)
+                    yield preparar_base(normalizar(df), ordenar=False)
+            finally:
+                conn.execute("COMMIT")
+
+    def _filtradas(self, filtros):
+        # Todas las filas que cumplen los filtros, por fecha desc
+        where, params = self._where_filtros(filtros)
+        df = self._leer_sql(where, params)
+        df["issue"] = df["issue"].astype(bool)
+        return preparar_base(normalizar(df), ordenar=False)
+
+    def refrescar(self):
+        # Cada consulta ya lee directo de la base
+        pass
+
+    def cargar(self):
+        df = self._leer_sql()
+        df["issue"] = df["issue"].astype(bool)
+        return normalizar(df)
+
+    @metricas.cronometrado("sqlite.cargar")
+    def cargar_cambios(self, estado=None):
+        """
+        Recarga incremental: cada fila lleva la generación en que se escribió,
+        así que basta leer las de generación mayor a la última vista.
+        Si hubo un reemplazo completo (reinicio) se lee todo.
+        Regresa (df, estado_nuevo, es_delta).
+        """
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            valores = dict(conn.execute(
+                "SELECT nombre, valor FROM secuencias WHERE nombre IN ('generacion', 'reinicio')"
+            ).fetchall())
+            generacion, reinicio = valores["generacion"], valores["reinicio"]
+            es_delta = bool(estado) and reinicio <= estado["gen"]
+            if es_delta:
+                df = self._leer_sql("WHERE gen > ?", (estado["gen"],))
+            else:
+                df = self._leer_sql()
+        finally:
+            conn.execute("COMMIT")
+
+        df["issue"] = df["issue"].astype(bool)
+        return normalizar(df), {"gen": generacion}, es_delta
+
+    def guardar_todo(self, df):
+        df_out = asegurar_columnas(df.drop(columns=["fecha_hora_dt"], errors="ignore").copy())
+        filas = [_fila_sqlite(f) for f in completar_uuids(df_out)[COLUMNAS_BASE].to_dict("records")]
+
+        self.crear_respaldo("pre_guardado")
+        with self._escribir() as conn:
+            conn.execute("DELETE FROM requisiciones")
+            # Las recargas incrementales no ven borrados: forzar lectura completa
+            conn.execute(f"UPDATE secuencias SET valor = {_SQL_GENERACION} WHERE nombre = 'reinicio'")
+            conn.executemany(self._sql_insert("INSERT OR IGNORE"), filas)
+            self._sincronizar_secuencia(conn)
+
+    @staticmethod
+    def _sincronizar_secuencia(conn):
+        # Tras importar / reemplazar datos la secuencia nunca queda por debajo del mayor folio
+        conn.execute(
+            f"INSERT INTO secuencias (nombre, valor) VALUES ('requisiciones', ({_SQL_MAX_FOLIO})) "
+            "ON CONFLICT(nombre) DO UPDATE SET valor = MAX(valor, excluded.valor)"
+        )
+
+    @staticmethod
+    def _reservar_folios(conn, cantidad=1):
+        """
+        Reserva `cantidad` folios consecutivos y regresa el primero.
+        Va dentro de la misma transacción que el alta.
+        """
+        conn.execute(
+            "UPDATE secuencias SET valor = valor + ? WHERE nombre = 'requisiciones'", (cantidad,)
+        )
+        ultimo = conn.execute(
+            "SELECT valor FROM secuencias WHERE nombre = 'requisiciones'"
+        ).fetchone()[0]
+        return ultimo - cantidad + 1
+
+    @staticmethod
+    def _sql_insert(verbo):
+        return (
+            f"{verbo} INTO requisiciones ({', '.join(COLUMNAS_BASE)}, gen) "
+            f"VALUES ({', '.join('?' for _ in COLUMNAS_BASE)}, {_SQL_GENERACION})"
+        )
+
+    def agregar(self, nueva_fila):
+        """
+        Inserta. Regresa (folio, insertada); el índice único de uuid evita duplicados.
+        El folio se asigna en la misma transacción que el insert, que la
+        cola de escritura comparte con las demás altas / ediciones del lote.
+        """
+        return self._cola.enviar("alta", dict(nueva_fila))
+
+    @metricas.cronometrado("sqlite.lote_masivo")
+    def agregar_lote(self, filas):
+        """
+        Alta masiva (importación) en una transacción: los uuid ya guardados
+        se buscan por bloques con IN (...), los folios salen de una sola
+        reserva y el insert es un executemany. Regresa un (folio, insertada)
+        por fila, en orden.
+        """
+        filas = [dict(fila) for fila in filas]
+        if not filas:
+            return []
+
+        uuids = list({str(f.get("uuid", "")) for f in filas} - {""})
+        resultados = [None] * len(filas)
+
+        with self._escribir() as conn:
+            previas = {}
+            for i in range(0, len(uuids), 500):
+                bloque = uuids[i:i + 500]
+                previas.update(conn.execute(
+                    f"SELECT uuid, ID FROM requisiciones WHERE uuid IN ({', '.join('?' for _ in bloque)})",
+                    bloque,
+                ).fetchall())
+
+            nuevas, vistas = [], {}
+            for i, fila in enumerate(filas):
+                u = str(fila.get("uuid", ""))
+                if u in previas:
+                    resultados[i] = (previas[u], False)
+                elif u and u in vistas:
+                    vistas[u].append(i)
+                else:
+                    nuevas.append((i, fila))
+                    if u:
+                        vistas[u] = []
+
+            sin_folio = [fila for _, fila in nuevas if not fila.get("ID")]
+            if sin_folio:
+                primero = self._reservar_folios(conn, len(sin_folio))
+                for n, fila in enumerate(sin_folio):
+                    fila["ID"] = formatear_folio(primero + n)
+
+            conn.executemany(self._sql_insert("INSERT"), [_fila_sqlite(fila) for _, fila in nuevas])
+            for i, fila in nuevas:
+                resultados[i] = (fila["ID"], True)
+                for j in vistas.get(str(fila.get("uuid", "")), []):
+                    resultados[j] = (fila["ID"], False)
+
+        return resultados
+
+    def actualizar_requisicion(self, uuid_val, id_val, status, almacenista, issue):
+        datos = (uuid_val, id_val, status, almacenista, issue)
+        encontrada = self._cola.enviar("edicion", datos)
+        if not encontrada and reactivar_archivada(self, uuid_val, id_val):
+            encontrada = self._cola.enviar("edicion", datos)
+        return encontrada
+
+    @metricas.cronometrado("sqlite.lote")
+    def _aplicar_lote(self, comandos):
+        """
+        Aplica un lote de la cola de escritura en una sola transacción
+        (un COMMIT / fsync del WAL). Regresa un resultado por comando.
+        """
+        with self._escribir() as conn:
+            return [
+                self._alta(conn, datos) if tipo == "alta" else self._edicion(conn, *datos)
+                for tipo, datos in comandos
+            ]
+
+    def _alta(self, conn, nueva_fila):
+        previa = conn.execute(
+            "SELECT ID FROM requisiciones WHERE uuid = ? AND uuid <> ''", (str(nueva_fila["uuid"]),)
+        ).fetchone()
+        if previa is not None:
+            return previa[0], False
+
+        if not nueva_fila.get("ID"):
+            nueva_fila["ID"] = formatear_folio(self._reservar_folios(conn))
+
+        conn.execute(self._sql_insert("INSERT"), _fila_sqlite(nueva_fila))
+        return nueva_fila["ID"], True
+
+    @staticmethod
+    def _edicion(conn, uuid_val, id_val, status, almacenista, issue):
+        uuid_val = str(uuid_val or "").strip()
+        if uuid_val:
+            where, clave = "uuid = ?", uuid_val
+        else:
+            where, clave = "ID = ?", str(id_val)
+
+        fila = conn.execute(
+            f"SELECT rid, fecha_hora, min_final FROM requisiciones WHERE {where} "
+            "ORDER BY rid LIMIT 1",
+            (clave,),
+        ).fetchone()
+        if fila is None:
+            return False
+
+        rid, fecha_hora, min_final_actual = fila
+        min_final = calcular_min_final(
+            status, fecha_hora, "" if min_final_actual is None else min_final_actual
+        )
+        conn.execute(
+            "UPDATE requisiciones SET status = ?, almacenista = ?, issue = ?, min_final = ?, "
+            f"gen = {_SQL_GENERACION} WHERE rid = ?",
+            (status, str(almacenista).strip(), int(bool(issue)), _a_entero_o_none(min_final), rid),
+        )
+        return True
+
+    @metricas.cronometrado("sqlite.archivar")
+    def archivar(self, dias=None):
+        """
+        Mueve al archivo histórico las requisiciones cerradas con más de
+        `dias` días, en la misma transacción que las borra de la base.
+        Regresa cuántas se archivaron.
+        """
+        if not historico.disponible():
+            return 0
+
+        dias = historico.DIAS_ARCHIVO if dias is None else dias
+        corte = (hora_local() - timedelta(days=dias)).strftime("%Y-%m-%d %H:%M:%S")
+        where = (
+            f"WHERE status IN ({', '.join('?' for _ in ESTADOS_FINALES)}) "
+            "AND fecha_hora <> '' AND fecha_hora < ?"
+        )
+        params = [*ESTADOS_FINALES, corte]
+
+        with self._escribir() as conn:
+            df = pd.read_sql_query(self._sql_lectura(where), conn, params=params)
+            if df.empty:
+                return 0
+            df["min_final"] = df["min_final"].fillna("")
+
+            historico.escribir(para_archivo(df))
+            conn.execute(f"DELETE FROM requisiciones {where}", params)
+            # Los borrados no viajan en la recarga incremental: se fuerza una completa
+            conn.execute(f"UPDATE secuencias SET valor = {_SQL_GENERACION} WHERE nombre = 'reinicio'")
+
+        return len(df)
+
+    def exportar_csv(self, ruta):
+        df = self._leer_sql()
+        df["issue"] = df["issue"].astype(bool)
+        df.to_csv(ruta, index=False, encoding="utf-8-sig")
+
+    def importar_csv(self, ruta):
+        """
+        Agrega las filas del CSV (las de uuid ya existente se ignoran).
+        """
+        df = completar_uuids(asegurar_columnas(leer_csv_seguro(ruta)))
+        filas = [_fila_sqlite(f) for f in df[COLUMNAS_BASE].to_dict("records")]
+        with self._escribir() as conn:
+            conn.executemany(self._sql_insert("INSERT OR IGNORE"), filas)
+            self._sincronizar_secuencia(conn)
+
+class _TransaccionSQLite:
+    """
+    Cada transacción de escritura sube la generación al iniciar (las filas
+    que escribe quedan marcadas con ella) y la publica en el archivo .gen
+    después del COMMIT. BEGIN IMMEDIATE es el lock de escritura de SQLite:
+    su espera y lo que dura la transacción quedan en metricas como
+    sqlite.escritura.lock_*.
+    """
+
+    def __init__(self, conn, gen_path):
+        self.conn = conn
+        self.gen_path = gen_path
+
+    def __enter__(self):
+        inicio = time.perf_counter()
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            metricas.contar("sqlite.escritura.lock_fallido")
+            raise
+        finally:
+            self._adquirido = time.perf_counter()
+            metricas.registrar("sqlite.escritura.lock_espera", self._adquirido - inicio)
+        self.conn.execute("UPDATE secuencias SET valor = valor + 1 WHERE nombre = 'generacion'")
+        self.generacion = self.conn.execute(
+            "SELECT valor FROM secuencias WHERE nombre = 'generacion'"
+        ).fetchone()[0]
+        return self.conn
+
+    def __exit__(self, tipo, valor, tb):
+        try:
+            if tipo is not None:
+                self.conn.execute("ROLLBACK")
+                return False
+
+            self.conn.execute("COMMIT")
+        finally:
+            metricas.registrar("sqlite.escritura.lock_retenido", time.perf_counter() - self._adquirido)
+        with _despues_de_escribir():
+            escribir_generacion(self.gen_path, self.generacion)
+        return False
+
+# ============================================================
+# COLA DE ESCRITURA (GROUP COMMIT)
+# ============================================================
+
+@contextlib.contextmanager
+def _despues_de_escribir():
+    """
+    Marca los errores que ocurren con el lote ya guardado (lote_escrito):
+    ColaEscritura no reintenta esos comandos, volverían a aplicarse.
+    """
+    try:
+        yield
+    except Exception as e:
+        e.lote_escrito = True
+        raise
+
+class _Comando:
+    def __init__(self, tipo, datos):
+        self.tipo = tipo
+        self.datos = datos
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+class ColaEscritura:
+    """
+    Escritor único por almacén. Los hilos de las sesiones encolan altas /
+    ediciones y esperan; el hilo de fondo toma todo lo que haya en la cola
+    (hasta MAX_LOTE), lo aplica con aplicar_lote(comandos) en una sola
+    escritura y despierta a cada quien con su resultado o su error.
+
+    Con varios usuarios a la vez el lock se toma una vez por lote, no una
+    vez por requisición, así que el throughput crece con el tamaño de la
+    ráfaga en lugar de formar fila en el FileLock.
+    """
+
+    def __init__(self, aplicar_lote, max_lote=None, nombre="cola"):
+        self.aplicar_lote = aplicar_lote
+        self.max_lote = max_lote or MAX_LOTE
+        self.nombre = nombre
+        self._cola = queue.Queue()
+        self._hilo = None
+        self._hilo_lock = threading.Lock()
+
+    def enviar(self, tipo, datos):
+        """
+        Encola un comando y espera a que su lote quede guardado.
+        Regresa el resultado del comando o levanta su error.
+        El tiempo total (cola + lote) queda en metricas como <nombre>.<tipo>.
+        """
+        with metricas.medir(f"{self.nombre}.{tipo}"):
+            return self._enviar(tipo, datos)
+
+    def _enviar(self, tipo, datos):
+        if not ESCRITURA_EN_GRUPO:
+            return self.aplicar_lote([(tipo, datos)])[0]
+
+        comando = _Comando(tipo, datos)
+        self._iniciar()
+        self._cola.put(comando)
+        comando.listo.wait()
+        if comando.error is not None:
+            raise comando.error
+        return comando.resultado
+
+    def _iniciar(self):
+        with self._hilo_lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ciclo, name="cola-escritura", daemon=True)
+                self._hilo.start()
+
+    def _ciclo(self):
+        while True:
+            lote = [self._cola.get()]
+            while len(lote) < self.max_lote:
+                try:
+                    lote.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            self._procesar(lote)
+
+    def _procesar(self, lote):
+        metricas.contar(f"{self.nombre}.lotes")
+        metricas.contar(f"{self.nombre}.comandos", len(lote))
+        try:
+            resultados = self.aplicar_lote([(c.tipo, c.datos) for c in lote])
+        except Exception as e:
+            # Lock ocupado: reintentar uno por uno solo multiplicaría la espera.
+            # Si el lote ya se guardó, reintentarlo lo aplicaría dos veces.
+            if len(lote) > 1 and not isinstance(e, Timeout) and not getattr(e, "lote_escrito", False):
+                # Un comando con error no tumba a los demás: se reintentan uno por uno
+                for comando in lote:
+                    self._procesar([comando])
+                return
+            for comando in lote:
+                comando.error = e
+                comando.listo.set()
+            return
+
+        for comando, resultado in zip(lote, resultados):
+            comando.resultado = resultado
+            comando.listo.set()
+
+# ============================================================
+# ESQUEMA COMPACTO EN MEMORIA
+# ============================================================
+
+# Tipos del frame compartido. Los textos de pocos valores van como
+# categóricas (códigos enteros), uuid como 128 bits en dos uint64 y la
+# fecha ya parseada; fecha_hora / uuid en texto se regeneran solo para
+# la página que se muestra o exporta. Los uuid que no saldrían idénticos
+# de los enteros (mayúsculas, sin guiones, no-uuid) van tal cual en
+# uuid_texto, que queda vacío para todos los demás.
+ESQUEMA = {
+    "ID": "object",
+    "uuid_hi": "uint64",
+    "uuid_lo": "uint64",
+    "uuid_texto": "category",
+    "fecha_hora_dt": "datetime64[ns]",
+    "cuarto": CUARTOS,
+    "work_order": "object",
+    "numero_parte": "object",
+    "numero_lote": "object",
+    "cantidad": "int32",
+    "motivo": MOTIVOS,
+    "status": ESTADOS,
+    "almacenista": "category",
+    "issue": "bool",
+    "min_final": "Int32",
+}
+
+_UUID_CANONICO = r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+
+def uuid_exactos(serie):
+    """
+    Máscara de los uuid que enteros_a_uuid() regresa idénticos: forma
+    canónica (minúsculas con guiones) y distintos de cero.
+    """
+    texto = serie.astype(str)
+    return (texto.str.fullmatch(_UUID_CANONICO).fillna(False) & texto.str.strip("0-").ne("")).to_numpy(dtype=bool)
+
+def uuid_a_enteros(serie):
+    """
+    uuid en texto -> (hi, lo) uint64. Solo se empacan los exactos (ver
+    uuid_exactos); vacíos y el resto quedan en 0 y viajan en uuid_texto.
+    """
+    validos = uuid_exactos(serie)
+    texto = serie.astype(str).str.replace("-", "", regex=False)
+
+    hi = np.zeros(len(texto), dtype=np.uint64)
+    lo = np.zeros(len(texto), dtype=np.uint64)
+    if validos.any():
+        crudo = np.frombuffer(bytes.fromhex("".join(texto[validos].tolist())), dtype=">u8")
+        crudo = crudo.reshape(-1, 2).astype(np.uint64)
+        hi[validos] = crudo[:, 0]
+        lo[validos] = crudo[:, 1]
+    return hi, lo
+
+def enteros_a_uuid(hi, lo):
+    return [
+        str(uuid.UUID(int=(int(h) << 64) | int(l))) if (h or l) else ""
+        for h, l in zip(hi, lo)
+    ]
+
+def _categoria(serie, conocidos):
+    # Conocidos primero (códigos estables) + valores fuera de lista que traigan los datos
+    categorica = serie.astype(str).astype("category")
+    extras = sorted(set(categorica.cat.categories) - set(conocidos) - {""})
+    return categorica.cat.set_categories(list(conocidos) + extras).array
+
+def aplicar_esquema(df):
+    """
+    Frame preparado (preparar_base) -> frame compacto según ESQUEMA.
+    Las columnas que no son del esquema (restos de versiones anteriores
+    del CSV) se descartan.
+    """
+    hi, lo = uuid_a_enteros(df["uuid"]) if "uuid" in df.columns else (None, None)
+
+    compacto = {}
+    for columna, tipo in ESQUEMA.items():
+        if columna == "uuid_hi":
+            compacto[columna] = hi if hi is not None else np.zeros(len(df), dtype=np.uint64)
+        elif columna == "uuid_lo":
+            compacto[columna] = lo if lo is not None else np.zeros(len(df), dtype=np.uint64)
+        elif columna == "uuid_texto":
+            texto = df["uuid"].astype(str) if "uuid" in df.columns else pd.Series("", index=df.index)
+            compacto[columna] = _categoria(texto.where(~uuid_exactos(texto), ""), [])
+        elif isinstance(tipo, list):
+            compacto[columna] = _categoria(df[columna], tipo)
+        elif tipo == "category":
+            compacto[columna] = _categoria(df[columna], [])
+        elif tipo == "object":
+            compacto[columna] = df[columna].astype(str).array
+        else:
+            compacto[columna] = df[columna].astype(tipo).array
+
+    return pd.DataFrame(compacto, index=df.index)
+
+def a_formato_externo(df):
+    """
+    Frame compacto (normalmente una página) -> columnas que usa la app:
+    COLUMNAS_BASE con uuid / fecha_hora en texto + fecha_hora_dt.
+    """
+    if "uuid_hi" not in df.columns:
+        return df
+
+    externo = df.drop(columns=["uuid_hi", "uuid_lo", "uuid_texto"])
+    texto = df["uuid_texto"].astype(object).fillna("").to_numpy()
+    empacados = enteros_a_uuid(df["uuid_hi"].to_numpy(), df["uuid_lo"].to_numpy())
+    externo["uuid"] = [t or e for t, e in zip(texto, empacados)]
+    externo["fecha_hora"] = df["fecha_hora_dt"].dt.strftime("%Y-%m-%d %H:%M:%S").fillna("")
+    for columna, tipo in ESQUEMA.items():
+        if (isinstance(tipo, list) or tipo == "category") and columna in externo.columns:
+            # Los vacíos quedan fuera de las categorías (NaN); afuera vuelven a ser ""
+            externo[columna] = externo[columna].astype(object).fillna("").astype(str)
+    return externo[COLUMNAS_BASE + ["fecha_hora_dt"]]
+
+def _alinear_categorias(a, b):
+    # Para concatenar sin perder el tipo categórico, ambas partes usan la unión de categorías
+    for columna in a.columns:
+        if isinstance(a[columna].dtype, pd.CategoricalDtype) and columna in b.columns:
+            categorias = list(a[columna].cat.categories)
+            nuevas = [c for c in b[columna].cat.categories if c not in set(categorias)]
+            if nuevas:
+                a[columna] = a[columna].cat.add_categories(nuevas)
+            b[columna] = b[columna].cat.set_categories(a[columna].cat.categories)
+    return a, b
+
+def reporte_memoria(df):
+    """
+    Bytes por columna (deep) del frame; última fila = total.
+    """
+    if df is None:
+        return pd.DataFrame(columns=["columna", "tipo", "bytes"])
+
+    uso = df.memory_usage(deep=True, index=True)
+    filas = [
+        {"columna": c, "tipo": str(df[c].dtype) if c in df.columns else "índice", "bytes": int(b)}
+        for c, b in uso.items()
+    ]
+    filas.append({"columna": "TOTAL", "tipo": f"{len(df)} filas", "bytes": int(uso.sum())})
+    return pd.DataFrame(filas)
+
+# ============================================================
+# CACHE COMPARTIDA POR PROCESO
+# ============================================================
+
+def preparar_base(df, ordenar=True):
+    """
+    Frame base que comparten todas las sesiones: min_final numérico
+    y orden por fecha desc. No incluye columnas que dependen de la hora.
+    """
+    df = df.fillna("")
+
+    if "min_final" not in df.columns:
+        df["min_final"] = None
+
+    # "" / "None" / "nan" -> <NA>; "12.0" -> 12
+    df["min_final"] = np.trunc(pd.to_numeric(df["min_final"], errors="coerce")).astype("Int64")
+    # normalizar() ya la parseó; solo se parsea si falta
+    if "fecha_hora_dt" not in df.columns:
+        df["fecha_hora_dt"] = pd.to_datetime(df["fecha_hora"], errors="coerce")
+
+    if not ordenar:
+        return df
+    return df.sort_values(by="fecha_hora_dt", ascending=False)
+
+def fusionar_cambios(df_base, df_delta):
+    """
+    Integra filas nuevas / modificadas (ya preparadas) al frame base:
+    la versión del delta reemplaza a la anterior con el mismo uuid.
+    """
+    if df_delta.empty:
+        return df_base
+
+    if "uuid_hi" in df_base.columns:
+        # Frames compactos: la llave es el par (uuid_hi, uuid_lo), o uuid_texto si no se empacó
+        llave_delta = pd.MultiIndex.from_arrays([df_delta["uuid_hi"], df_delta["uuid_lo"]])
+        llave_base = pd.MultiIndex.from_arrays([df_base["uuid_hi"], df_base["uuid_lo"]])
+        reemplazadas = llave_base.isin(llave_delta[(df_delta["uuid_hi"] | df_delta["uuid_lo"]) != 0])
+        textos_delta = set(df_delta["uuid_texto"].dropna().astype(str)) - {""}
+        if textos_delta:
+            reemplazadas |= df_base["uuid_texto"].astype(object).isin(textos_delta).to_numpy()
+        df_base, df_delta = _alinear_categorias(df_base[~reemplazadas].copy(), df_delta.copy())
+    else:
+        uuids_delta = set(df_delta["uuid"].astype(str)) - {""}
+        if uuids_delta:
+            df_base = df_base[~df_base["uuid"].astype(str).isin(uuids_delta)]
+
+    df = pd.concat([df_delta, df_base])
+    return df.sort_values(by="fecha_hora_dt", ascending=False, kind="stable")
+
+class CacheCompartida:
+    """
+    Un solo frame parseado por proceso, compartido por todas las sesiones.
+    Se invalida cuando cambia almacen.version(); mientras no haya cambios,
+    cada sesión solo paga el chequeo de versión.
+
+    El frame que regresa obtener() es compartido y compacto (ESQUEMA):
+    no se debe modificar en sitio; a_formato_externo() da las columnas de la app.
+    """
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        self._lock = threading.Lock()
+        self._version = None
+        self._estado = None
+        self._df = None
+
+    def obtener(self, forzar=False):
+        version = self.almacen.version()
+        if not forzar and self._df is not None and version == self._version:
+            return self._df
+
+        with metricas.con_lock(self._lock, "cache"):
+            # Otra sesión pudo recargar mientras esperábamos el lock
+            version = self.almacen.version()
+            if forzar or self._df is None or version != self._version:
+                estado = None if (forzar or self._df is None) else self._estado
+                df, self._estado, es_delta = self.almacen.cargar_cambios(estado)
+                with metricas.medir("cache.delta" if es_delta else "cache.completa"):
+                    if es_delta:
+                        self._df = fusionar_cambios(self._df, aplicar_esquema(preparar_base(df)))
+                    else:
+                        self._df = aplicar_esquema(preparar_base(df))
+                self._version = version
+            return self._df
+
+    def frame_actual(self):
+        # Lo que haya en memoria, sin revisar versión (para reportes)
+        return self._df
+
+_caches = {}
+
+def obtener_cache(almacen):
+    with _almacenes_lock:
+        if almacen.nombre not in _caches:
+            _caches[almacen.nombre] = CacheCompartida(almacen)
+        return _caches[almacen.nombre]
+
+# ============================================================
+# ARCHIVO HISTÓRICO (CERRADAS Y VIEJAS)
+# ============================================================
+
+def filas_archivables(df, dias=None):
+    """
+    Máscara (numpy) de filas en status final con fecha anterior a hoy - dias.
+    df con columnas del almacén en texto (sin normalizar).
+    """
+    dias = historico.DIAS_ARCHIVO if dias is None else dias
+    corte = pd.Timestamp(hora_local() - timedelta(days=dias))
+    fechas = pd.to_datetime(df["fecha_hora"], errors="coerce")
+    return (df["status"].isin(ESTADOS_FINALES) & (fechas < corte)).to_numpy(dtype=bool)
+
+def para_archivo(df):
+    """
+    Filas del almacén -> columnas con tipo fijo para Parquet (todas las
+    partes con el mismo esquema, vengan del CSV o de SQLite).
+    """
+    df = asegurar_columnas(df.copy())[COLUMNAS_BASE]
+    for columna in COLUMNAS_BASE:
+        if columna not in ("cantidad", "issue", "min_final"):
+            df[columna] = df[columna].astype(str)
+    df["cantidad"] = pd.to_numeric(df["cantidad"], errors="coerce").fillna(0).astype("int32")
+    df["issue"] = df["issue"].astype(str).str.lower().isin(["true", "1", "yes", "si", "sí"])
+    df["min_final"] = np.trunc(pd.to_numeric(df["min_final"], errors="coerce")).astype("Int32")
+    return df.reset_index(drop=True)
+
+def con_historico(df, filtros):
+    """
+    Frame filtrado del almacén (formato externo) + filas archivadas de los
+    meses del rango con los mismos filtros, por fecha desc. Si una fila
+    está en ambos lados (se reactivó) vale la del almacén.
+    """
+    filtros = filtros or {}
+    if not historico.disponible():
+        if historico.meses_archivados():
+            _avisar("⚠️ Hay archivo histórico pero falta pyarrow para leerlo.")
+        return df
+
+    frias = historico.leer(filtros.get("desde"), filtros.get("hasta"))
+    if frias.empty:
+        return df
+
+    frias = normalizar(asegurar_columnas(frias.astype({"min_final": "object"})))
+    frias = filtrar_frame(preparar_base(frias, ordenar=False), filtros)
+    frias = frias[~frias["uuid"].astype(str).isin(set(df["uuid"].astype(str)) - {""})]
+    if frias.empty:
+        return df
+
+    columnas = COLUMNAS_BASE + ["fecha_hora_dt"]
+    combinado = pd.concat([df[columnas], frias[columnas]], ignore_index=True)
+    return combinado.sort_values(by="fecha_hora_dt", ascending=False, kind="stable")
+
+def reactivar_archivada(almacen, uuid_val, id_val):
+    """
+    Si la requisición está en el archivo, la regresa al almacén (mismo
+    uuid e ID) para poder editarla. Regresa True si la reactivó.
+    """
+    fila = historico.buscar(uuid_val, id_val)
+    if fila is None:
+        return False
+
+    fila = {
+        c: ("" if pd.isna(v) else v.item() if hasattr(v, "item") else v)
+        for c, v in fila.items() if c in COLUMNAS_BASE
+    }
+    _, insertada = almacen.agregar(fila)
+    return insertada
+
+# ============================================================
+# AVISO DE CAMBIOS
+# ============================================================
+
+class VigilanteCambios:
+    """
+    Un hilo por proceso revisa almacen.version() cada INTERVALO_VIGILANCIA
+    segundos (stat / lectura del .gen, sin tocar los datos) y publica la
+    última versión vista. Las sesiones solo comparan contra ella, así que
+    mientras nadie escribe no hay ninguna recarga.
+
+    Al ver un cambio primero actualiza el frame compartido (si el motor
+    lo usa) y luego publica la versión: las sesiones que se recargan por
+    el aviso ya encuentran los datos listos.
+    """
+
+    def __init__(self, almacen, intervalo=None):
+        self.almacen = almacen
+        self.intervalo = intervalo or INTERVALO_VIGILANCIA
+        self._version = almacen.version()
+        self._cambio = threading.Condition()
+        self._hilo = None
+        self._hilo_lock = threading.Lock()
+        self._ultimo_error = None
+
+    def version(self):
+        self._iniciar()
+        return self._version
+
+    def esperar_cambio(self, version, timeout=None):
+        """
+        Bloquea hasta que la versión publicada sea distinta de `version`
+        (o se acabe el timeout) y regresa la versión vigente.
+        """
+        self._iniciar()
+        with self._cambio:
+            self._cambio.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def _iniciar(self):
+        with self._hilo_lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ciclo, name="vigilante-cambios", daemon=True)
+                self._hilo.start()
+
+    def _ciclo(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                version = self.almacen.version()
+                if version == self._version:
+                    continue
+                cache = _caches.get(self.almacen.nombre)
+                if cache is not None and cache.frame_actual() is not None:
+                    cache.obtener()
+            except Exception as e:
+                # Se reintenta en la siguiente vuelta; el aviso sale una vez por error distinto
+                if str(e) != self._ultimo_error:
+                    self._ultimo_error = str(e)
+                    _avisar(f"⚠️ No se pudo revisar si hubo cambios: {e}")
+                continue
+
+            with self._cambio:
+                self._version = version
+                self._cambio.notify_all()
+
+_vigilantes = {}
+
+def obtener_vigilante(almacen):
+    with _almacenes_lock:
+        if almacen.nombre not in _vigilantes:
+            _vigilantes[almacen.nombre] = VigilanteCambios(almacen)
+        return _vigilantes[almacen.nombre]
+
+# ============================================================
+# SELECCIÓN DE MOTOR
+# ============================================================
+
+MOTORES = {"csv": AlmacenCSV, "sqlite": AlmacenSQLite}
+
+_almacenes = {}
+_almacenes_lock = threading.Lock()
+
+def obtener_almacen(motor=None):
+    """
+    Instancia única por proceso del motor indicado ("csv" o "sqlite").
+    Sin argumento usa la variable de entorno REQUISICIONES_MOTOR (default csv).
+    """
+    motor = (motor or os.environ.get("REQUISICIONES_MOTOR") or "csv").lower()
+    if motor not in MOTORES:
+        raise ValueError(f"Motor de almacenamiento desconocido: {motor}")
+
+    with _almacenes_lock:
+        if motor not in _almacenes:
+            _almacenes[motor] = MOTORES[motor]()
+        return _almacenes[motor]
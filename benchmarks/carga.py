@@ -0,0 +1,309 @@
+"""
+Prueba de carga: muchos usuarios de piso y pantallas de almacén a la vez.
+
+Cada proceso abre su propio almacén sobre los mismos archivos (como
+varios workers de Streamlit) y corre varios hilos (uno por sesión):
+    piso     "Guardar Requisición": altas con pausas al azar entre una y otra
+    almacén  refresca la lista de pendientes y cambia el status de una
+
+Al terminar se lee el almacén desde cero y se revisa que:
+    - toda alta confirmada exista (altas perdidas)
+    - no haya folios repetidos
+    - toda edición confirmada haya quedado (ediciones perdidas); cada
+      pantalla solo edita "sus" requisiciones, así la última edición
+      confirmada de cada una es la que debe verse
+
+Reporta throughput, latencias p50 / p95 / p99 de las altas, tasa de
+timeouts de lock de las altas (y timeouts por operación) y los tiempos
+de lock de metricas. Termina con código
+1 si hubo folios repetidos o escrituras perdidas.
+
+Uso:
+    python benchmarks/carga.py --motor csv --procesos 4 --usuarios 40 --pantallas 6 --duracion 60
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+from filelock import Timeout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import almacenamiento
+import metricas
+import generador
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+RESULTADOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados")
+
+PROCESOS = 4
+USUARIOS = 24                    # sesiones de piso (altas)
+PANTALLAS = 4                    # sesiones de almacén (refrescar + editar)
+DURACION = 30                    # segundos de carga
+PAUSA_PISO = 0.5                 # promedio (s) entre altas de un mismo usuario
+PAUSA_PANTALLA = 1.0             # promedio (s) entre refrescos de una pantalla
+FILAS_INICIALES = 10_000
+
+# ==========================
+# SESIONES
+# ==========================
+
+def _es_timeout(error):
+    # FileLock (motor CSV) o "database is locked" (SQLite)
+    return isinstance(error, Timeout) or (
+        isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+    )
+
+def _falla(resultado, operacion, error):
+    # Por operación: la tasa de timeouts de las altas no debe mezclar refrescos / ediciones
+    resultado["timeouts" if _es_timeout(error) else "errores"].append((operacion, repr(error)))
+
+def _fila(rng):
+    return {
+        "uuid": str(uuid.uuid4()),
+        "fecha_hora": almacenamiento.hora_local().strftime("%Y-%m-%d %H:%M:%S"),
+        "cuarto": rng.choice(almacenamiento.CUARTOS),
+        "work_order": str(rng.integers(400_000, 600_000)),
+        "numero_parte": f"P-{rng.integers(0, 5_000):05d}",
+        "numero_lote": f"L{rng.integers(0, 1_000_000):06d}",
+        "cantidad": int(rng.integers(1, 500)),
+        "motivo": rng.choice(almacenamiento.MOTIVOS),
+        "status": "Pendiente",
+        "almacenista": "",
+        "issue": False,
+        "min_final": "",
+    }
+
+def _usuario_piso(almacen, sesion, fin, pausa, resultado):
+    rng = np.random.default_rng(sesion)
+    while time.time() < fin:
+        time.sleep(rng.exponential(pausa))
+        fila = _fila(rng)
+        inicio = time.perf_counter()
+        try:
+            folio, insertada = almacen.agregar(fila)
+        except Exception as e:
+            _falla(resultado, "alta", e)
+            continue
+        resultado["altas"].append((fila["uuid"], folio, insertada, time.perf_counter() - inicio))
+
+def _es_de_pantalla(uuid_val, pantalla, pantallas):
+    return int(uuid_val.replace("-", "")[:8] or "0", 16) % pantallas == pantalla
+
+def _pantalla_almacen(almacen, pantalla, pantallas, fin, pausa, resultado):
+    rng = np.random.default_rng(10_000 + pantalla)
+    contador = 0
+    while time.time() < fin:
+        time.sleep(rng.exponential(pausa))
+        inicio = time.perf_counter()
+        try:
+            pagina, _ = almacen.consultar({"estados": ["Pendiente", "En proceso"]}, por_pagina=50)
+        except Exception as e:
+            _falla(resultado, "refresco", e)
+            continue
+        resultado["refrescos"].append(time.perf_counter() - inicio)
+
+        propias = [
+            (u, i, s) for u, i, s in zip(pagina["uuid"], pagina["ID"], pagina["status"])
+            if _es_de_pantalla(u, pantalla, pantallas)
+        ]
+        if not propias:
+            continue
+
+        uuid_val, id_val, status = propias[0]
+        contador += 1
+        nuevo = "En proceso" if status == "Pendiente" else "Entregado"
+        almacenista = f"pantalla-{pantalla}-{contador}"
+        inicio = time.perf_counter()
+        try:
+            ok = almacen.actualizar_requisicion(uuid_val, id_val, nuevo, almacenista, False)
+        except Exception as e:
+            _falla(resultado, "edicion", e)
+            continue
+        resultado["ediciones"].append((uuid_val, nuevo, almacenista, ok, time.perf_counter() - inicio))
+
+def _proceso(motor, directorio, sesiones, inicio, duracion, pausa_piso, pausa_pantalla, pantallas):
+    """
+    Un worker: su propio almacén y un hilo por sesión. Regresa lo que vio cada sesión.
+    """
+    os.chdir(directorio)
+    almacen = almacenamiento.obtener_almacen(motor)
+    resultado = {"altas": [], "ediciones": [], "refrescos": [], "timeouts": [], "errores": []}
+
+    fin = inicio + duracion
+    hilos = []
+    for rol, n in sesiones:
+        if rol == "piso":
+            args = (almacen, n, fin, pausa_piso, resultado)
+            objetivo = _usuario_piso
+        else:
+            args = (almacen, n, pantallas, fin, pausa_pantalla, resultado)
+            objetivo = _pantalla_almacen
+        hilos.append(threading.Thread(target=objetivo, args=args, daemon=True))
+
+    time.sleep(max(0.0, inicio - time.time()))
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+    resultado["metricas"] = metricas.resumen()[0]
+    return resultado
+
+# ==========================
+# VERIFICACIÓN / REPORTE
+# ==========================
+
+def _percentiles(valores):
+    if not valores:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    arr = np.array(valores) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(arr, 50)), 2),
+        "p95_ms": round(float(np.percentile(arr, 95)), 2),
+        "p99_ms": round(float(np.percentile(arr, 99)), 2),
+        "max_ms": round(float(arr.max()), 2),
+    }
+
+def verificar(motor, directorio, resultados):
+    """
+    Compara lo confirmado por las sesiones contra lo que quedó guardado.
+    """
+    os.chdir(directorio)
+    final = almacenamiento.MOTORES[motor]().cargar()
+    guardadas = dict(zip(final["uuid"].astype(str), zip(final["ID"], final["status"], final["almacenista"])))
+
+    altas = [a for r in resultados for a in r["altas"]]
+    confirmadas = [a for a in altas if a[2]]
+    perdidas = [u for u, _, _, _ in confirmadas if u not in guardadas]
+    folio_distinto = [u for u, folio, _, _ in confirmadas if u in guardadas and guardadas[u][0] != folio]
+
+    # Última edición confirmada de cada requisición (cada una la edita una sola pantalla, en orden)
+    ultima = {}
+    for r in resultados:
+        for uuid_val, status, almacenista, ok, _ in r["ediciones"]:
+            if ok:
+                ultima[uuid_val] = (status, almacenista)
+    ediciones_perdidas = [
+        u for u, (status, almacenista) in ultima.items()
+        if guardadas.get(u, (None, None, None))[1:] != (status, almacenista)
+    ]
+
+    ids = final["ID"].astype(str)
+    return {
+        "filas_finales": len(final),
+        "altas_confirmadas": len(confirmadas),
+        "altas_perdidas": len(perdidas),
+        "folios_distintos_al_confirmado": len(folio_distinto),
+        "ids_duplicados": int(ids[ids != ""].duplicated().sum()),
+        "folios_confirmados_repetidos": len(confirmadas) - len({folio for _, folio, _, _ in confirmadas}),
+        "ediciones_confirmadas": len(ultima),
+        "ediciones_perdidas": len(ediciones_perdidas),
+    }
+
+def _repartir(procesos, usuarios, pantallas):
+    # Sesiones por proceso, en round robin (como el balanceo entre workers)
+    sesiones = [("piso", n) for n in range(usuarios)] + [("almacen", n) for n in range(pantallas)]
+    return [sesiones[i::procesos] for i in range(procesos)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga concurrente del almacenamiento.")
+    parser.add_argument("--motor", default="csv", choices=sorted(almacenamiento.MOTORES))
+    parser.add_argument("--procesos", type=int, default=PROCESOS)
+    parser.add_argument("--usuarios", type=int, default=USUARIOS)
+    parser.add_argument("--pantallas", type=int, default=PANTALLAS)
+    parser.add_argument("--duracion", type=float, default=DURACION)
+    parser.add_argument("--pausa-piso", type=float, default=PAUSA_PISO)
+    parser.add_argument("--pausa-pantalla", type=float, default=PAUSA_PANTALLA)
+    parser.add_argument("--filas-iniciales", type=int, default=FILAS_INICIALES)
+    parser.add_argument("--salida", help="JSON del reporte (default benchmarks/resultados/carga_<fecha>.json)")
+    args = parser.parse_args(argv)
+
+    directorio = tempfile.mkdtemp(prefix=f"carga_{args.motor}_")
+    directorio_original = os.getcwd()
+    try:
+        # Historial inicial sintético en la ruta default del motor (data/requisiciones.csv)
+        csv_path = os.path.join(directorio, almacenamiento.CSV_PATH)
+        almacenamiento.asegurar_directorio(csv_path)
+        if args.filas_iniciales:
+            shutil.copyfile(generador.csv_sintetico(args.filas_iniciales), csv_path)
+
+        # El primer worker no debe pagar la importación / el índice dentro de la medición
+        os.chdir(directorio)
+        almacenamiento.MOTORES[args.motor]().cargar()
+        os.chdir(directorio_original)
+
+        inicio = time.time() + 3
+        contexto = multiprocessing.get_context("spawn")
+        with contexto.Pool(args.procesos) as pool:
+            pendientes = [
+                pool.apply_async(_proceso, (
+                    args.motor, directorio, sesiones, inicio, args.duracion,
+                    args.pausa_piso, args.pausa_pantalla, args.pantallas,
+                ))
+                for sesiones in _repartir(args.procesos, args.usuarios, args.pantallas)
+            ]
+            resultados = [p.get() for p in pendientes]
+
+        verificacion = verificar(args.motor, directorio, resultados)
+    finally:
+        os.chdir(directorio_original)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    latencias_altas = [a[3] for r in resultados for a in r["altas"]]
+    timeouts = [op for r in resultados for op, _ in r["timeouts"]]
+    errores = [(op, e) for r in resultados for op, e in r["errores"]]
+    timeouts_altas = timeouts.count("alta")
+    intentos = len(latencias_altas) + timeouts_altas + sum(op == "alta" for op, _ in errores)
+
+    # Espera del lock de escritura: el peor p99 entre los procesos
+    lock = "csv.lote.lock_espera" if args.motor == "csv" else "sqlite.escritura.lock_espera"
+    p99_lock = [m["p99_ms"] for r in resultados for m in r["metricas"] if m["metrica"] == lock]
+
+    reporte = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "configuracion": vars(args),
+        "throughput_altas_s": round(verificacion["altas_confirmadas"] / args.duracion, 2),
+        "latencia_altas": _percentiles(latencias_altas),
+        "latencia_ediciones": _percentiles([e[4] for r in resultados for e in r["ediciones"]]),
+        "latencia_refrescos": _percentiles([t for r in resultados for t in r["refrescos"]]),
+        "intentos_altas": intentos,
+        "timeouts_altas": timeouts_altas,
+        "tasa_timeouts": round(timeouts_altas / intentos, 4) if intentos else 0.0,
+        "timeouts_por_operacion": {op: timeouts.count(op) for op in ("alta", "edicion", "refresco")},
+        "otros_errores": [f"{op}: {e}" for op, e in errores][:20],
+        "p99_espera_lock_ms": max(p99_lock) if p99_lock else None,
+        "verificacion": verificacion,
+    }
+
+    print(json.dumps(reporte, indent=2, ensure_ascii=False))
+    salida = args.salida or os.path.join(
+        RESULTADOS_DIR, f"carga_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+    )
+    almacenamiento.asegurar_directorio(salida)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(reporte, f, indent=2, ensure_ascii=False)
+    print(f"Reporte: {salida}")
+
+    falla = (
+        verificacion["altas_perdidas"] or verificacion["ids_duplicados"]
+        or verificacion["folios_confirmados_repetidos"] or verificacion["ediciones_perdidas"]
+    )
+    return 1 if falla else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
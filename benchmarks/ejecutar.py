@@ -0,0 +1,289 @@
+"""
+Benchmarks del almacenamiento con datos sintéticos (ver generador.py).
+
+Mide, por motor y tamaño, los caminos que usa la app:
+    cargar          lectura completa en frío (instancia nueva)
+    cache           frame compartido en frío (preparar_base + esquema)
+    columnas_tiempo minutos / semáforo sobre todo el frame
+    siguiente_id    folio siguiente recorriendo todo el frame
+    filtrar         una página con filtros de cuarto, status y fechas
+    editar          EDICIONES cambios de status (uno por guardado)
+    agregar         ALTAS altas (una por guardado)
+    exportar_csv    exportación completa del historial a CSV
+
+Cada operación se repite y se guarda la mediana. Los resultados quedan
+en JSON (benchmarks/resultados/) y se comparan contra la línea base
+(benchmarks/linea_base.json): si una operación es más lenta que la base
+por más de la tolerancia, el script termina con código 1.
+
+Uso:
+    python benchmarks/ejecutar.py                       # 10k y 100k, ambos motores
+    python benchmarks/ejecutar.py --tamanos 10k,100k,1M,5M --motores csv
+    python benchmarks/ejecutar.py --guardar-linea-base  # fija la base en esta máquina
+
+La línea base depende de la máquina: se genera en la misma donde se
+van a comparar los resultados.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import almacenamiento
+import exportaciones
+import indicadores
+import generador
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTADOS_DIR = os.path.join(BENCH_DIR, "resultados")
+LINEA_BASE = os.path.join(BENCH_DIR, "linea_base.json")
+
+TAMANOS_DEFAULT = "10k,100k"
+MOTORES_DEFAULT = "csv,sqlite"
+REPETICIONES = 3
+ALTAS = 200
+EDICIONES = 50
+
+TOLERANCIA = 0.25                # 25% más lento que la base = regresión
+MINIMO_SEGUNDOS = 0.005          # diferencias menores se consideran ruido
+
+# ==========================
+# MEDICIÓN
+# ==========================
+
+def medir(funcion, repeticiones=REPETICIONES):
+    """
+    Tiempos (s) de `repeticiones` llamadas a funcion().
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return {
+        "mediana_s": statistics.median(tiempos),
+        "min_s": min(tiempos),
+        "max_s": max(tiempos),
+        "repeticiones": repeticiones,
+    }
+
+def crear_almacen(motor, trabajo_dir, csv_inicial):
+    """
+    Almacén del motor con sus archivos dentro de trabajo_dir.
+    El CSV motor lee una copia de csv_inicial; SQLite lo importa.
+    """
+    csv_path = os.path.join(trabajo_dir, "requisiciones.csv")
+    backup_dir = os.path.join(trabajo_dir, "backups")
+    if motor == "csv":
+        if not os.path.exists(csv_path):
+            shutil.copyfile(csv_inicial, csv_path)
+        return almacenamiento.AlmacenCSV(csv_path=csv_path, backup_dir=backup_dir)
+    return almacenamiento.AlmacenSQLite(
+        db_path=os.path.join(trabajo_dir, "requisiciones.sqlite"),
+        backup_dir=backup_dir,
+        csv_inicial=csv_inicial,
+    )
+
+def _fila_nueva(i):
+    return {
+        "uuid": str(uuid.uuid4()),
+        "fecha_hora": almacenamiento.hora_local().strftime("%Y-%m-%d %H:%M:%S"),
+        "cuarto": almacenamiento.CUARTOS[i % len(almacenamiento.CUARTOS)],
+        "work_order": "500000",
+        "numero_parte": "P-00001",
+        "numero_lote": "L000001",
+        "cantidad": 10,
+        "motivo": almacenamiento.MOTIVOS[0],
+        "status": "Pendiente",
+        "almacenista": "",
+        "issue": False,
+        "min_final": "",
+    }
+
+def ejecutar_caso(motor, filas, repeticiones, semilla=0):
+    """
+    Todas las operaciones para un motor y un tamaño. Regresa {operación: tiempos}.
+    """
+    csv_inicial = generador.csv_sintetico(filas, semilla)
+    trabajo_dir = tempfile.mkdtemp(prefix=f"bench_{motor}_{filas}_")
+    directorio_original = os.getcwd()
+    # El archivo histórico y demás rutas relativas quedan dentro del directorio temporal
+    os.chdir(trabajo_dir)
+    # La cache compartida es una por motor y proceso; cada caso usa un almacén nuevo
+    almacenamiento._caches.pop(motor, None)
+    try:
+        almacen = crear_almacen(motor, trabajo_dir, csv_inicial)
+        resultados = {}
+
+        resultados["cargar"] = medir(
+            lambda: crear_almacen(motor, trabajo_dir, csv_inicial).cargar(), repeticiones
+        )
+        resultados["cache"] = medir(
+            lambda: almacenamiento.CacheCompartida(almacen).obtener(), repeticiones
+        )
+
+        frame = almacenamiento.obtener_cache(almacen).obtener()
+        resultados["columnas_tiempo"] = medir(
+            lambda: indicadores.calcular_columnas_tiempo(frame), repeticiones
+        )
+        df = almacen.cargar()
+        resultados["siguiente_id"] = medir(lambda: almacenamiento.siguiente_id(df), repeticiones)
+
+        ahora = almacenamiento.hora_local()
+        filtros = {
+            "cuartos": almacenamiento.CUARTOS[:3],
+            "estados": ["Entregado", "Pendiente"],
+            "desde": (ahora - timedelta(days=30)).date(),
+            "hasta": ahora.date(),
+        }
+        resultados["filtrar"] = medir(lambda: almacen.consultar(filtros), repeticiones)
+
+        # Ediciones sobre filas viejas al azar (no las que están en el journal)
+        rng = np.random.default_rng(semilla)
+        muestra = df.iloc[rng.integers(len(df) // 2, len(df), size=EDICIONES * repeticiones)]
+        objetivos = iter(zip(muestra["uuid"], muestra["ID"]))
+
+        def editar():
+            for _ in range(EDICIONES):
+                uuid_val, id_val = next(objetivos)
+                almacen.actualizar_requisicion(uuid_val, id_val, "Entregado", "Benchmark", False)
+
+        resultados["editar"] = medir(editar, repeticiones)
+
+        contador = iter(range(1, ALTAS * repeticiones + 1))
+
+        def agregar():
+            for _ in range(ALTAS):
+                almacen.agregar(_fila_nueva(next(contador)))
+
+        resultados["agregar"] = medir(agregar, repeticiones)
+
+        export_dir = os.path.join(trabajo_dir, "exportaciones")
+
+        def exportar():
+            # Ruta nueva en cada repetición: sin esto la segunda sale de la cache de exportaciones
+            shutil.rmtree(export_dir, ignore_errors=True)
+            exportaciones.generar(almacen, {}, "fecha_hora", True, "CSV", export_dir=export_dir)
+
+        resultados["exportar_csv"] = medir(exportar, repeticiones)
+        return resultados
+    finally:
+        os.chdir(directorio_original)
+        shutil.rmtree(trabajo_dir, ignore_errors=True)
+
+# ==========================
+# LÍNEA BASE
+# ==========================
+
+def comparar(actual, base, tolerancia=TOLERANCIA, minimo=MINIMO_SEGUNDOS):
+    """
+    Regresiones de `actual` contra `base` (mismo formato de resultados).
+    Solo se comparan los casos que están en ambos.
+    """
+    regresiones = []
+    for motor, tamanos in actual.items():
+        for tamano, operaciones in tamanos.items():
+            for operacion, tiempos in operaciones.items():
+                previo = base.get(motor, {}).get(tamano, {}).get(operacion)
+                if not previo:
+                    continue
+                antes, ahora = previo["mediana_s"], tiempos["mediana_s"]
+                if ahora > antes * (1 + tolerancia) and ahora - antes > minimo:
+                    regresiones.append({
+                        "motor": motor, "tamano": tamano, "operacion": operacion,
+                        "base_s": antes, "actual_s": ahora, "factor": ahora / antes,
+                    })
+    return regresiones
+
+def _leer_json(ruta):
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _escribir_json(ruta, datos):
+    almacenamiento.asegurar_directorio(ruta)
+    tmp_path = ruta + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(datos, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, ruta)
+
+# ==========================
+# CLI
+# ==========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks del almacenamiento de requisiciones.")
+    parser.add_argument("--tamanos", default=TAMANOS_DEFAULT, help="lista de 10k,100k,1M,5M o números")
+    parser.add_argument("--motores", default=MOTORES_DEFAULT, help="csv,sqlite")
+    parser.add_argument("--repeticiones", type=int, default=REPETICIONES)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="JSON de resultados (default benchmarks/resultados/<fecha>.json)")
+    parser.add_argument("--linea-base", default=LINEA_BASE)
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA)
+    parser.add_argument("--guardar-linea-base", action="store_true",
+                        help="guarda estos resultados como línea base en lugar de comparar")
+    args = parser.parse_args(argv)
+
+    resultados = {}
+    for motor in args.motores.split(","):
+        for tamano in args.tamanos.split(","):
+            filas = generador.TAMANOS.get(tamano) or int(tamano)
+            print(f"{motor} {tamano} ...", flush=True)
+            operaciones = ejecutar_caso(motor, filas, args.repeticiones, args.semilla)
+            resultados.setdefault(motor, {})[tamano] = operaciones
+            for operacion, tiempos in operaciones.items():
+                print(f"    {operacion:<16} {tiempos['mediana_s']:9.4f} s")
+
+    reporte = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "maquina": platform.node(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "repeticiones": args.repeticiones,
+        "resultados": resultados,
+    }
+    salida = args.salida or os.path.join(
+        RESULTADOS_DIR, f"bench_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+    )
+    _escribir_json(salida, reporte)
+    print(f"Resultados: {salida}")
+
+    if args.guardar_linea_base:
+        _escribir_json(args.linea_base, reporte)
+        print(f"Línea base guardada: {args.linea_base}")
+        return 0
+
+    base = _leer_json(args.linea_base)
+    if base is None:
+        print("Sin línea base; se omite la comparación (usa --guardar-linea-base).")
+        return 0
+
+    regresiones = comparar(resultados, base["resultados"], args.tolerancia)
+    for r in regresiones:
+        print(
+            f"REGRESIÓN {r['motor']} {r['tamano']} {r['operacion']}: "
+            f"{r['base_s']:.4f} s -> {r['actual_s']:.4f} s (x{r['factor']:.2f})"
+        )
+    return 1 if regresiones else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
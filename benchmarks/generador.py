@@ -0,0 +1,142 @@
+"""
+Generador de requisiciones sintéticas para los benchmarks.
+
+Usa los catálogos reales (CUARTOS, MOTIVOS, ESTADOS) con una mezcla
+parecida a la de producción: casi todo lo de días anteriores está
+cerrado y lo abierto se concentra en el último día. Todo se arma con
+numpy por columnas, así que 5M filas toman segundos, no minutos.
+
+Uso:
+    python benchmarks/generador.py 100000 data/sintetico.csv [--semilla 0] [--dias 365]
+"""
+
+import os
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import almacenamiento
+from almacenamiento import COLUMNAS_BASE, CUARTOS, MOTIVOS, asegurar_directorio, hora_local
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+DATOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos")
+
+# Los cuartos grandes piden mucho más que los chicos (peso ~ 1/rango)
+PESOS_CUARTOS = 1 / np.arange(1, len(CUARTOS) + 1)
+PESOS_MOTIVOS = [0.60, 0.15, 0.12, 0.08, 0.05]
+
+# Mezcla de status: días anteriores vs. último día
+ESTADOS_VIEJAS = (["Entregado", "Cancelado", "No encontrado"], [0.88, 0.08, 0.04])
+ESTADOS_RECIENTES = (
+    ["Pendiente", "En proceso", "Entregado", "Cancelado", "No encontrado"],
+    [0.35, 0.25, 0.32, 0.05, 0.03],
+)
+
+ALMACENISTAS = [f"Almacenista {i:02d}" for i in range(1, 13)]
+NUMEROS_PARTE = 5_000
+PROB_ISSUE = 0.03
+
+TAMANOS = {"10k": 10_000, "100k": 100_000, "1M": 1_000_000, "5M": 5_000_000}
+
+# ==========================
+# COLUMNAS
+# ==========================
+
+def _uuids(rng, filas):
+    # uuid4 en texto sin pasar por uuid.uuid4() fila por fila
+    crudo = rng.integers(0, 256, size=(filas, 16), dtype=np.uint8)
+    crudo[:, 6] = (crudo[:, 6] & 0x0F) | 0x40
+    crudo[:, 8] = (crudo[:, 8] & 0x3F) | 0x80
+    hexa = np.frombuffer(crudo.tobytes().hex().encode("ascii"), dtype="S1").reshape(filas, 32)
+    guion = np.full((filas, 1), b"-", dtype="S1")
+    partes = [hexa[:, :8], guion, hexa[:, 8:12], guion, hexa[:, 12:16], guion, hexa[:, 16:20], guion, hexa[:, 20:]]
+    return np.ascontiguousarray(np.hstack(partes)).view("S36").ravel().astype(str)
+
+def _con_prefijo(prefijo, numeros, ancho):
+    return (prefijo + pd.Series(numeros).astype(str).str.zfill(ancho)).to_numpy(dtype=object)
+
+def generar(filas, dias=365, semilla=0, ahora=None):
+    """
+    DataFrame con COLUMNAS_BASE (todo en texto, como lo lee el CSV),
+    ordenado por fecha desc y con folios REQ-xxxxx en orden cronológico.
+    """
+    rng = np.random.default_rng(semilla)
+    ahora = pd.Timestamp(ahora or hora_local()).floor("s")
+
+    # Fechas uniformes en el rango, más recientes primero
+    segundos = np.sort(rng.integers(0, dias * 86_400, size=filas))
+    fechas = ahora - pd.to_timedelta(segundos, unit="s")
+    recientes = segundos < 86_400
+
+    status = np.empty(filas, dtype=object)
+    for mascara, (valores, pesos) in ((~recientes, ESTADOS_VIEJAS), (recientes, ESTADOS_RECIENTES)):
+        status[mascara] = rng.choice(valores, size=int(mascara.sum()), p=pesos)
+    cerradas = np.isin(status, almacenamiento.ESTADOS_FINALES)
+
+    almacenista = rng.choice(ALMACENISTAS, size=filas).astype(object)
+    almacenista[status == "Pendiente"] = ""
+
+    min_final = np.full(filas, "", dtype=object)
+    min_final[cerradas] = np.ceil(rng.gamma(2.0, 10.0, size=int(cerradas.sum()))).astype(int).astype(str)
+
+    df = pd.DataFrame({
+        # El más viejo es el folio 1
+        "ID": _con_prefijo("REQ-", np.arange(filas, 0, -1), 5),
+        "uuid": _uuids(rng, filas),
+        "fecha_hora": fechas.strftime("%Y-%m-%d %H:%M:%S"),
+        "cuarto": rng.choice(CUARTOS, size=filas, p=PESOS_CUARTOS / PESOS_CUARTOS.sum()),
+        "work_order": _con_prefijo("", rng.integers(400_000, 600_000, size=filas), 6),
+        "numero_parte": _con_prefijo("P-", rng.integers(0, NUMEROS_PARTE, size=filas), 5),
+        "numero_lote": _con_prefijo("L", rng.integers(0, 1_000_000, size=filas), 6),
+        "cantidad": np.clip(rng.lognormal(3.5, 1.0, size=filas), 1, 5_000).astype(int).astype(str),
+        "motivo": rng.choice(MOTIVOS, size=filas, p=PESOS_MOTIVOS),
+        "status": status,
+        "almacenista": almacenista,
+        "issue": np.where(rng.random(filas) < PROB_ISSUE, "True", "False"),
+        "min_final": min_final,
+    })
+    return df[COLUMNAS_BASE]
+
+def ruta_datos(filas, semilla=0, datos_dir=DATOS_DIR):
+    return os.path.join(datos_dir, f"sintetico_{filas}_{semilla}.csv")
+
+def csv_sintetico(filas, semilla=0, datos_dir=DATOS_DIR):
+    """
+    Ruta de un CSV sintético de `filas` filas; se genera la primera vez y
+    después se reutiliza (la misma semilla da los mismos datos).
+    Las fechas son relativas a cuando se generó.
+    """
+    ruta = ruta_datos(filas, semilla, datos_dir)
+    if not os.path.exists(ruta):
+        asegurar_directorio(ruta)
+        tmp_path = ruta + ".tmp"
+        generar(filas, semilla=semilla).to_csv(tmp_path, index=False, encoding="utf-8-sig")
+        os.replace(tmp_path, ruta)
+    return ruta
+
+# ==========================
+# CLI
+# ==========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un CSV de requisiciones sintéticas.")
+    parser.add_argument("filas", help="número de filas o 10k / 100k / 1M / 5M")
+    parser.add_argument("salida", help="ruta del CSV a escribir")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--dias", type=int, default=365, help="días hacia atrás que cubren las fechas")
+    args = parser.parse_args(argv)
+
+    filas = TAMANOS.get(args.filas) or int(args.filas)
+    asegurar_directorio(args.salida)
+    generar(filas, dias=args.dias, semilla=args.semilla).to_csv(args.salida, index=False, encoding="utf-8-sig")
+    print(f"{filas} filas -> {args.salida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Verificación de la retención de respaldos: que todo respaldo que queda
+después de aplicar_retencion() se pueda reconstruir y dé los mismos
+datos que había al tomarlo.
+
+Simula varios días de operación con un reloj falso: altas y cambios de
+status cada pocos minutos, un ciclo de GestorRespaldos después de cada
+uno (incrementales + un completo por hora, que aplica la retención) y,
+de vez en cuando, un completo manual en la misma hora que el
+automático. Al final reconstruye cada respaldo que sobrevivió y lo
+compara contra la foto de los datos tomada cuando se escribió. Termina
+con código 1 si alguno no cuadra o no se puede reconstruir.
+
+Uso:
+    python benchmarks/retencion.py --motor csv --dias 3 --paso 17
+"""
+
+import os
+import sys
+import time
+import types
+import uuid
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import almacenamiento
+import respaldos
+
+COLUMNAS_COMPARADAS = ["ID", "uuid", "status", "almacenista"]
+
+class _Reloj(datetime):
+    """
+    datetime cuyo now() es el del reloj simulado (strptime y demás quedan igual).
+    """
+    actual = datetime(2026, 1, 1, 0, 5)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.actual
+
+def _foto(df):
+    df = df.astype({c: str for c in COLUMNAS_COMPARADAS})[COLUMNAS_COMPARADAS]
+    return df.sort_values("uuid").reset_index(drop=True)
+
+def _fila(rng, ahora):
+    return {
+        "ID": "",
+        "uuid": str(uuid.uuid4()),
+        "fecha_hora": ahora.strftime("%Y-%m-%d %H:%M:%S"),
+        "cuarto": str(rng.choice(almacenamiento.CUARTOS[1:])),
+        "work_order": "",
+        "numero_parte": f"P-{rng.integers(1000)}",
+        "numero_lote": "",
+        "cantidad": int(rng.integers(1, 50)),
+        "motivo": str(rng.choice(almacenamiento.MOTIVOS)),
+        "status": "Pendiente",
+        "almacenista": "",
+        "issue": False,
+        "min_final": "",
+    }
+
+def simular(motor, dias, paso, semilla=0):
+    """
+    Regresa (sobrevivientes, errores): cuántos respaldos quedaron y la
+    lista de los que no se reconstruyen igual.
+    """
+    rng = np.random.default_rng(semilla)
+    backup_dir = os.path.join("data", "backups")
+    almacen = almacenamiento.MOTORES[motor]()
+    gestor = respaldos.GestorRespaldos(almacen, backup_dir)
+    fotos = {}
+
+    fin = _Reloj.actual + timedelta(days=dias)
+    ciclo = 0
+    while _Reloj.actual < fin:
+        ciclo += 1
+        for _ in range(int(rng.integers(1, 4))):
+            almacen.agregar(_fila(rng, _Reloj.actual))
+        abiertas, _ = almacen.consultar({"estados": ["Pendiente", "En proceso"]}, por_pagina=20)
+        for u, i in zip(abiertas["uuid"][:2], abiertas["ID"][:2]):
+            almacen.actualizar_requisicion(u, i, "Entregado", f"alm-{ciclo}", False)
+
+        # Completo manual a media hora: dos completos en la misma hora
+        manual = ciclo % 7 == 0
+        ruta = gestor.respaldar("manual" if manual else "auto", completo=manual)
+        if ruta:
+            fotos[os.path.basename(ruta)] = _foto(almacen.cargar())
+        _Reloj.actual += timedelta(minutes=paso)
+
+    errores = []
+    sobrevivientes = respaldos.listar_respaldos(backup_dir)
+    for ruta in sobrevivientes:
+        nombre = os.path.basename(ruta)
+        try:
+            reconstruido = _foto(respaldos.reconstruir(ruta, backup_dir))
+        except FileNotFoundError as e:
+            errores.append(f"{nombre}: {e}")
+            continue
+        if not reconstruido.equals(fotos[nombre]):
+            errores.append(f"{nombre}: {len(reconstruido)} filas reconstruidas, {len(fotos[nombre])} esperadas o con otro status")
+    return len(sobrevivientes), errores
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica que la retención no rompa las cadenas de respaldos.")
+    parser.add_argument("--motor", default="csv", choices=list(almacenamiento.MOTORES))
+    parser.add_argument("--dias", type=float, default=3)
+    parser.add_argument("--paso", type=int, default=17,
+                        help="minutos simulados entre ciclos (que no divida la hora: los ciclos caen a minutos distintos)")
+    args = parser.parse_args(argv)
+
+    # Reloj falso para los nombres de archivo, el intervalo de completos y la retención
+    respaldos.datetime = _Reloj
+    respaldos.time = types.SimpleNamespace(time=lambda: _Reloj.actual.timestamp(), sleep=time.sleep)
+
+    directorio_original = os.getcwd()
+    directorio = tempfile.mkdtemp(prefix="retencion_")
+    try:
+        os.chdir(directorio)
+        sobrevivientes, errores = simular(args.motor, args.dias, args.paso)
+    finally:
+        os.chdir(directorio_original)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    print(f"Respaldos conservados: {sobrevivientes}")
+    for error in errores:
+        print(f"NO CUADRA {error}")
+    print("OK" if not errores else f"{len(errores)} respaldos no se reconstruyen igual")
+    return 1 if errores else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
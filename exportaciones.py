@@ -0,0 +1,181 @@
+"""
+Exportación del historial filtrado (CSV, Excel .xlsx y Parquet).
+
+Los archivos se generan solo cuando alguien los pide y se guardan en
+EXPORT_DIR con una llave (versión de datos, minuto, filtros, orden,
+formato): pedir otra vez la misma exportación sin cambios en los datos
+no vuelve a serializar nada. El minuto va en la llave porque minutos y
+semáforo dependen de la hora, no solo de los datos. Las filas se leen y escriben por bloques, nunca como un
+solo bytes con todo el historial.
+"""
+
+import os
+import glob
+import hashlib
+import contextlib
+import uuid
+import importlib.util
+
+import indicadores
+import metricas
+from almacenamiento import asegurar_directorio, hora_local
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+EXPORT_DIR = "data/exportaciones"
+TAMANO_BLOQUE = 50_000           # filas por bloque al leer / escribir
+MAX_EXPORTACIONES = 10           # archivos que se conservan en EXPORT_DIR
+
+# Excel admite 1,048,576 filas por hoja (incluyendo encabezado)
+FILAS_POR_HOJA = 1_048_575
+
+# nombre visible -> (extensión, mime, módulo opcional que requiere)
+FORMATOS = {
+    "CSV": ("csv", "text/csv", None),
+    "Excel (.xlsx)": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "openpyxl"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet", "pyarrow"),
+}
+
+def formatos_disponibles():
+    """
+    Formatos cuyo módulo opcional está instalado (CSV siempre).
+    """
+    return [
+        nombre for nombre, (_, _, modulo) in FORMATOS.items()
+        if modulo is None or importlib.util.find_spec(modulo) is not None
+    ]
+
+def mime_de(formato):
+    return FORMATOS[formato][1]
+
+# ==========================
+# LLAVE / RUTA
+# ==========================
+
+def ruta_exportacion(almacen, filtros, orden, descendente, formato, export_dir=EXPORT_DIR):
+    """
+    Ruta del archivo para esta combinación. Si ya existe, está vigente:
+    la llave incluye almacen.version(), que cambia con cada escritura, y
+    el minuto actual (las columnas de tiempo se calculan al generar).
+    """
+    minuto = hora_local().strftime("%Y-%m-%d %H:%M")
+    llave = repr((almacen.version(), minuto, sorted((filtros or {}).items()), orden, bool(descendente), formato))
+    digest = hashlib.sha1(llave.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(export_dir, f"requisiciones_{digest}.{FORMATOS[formato][0]}")
+
+def nombre_descarga(formato):
+    return f"requisiciones_{hora_local().strftime('%Y-%m-%d_%H-%M-%S')}.{FORMATOS[formato][0]}"
+
+# ==========================
+# GENERACIÓN POR BLOQUES
+# ==========================
+
+def _bloques(almacen, filtros, orden, descendente):
+    """
+    Bloques listos para escribir: columnas de tiempo calculadas con la
+    misma hora para todo el archivo y sin columnas internas. Siempre hay
+    al menos un bloque (vacío si nada cumple los filtros) para que el
+    archivo lleve encabezados / esquema.
+    """
+    ahora = hora_local()
+    vacio = True
+    with contextlib.closing(almacen.iterar_consulta(filtros, orden, descendente, tamano=TAMANO_BLOQUE)) as consulta:
+        for bloque in consulta:
+            vacio = False
+            yield indicadores.calcular_columnas_tiempo(bloque, ahora).drop(columns=["fecha_hora_dt"], errors="ignore")
+
+    if vacio:
+        bloque, _ = almacen.consultar(filtros, orden, descendente, por_pagina=1)
+        yield indicadores.calcular_columnas_tiempo(bloque.iloc[:0], ahora).drop(columns=["fecha_hora_dt"], errors="ignore")
+
+def _escribir_csv(bloques, ruta):
+    with open(ruta, "w", encoding="utf-8-sig", newline="") as f:
+        encabezado = True
+        for bloque in bloques:
+            bloque.to_csv(f, index=False, header=encabezado)
+            encabezado = False
+
+def _escribir_xlsx(bloques, ruta):
+    from openpyxl import Workbook
+
+    # write_only: cada fila se manda al archivo, no se arma la hoja en memoria
+    libro = Workbook(write_only=True)
+    hoja, filas_en_hoja = None, 0
+
+    for bloque in bloques:
+        if hoja is None:
+            hoja = libro.create_sheet("Requisiciones 1")
+            hoja.append(list(bloque.columns))
+        valores = bloque.astype(object).where(bloque.notna(), None)
+        for fila in valores.itertuples(index=False, name=None):
+            if filas_en_hoja >= FILAS_POR_HOJA:
+                hoja = libro.create_sheet(f"Requisiciones {len(libro.worksheets) + 1}")
+                hoja.append(list(bloque.columns))
+                filas_en_hoja = 0
+            hoja.append(fila)
+            filas_en_hoja += 1
+
+    libro.save(ruta)
+
+def _escribir_parquet(bloques, ruta):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Un row group por bloque; el esquema lo fija el primer bloque
+    escritor = None
+    try:
+        for bloque in bloques:
+            if escritor is None:
+                tabla = pa.Table.from_pandas(bloque, preserve_index=False)
+                escritor = pq.ParquetWriter(ruta, tabla.schema, compression="zstd")
+            else:
+                tabla = pa.Table.from_pandas(bloque, schema=escritor.schema, preserve_index=False)
+            escritor.write_table(tabla)
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+ESCRITORES = {
+    "csv": _escribir_csv,
+    "xlsx": _escribir_xlsx,
+    "parquet": _escribir_parquet,
+}
+
+@metricas.cronometrado("exportaciones.generar")
+def generar(almacen, filtros, orden, descendente, formato, export_dir=EXPORT_DIR):
+    """
+    Regresa la ruta de la exportación; solo la genera si no existe.
+    Se escribe a .tmp y se reemplaza, así nunca se sirve un archivo a medias.
+    """
+    ruta = ruta_exportacion(almacen, filtros, orden, descendente, formato, export_dir)
+    if os.path.exists(ruta):
+        return ruta
+
+    asegurar_directorio(ruta)
+    # Cada sesión es un hilo: el .tmp no puede depender solo del proceso
+    tmp = f"{ruta}.{uuid.uuid4().hex}.tmp"
+    try:
+        # Si el escritor falla a medias, cerrar los bloques suelta la lectura en curso
+        with contextlib.closing(_bloques(almacen, filtros, orden, descendente)) as bloques:
+            ESCRITORES[FORMATOS[formato][0]](bloques, tmp)
+        os.replace(tmp, ruta)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    limpiar(export_dir)
+    return ruta
+
+def limpiar(export_dir=EXPORT_DIR, conservar=MAX_EXPORTACIONES):
+    """
+    Borra las exportaciones más viejas; se quedan las `conservar` más recientes.
+    """
+    rutas = [r for r in glob.glob(os.path.join(export_dir, "requisiciones_*")) if not r.endswith(".tmp")]
+    rutas.sort(key=os.path.getmtime, reverse=True)
+    for ruta in rutas[conservar:]:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
@@ -0,0 +1,160 @@
+"""
+Archivo histórico: requisiciones cerradas y viejas en Parquet por mes.
+
+Cada mes es una carpeta (data/archivo/2025-11/) con una o más partes
+inmutables; archivar otra vez ese mes agrega una parte nueva, nunca
+reescribe las existentes. Las consultas con rango de fechas leen solo
+los meses que lo cruzan.
+
+Este módulo solo lee y escribe archivos; qué filas se archivan y cómo se
+combinan con las del almacén lo decide almacenamiento.
+"""
+
+import os
+import glob
+import uuid
+import importlib.util
+from datetime import datetime
+from functools import lru_cache
+
+import pandas as pd
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+ARCHIVO_DIR = "data/archivo"
+DIAS_ARCHIVO = 90                # cerradas con más de estos días se archivan
+MAX_PARTES_EN_MEMORIA = 48       # partes leídas que se conservan por proceso
+
+def disponible():
+    """
+    El archivo usa Parquet (pyarrow); sin él no se archiva nada.
+    """
+    return importlib.util.find_spec("pyarrow") is not None
+
+# ==========================
+# PARTICIONES
+# ==========================
+
+def mes_de(fecha_hora):
+    """
+    Serie de fecha_hora en texto ('YYYY-MM-DD HH:MM:SS') -> 'YYYY-MM'.
+    """
+    return fecha_hora.astype(str).str.slice(0, 7)
+
+def meses_archivados(archivo_dir=ARCHIVO_DIR):
+    if not os.path.isdir(archivo_dir):
+        return []
+    return sorted(
+        nombre for nombre in os.listdir(archivo_dir)
+        if len(nombre) == 7 and nombre[4] == "-" and os.path.isdir(os.path.join(archivo_dir, nombre))
+    )
+
+def meses_en_rango(desde=None, hasta=None, archivo_dir=ARCHIVO_DIR):
+    """
+    Meses archivados que cruzan [desde, hasta] (fechas; None = sin límite).
+    """
+    inicio = pd.Timestamp(desde).strftime("%Y-%m") if desde else None
+    fin = pd.Timestamp(hasta).strftime("%Y-%m") if hasta else None
+    return [
+        mes for mes in meses_archivados(archivo_dir)
+        if (inicio is None or mes >= inicio) and (fin is None or mes <= fin)
+    ]
+
+def partes_de(mes, archivo_dir=ARCHIVO_DIR):
+    """
+    Partes del mes, más recientes primero (el nombre empieza con la fecha).
+    """
+    return sorted(glob.glob(os.path.join(archivo_dir, mes, "parte_*.parquet")), reverse=True)
+
+# ==========================
+# ESCRITURA
+# ==========================
+
+def escribir(df, archivo_dir=ARCHIVO_DIR):
+    """
+    Agrega una parte por mes con las filas de `df` (columnas del almacén,
+    fecha_hora en texto). Cada parte se escribe a .tmp con fsync y luego
+    se renombra: una parte visible siempre está completa.
+    Regresa las rutas escritas.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rutas = []
+    sello = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+    for mes, grupo in df.groupby(mes_de(df["fecha_hora"]), sort=True):
+        carpeta = os.path.join(archivo_dir, mes)
+        os.makedirs(carpeta, exist_ok=True)
+        ruta = os.path.join(carpeta, f"parte_{sello}_{uuid.uuid4().hex[:8]}.parquet")
+        tmp_path = ruta + ".tmp"
+
+        tabla = pa.Table.from_pandas(grupo.reset_index(drop=True), preserve_index=False)
+        with open(tmp_path, "wb") as f:
+            pq.write_table(tabla, f, compression="zstd")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, ruta)
+        rutas.append(ruta)
+    return rutas
+
+# ==========================
+# LECTURA
+# ==========================
+
+@lru_cache(maxsize=MAX_PARTES_EN_MEMORIA)
+def _leer_parte(ruta, _mtime):
+    # Las partes no cambian: basta la ruta (+ mtime por si alguien la reemplaza a mano)
+    return pd.read_parquet(ruta)
+
+def leer(desde=None, hasta=None, archivo_dir=ARCHIVO_DIR):
+    """
+    Filas archivadas de los meses que cruzan el rango. Si una requisición
+    se archivó más de una vez (se reabrió y volvió a cerrar) queda la de
+    la parte más reciente.
+    """
+    partes = [ruta for mes in meses_en_rango(desde, hasta, archivo_dir) for ruta in partes_de(mes, archivo_dir)]
+    if not partes:
+        return pd.DataFrame()
+
+    partes.sort(key=os.path.basename, reverse=True)
+    df = pd.concat([_leer_parte(r, os.path.getmtime(r)) for r in partes], ignore_index=True)
+    if "uuid" in df.columns:
+        df = df[~(df["uuid"].astype(str).ne("") & df.duplicated(subset=["uuid"], keep="first"))]
+    return df
+
+def buscar(uuid_val, id_val, archivo_dir=ARCHIVO_DIR):
+    """
+    Última versión archivada de una requisición (dict) por uuid, o por ID
+    si no hay uuid. Recorre todo el archivo: solo se usa al editar una
+    requisición que ya no está en el almacén.
+    """
+    if not disponible():
+        return None
+
+    df = leer(archivo_dir=archivo_dir)
+    if df.empty:
+        return None
+
+    uuid_val = str(uuid_val or "").strip()
+    if uuid_val:
+        encontradas = df[df["uuid"].astype(str) == uuid_val]
+    else:
+        encontradas = df[df["ID"].astype(str) == str(id_val)]
+    if encontradas.empty:
+        return None
+    return encontradas.iloc[0].to_dict()
+
+def max_folio(archivo_dir=ARCHIVO_DIR):
+    """
+    Mayor número REQ-xxxx archivado (para no repetir folios si hay que
+    reconstruir la secuencia).
+    """
+    if not disponible():
+        return 0
+    df = leer(archivo_dir=archivo_dir)
+    if df.empty or "ID" not in df.columns:
+        return 0
+    nums = pd.to_numeric(df["ID"].astype(str).str.extract(r"REQ-(\d+)", expand=False), errors="coerce")
+    return int(nums.max()) if nums.notna().any() else 0
@@ -0,0 +1,225 @@
+"""
+Importación masiva de requisiciones desde CSV o Excel (.xlsx).
+
+Para cuando planeación levanta muchas requisiciones de una work order:
+el archivo se valida completo por columnas (cuarto y motivo contra los
+catálogos, cantidad entera positiva, número de parte), se quitan
+los uuid repetidos y todas las filas válidas se guardan con
+almacen.agregar_lote(): un lock / transacción, un bloque de folios
+consecutivos y una sola escritura.
+
+Si el archivo no trae uuid se derivan del contenido del archivo y del
+número de fila, así subir dos veces el mismo archivo no duplica nada.
+
+Uso:
+    python importacion.py requisiciones.xlsx [--motor sqlite] [--omitir-invalidas]
+"""
+
+import os
+import io
+import sys
+import uuid
+import hashlib
+import argparse
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+import almacenamiento
+import metricas
+from almacenamiento import CUARTOS, MOTIVOS, hora_local
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+# Lo mismo que pide el formulario de Registrar; work order y lote pueden ir vacíos
+OBLIGATORIAS = ["cuarto", "numero_parte", "cantidad", "motivo"]
+OPCIONALES = ["work_order", "numero_lote", "uuid"]
+MAX_FILAS = 5_000                # por archivo
+
+# Encabezados como los muestra el formulario de Registrar -> columna interna
+ALIAS = {
+    "cuarto": "cuarto",
+    "work order": "work_order",
+    "wo": "work_order",
+    "número de parte": "numero_parte",
+    "numero de parte": "numero_parte",
+    "no. de parte": "numero_parte",
+    "número de lote": "numero_lote",
+    "numero de lote": "numero_lote",
+    "lote": "numero_lote",
+    "cantidad": "cantidad",
+    "motivo": "motivo",
+}
+
+# Espacio de nombres de los uuid derivados del archivo (uuid5)
+_NAMESPACE = uuid.UUID("6f1c2f4e-3f7a-4a55-9d7e-2b1a7c0e9e21")
+
+def formatos_disponibles():
+    """
+    Extensiones que se pueden subir (xlsx solo con openpyxl instalado).
+    """
+    return ["csv"] + (["xlsx"] if importlib.util.find_spec("openpyxl") is not None else [])
+
+# ==========================
+# LECTURA
+# ==========================
+
+def _columna(nombre):
+    limpio = " ".join(str(nombre).strip().lower().replace("_", " ").split())
+    return ALIAS.get(limpio, limpio.replace(" ", "_"))
+
+def leer_archivo(datos, nombre):
+    """
+    DataFrame (todo texto, sin NaN) de los bytes de un CSV / XLSX.
+    `nombre` solo se usa para la extensión. El índice es la posición en
+    el archivo (renglón - 2) aunque se quiten los renglones vacíos.
+    """
+    if nombre.lower().endswith(".xlsx"):
+        df = pd.read_excel(io.BytesIO(datos), dtype=str)
+    else:
+        df = pd.read_csv(io.BytesIO(datos), dtype=str, encoding="utf-8-sig", skip_blank_lines=False)
+
+    df.columns = [_columna(c) for c in df.columns]
+    df = df.loc[:, ~df.columns.duplicated()]
+    df = df.fillna("").apply(lambda s: s.str.strip())
+    for columna in ("work_order", "numero_lote"):
+        if columna not in df.columns:
+            df[columna] = ""
+    # Renglones vacíos (p. ej. al final de una hoja de Excel)
+    return df[df.ne("").any(axis=1)]
+
+# ==========================
+# VALIDACIÓN
+# ==========================
+
+def validar(df):
+    """
+    Regresa (validas, errores). Todas las reglas son por columna, sin
+    recorrer fila por fila. `errores` tiene una fila por renglón inválido
+    con el número de renglón del archivo (encabezado = 1) y los motivos.
+    """
+    faltantes = [c for c in OBLIGATORIAS if c not in df.columns]
+    if faltantes:
+        errores = pd.DataFrame({"renglon": [1], "errores": [f"Faltan columnas: {', '.join(faltantes)}"]})
+        return df.iloc[:0], errores
+    if len(df) > MAX_FILAS:
+        errores = pd.DataFrame({"renglon": [1], "errores": [f"Máximo {MAX_FILAS} filas por archivo"]})
+        return df.iloc[:0], errores
+
+    cantidad = pd.to_numeric(df["cantidad"], errors="coerce")
+    reglas = {
+        "cuarto no está en el catálogo": ~df["cuarto"].isin(CUARTOS),
+        "motivo no está en el catálogo": ~df["motivo"].isin(MOTIVOS),
+        "cantidad debe ser entero mayor a 0": ~((cantidad > 0) & (cantidad % 1 == 0)),
+        "falta número de parte": df["numero_parte"].eq(""),
+    }
+
+    mascaras = np.column_stack(list(reglas.values()))
+    invalidas = mascaras.any(axis=1)
+    mensajes = np.array(list(reglas.keys()), dtype=object)
+    errores = pd.DataFrame({
+        "renglon": df.index[invalidas] + 2,
+        "errores": ["; ".join(mensajes[fila]) for fila in mascaras[invalidas]],
+    })
+    return df[~invalidas], errores
+
+# ==========================
+# ARMADO DE FILAS
+# ==========================
+
+def _uuids_de_archivo(datos, renglones):
+    digest = hashlib.sha1(datos).hexdigest()
+    return [str(uuid.uuid5(_NAMESPACE, f"{digest}:{r}")) for r in renglones]
+
+def preparar(df, datos, ahora=None):
+    """
+    Filas listas para agregar_lote(): misma fecha_hora para todo el
+    archivo, status Pendiente y sin folio (lo asigna el almacenamiento).
+    Los uuid repetidos dentro del archivo se quedan con la primera fila.
+    Regresa (filas, repetidas).
+    """
+    df = df.copy()
+    derivados = _uuids_de_archivo(datos, df.index)
+    if "uuid" in df.columns:
+        df["uuid"] = df["uuid"].where(df["uuid"].ne(""), derivados)
+    else:
+        df["uuid"] = derivados
+
+    repetidas = df["uuid"].duplicated(keep="first")
+    df = df[~repetidas]
+
+    df["ID"] = ""
+    df["fecha_hora"] = (ahora or hora_local()).strftime("%Y-%m-%d %H:%M:%S")
+    df["cantidad"] = pd.to_numeric(df["cantidad"]).astype(int)
+    df["status"] = "Pendiente"
+    df["almacenista"] = ""
+    df["issue"] = False
+    df["min_final"] = ""
+    return df[almacenamiento.COLUMNAS_BASE].to_dict("records"), int(repetidas.sum())
+
+# ==========================
+# IMPORTACIÓN
+# ==========================
+
+@metricas.cronometrado("importacion.importar")
+def importar(almacen, datos, nombre, omitir_invalidas=False):
+    """
+    Valida e importa el archivo. Por default es todo o nada: si hay un
+    renglón inválido no se guarda ninguno. Regresa un dict con
+    folios (los nuevos), ya_registradas, repetidas y errores (DataFrame).
+    """
+    df = leer_archivo(datos, nombre)
+    validas, errores = validar(df)
+    resultado = {"folios": [], "ya_registradas": 0, "repetidas": 0, "errores": errores}
+
+    if validas.empty or (len(errores) and not omitir_invalidas):
+        return resultado
+
+    filas, resultado["repetidas"] = preparar(validas, datos)
+    for folio, insertada in almacen.agregar_lote(filas):
+        if insertada:
+            resultado["folios"].append(folio)
+        else:
+            resultado["ya_registradas"] += 1
+    return resultado
+
+# ==========================
+# CLI
+# ==========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa requisiciones desde un CSV o Excel.")
+    parser.add_argument("archivo", help="ruta del .csv / .xlsx")
+    parser.add_argument("--motor", help="csv o sqlite (default REQUISICIONES_MOTOR o csv)")
+    parser.add_argument("--omitir-invalidas", action="store_true",
+                        help="importa las filas válidas aunque haya renglones con error")
+    args = parser.parse_args(argv)
+
+    with open(args.archivo, "rb") as f:
+        datos = f.read()
+
+    almacen = almacenamiento.obtener_almacen(args.motor)
+    resultado = importar(almacen, datos, os.path.basename(args.archivo), args.omitir_invalidas)
+
+    for error in resultado["errores"].itertuples(index=False):
+        print(f"Renglón {error.renglon}: {error.errores}")
+    if len(resultado["errores"]) and not args.omitir_invalidas:
+        print("No se importó nada (usa --omitir-invalidas para importar las válidas).")
+        return 1
+
+    folios = resultado["folios"]
+    if folios:
+        print(f"{len(folios)} requisiciones importadas: {folios[0]} a {folios[-1]}")
+    else:
+        print("No se importaron requisiciones nuevas.")
+    if resultado["ya_registradas"]:
+        print(f"{resultado['ya_registradas']} ya estaban registradas.")
+    if resultado["repetidas"]:
+        print(f"{resultado['repetidas']} filas con uuid repetido en el archivo.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
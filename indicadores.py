@@ -0,0 +1,49 @@
+"""
+Columnas derivadas de la hora actual (minutos transcurridos y semáforo).
+
+Se calculan en cada render sobre el frame base cacheado, sin volver a
+leer el almacenamiento, con operaciones vectorizadas de numpy.
+"""
+
+import numpy as np
+import pandas as pd
+
+from almacenamiento import hora_local
+
+# Minutos a partir de los cuales cambia el semáforo
+UMBRAL_AMARILLO = 20
+UMBRAL_ROJO = 35
+
+NS_POR_SEGUNDO = 1_000_000_000
+
+def calcular_minutos(fecha_hora_dt, min_final, ahora=None):
+    """
+    Minutos transcurridos desde fecha_hora (0 si no hay fecha); las
+    requisiciones cerradas usan su min_final congelado.
+    Trabaja sobre epoch int64, sin .apply por fila.
+    """
+    ahora = pd.Timestamp(ahora or hora_local())
+
+    fechas = fecha_hora_dt.to_numpy(dtype="datetime64[ns]")
+    validas = ~np.isnat(fechas)
+
+    segundos = (ahora.value - fechas.astype(np.int64)) // NS_POR_SEGUNDO
+    minutos = np.where(validas, np.trunc(segundos / 60), 0).astype(np.int64)
+
+    congelados = min_final.to_numpy(dtype="float64", na_value=np.nan)
+    return np.where(np.isnan(congelados), minutos, congelados).astype(np.int64)
+
+def calcular_semaforo(minutos):
+    return np.select(
+        [minutos >= UMBRAL_ROJO, minutos >= UMBRAL_AMARILLO],
+        ["🔴", "🟡"],
+        default="🟢",
+    )
+
+def calcular_columnas_tiempo(df, ahora=None):
+    """
+    Vista con `minutos` y `semaforo` al momento `ahora` (hora local por default).
+    No modifica df (puede ser el frame compartido de la cache).
+    """
+    minutos = calcular_minutos(df["fecha_hora_dt"], df["min_final"], ahora)
+    return df.assign(minutos=minutos, semaforo=calcular_semaforo(minutos))
@@ -0,0 +1,288 @@
+"""
+Tiempos del camino de escritura / lectura del almacenamiento.
+
+Cada operación instrumentada registra su duración en un histograma por
+nombre ("csv.lote.lock_espera", "csv.snapshot", "sqlite.escritura"...).
+Con los locks se separa la espera (hasta obtenerlo) del tiempo que se
+retiene, para saber si un alta lenta fue por fila en el lock o por el
+trabajo hecho adentro.
+
+Las métricas son por proceso y viven en memoria. Se muestran en el
+expander de Admin y un hilo de fondo las vuelca cada INTERVALO_VOLCADO
+a METRICAS_DIR en JSON y en formato de texto de Prometheus (para el
+textfile collector de node_exporter o cualquier scraper de archivos),
+un par de archivos por proceso (metricas_<pid>.*): el collector junta
+todos los .prom y la etiqueta pid los distingue.
+"""
+
+import os
+import glob
+import json
+import time
+import bisect
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+METRICAS_DIR = "data/metricas"
+INTERVALO_VOLCADO = 60           # segundos entre volcados a archivo
+MUESTRAS_RECIENTES = 2048        # muestras por métrica para p50 / p95 / p99
+VIGENCIA_VOLCADOS = 600          # segundos sin actualizarse para borrar los de un proceso que ya no existe
+
+# Límites de los buckets (segundos), como los de un histograma de Prometheus
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+PREFIJO_PROMETHEUS = "requisiciones"
+
+# ==========================
+# HISTOGRAMA
+# ==========================
+
+class Histograma:
+    """
+    Conteo por bucket + suma (acumulados desde que arrancó el proceso) y
+    las últimas MUESTRAS_RECIENTES duraciones para los percentiles.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)   # el último es +Inf
+        self.cuenta = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+        self.recientes = deque(maxlen=MUESTRAS_RECIENTES)
+
+    def registrar(self, segundos):
+        self.buckets[bisect.bisect_left(BUCKETS, segundos)] += 1
+        self.cuenta += 1
+        self.suma += segundos
+        self.maximo = max(self.maximo, segundos)
+        self.recientes.append(segundos)
+
+    def percentil(self, p):
+        if not self.recientes:
+            return 0.0
+        ordenadas = sorted(self.recientes)
+        return ordenadas[min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))]
+
+_histogramas = {}
+_contadores = {}
+_lock = threading.Lock()
+
+def registrar(nombre, segundos):
+    with _lock:
+        if nombre not in _histogramas:
+            _histogramas[nombre] = Histograma()
+        _histogramas[nombre].registrar(segundos)
+
+def contar(nombre, cantidad=1):
+    with _lock:
+        _contadores[nombre] = _contadores.get(nombre, 0) + cantidad
+
+def reiniciar():
+    with _lock:
+        _histogramas.clear()
+        _contadores.clear()
+
+# ==========================
+# INSTRUMENTACIÓN
+# ==========================
+
+@contextmanager
+def medir(nombre):
+    """
+    with medir("csv.snapshot"): ...  -> registra la duración del bloque
+    (también si termina con excepción).
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar(nombre, time.perf_counter() - inicio)
+
+def cronometrado(nombre):
+    """
+    Decorador: cada llamada a la función se registra como `nombre`.
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envuelta(*args, **kwargs):
+            with medir(nombre):
+                return funcion(*args, **kwargs)
+        return envuelta
+    return decorador
+
+@contextmanager
+def con_lock(lock, nombre):
+    """
+    Toma `lock` (cualquier context manager: FileLock, threading.Lock...)
+    y registra por separado <nombre>.lock_espera y <nombre>.lock_retenido.
+    Si no se obtiene (Timeout u otro error) cuenta <nombre>.lock_fallido.
+    """
+    inicio = time.perf_counter()
+    adquirido = None
+    try:
+        with lock:
+            adquirido = time.perf_counter()
+            registrar(f"{nombre}.lock_espera", adquirido - inicio)
+            try:
+                yield lock
+            finally:
+                registrar(f"{nombre}.lock_retenido", time.perf_counter() - adquirido)
+    except BaseException:
+        if adquirido is None:
+            registrar(f"{nombre}.lock_espera", time.perf_counter() - inicio)
+            contar(f"{nombre}.lock_fallido")
+        raise
+
+# ==========================
+# REPORTES
+# ==========================
+
+def resumen():
+    """
+    Una fila (dict) por métrica: n, p50 / p95 / p99 / máx en ms (últimas
+    MUESTRAS_RECIENTES) y total en segundos (desde el arranque).
+    """
+    with _lock:
+        filas = [
+            {
+                "metrica": nombre,
+                "n": h.cuenta,
+                "p50_ms": round(h.percentil(50) * 1000, 2),
+                "p95_ms": round(h.percentil(95) * 1000, 2),
+                "p99_ms": round(h.percentil(99) * 1000, 2),
+                "max_ms": round(h.maximo * 1000, 2),
+                "total_s": round(h.suma, 3),
+            }
+            for nombre, h in sorted(_histogramas.items())
+        ]
+        contadores = dict(sorted(_contadores.items()))
+    return filas, contadores
+
+def a_json():
+    filas, contadores = resumen()
+    return {
+        "pid": os.getpid(),
+        "generado": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "duraciones": filas,
+        "contadores": contadores,
+    }
+
+def _etiqueta(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"')
+
+def a_prometheus():
+    """
+    Texto de exposición de Prometheus: un histograma con etiqueta
+    operacion, los percentiles como gauge y los contadores.
+    """
+    pid = os.getpid()
+    duracion = f"{PREFIJO_PROMETHEUS}_duracion_segundos"
+    cuantil = f"{PREFIJO_PROMETHEUS}_duracion_cuantil_segundos"
+    eventos = f"{PREFIJO_PROMETHEUS}_eventos_total"
+
+    lineas = [
+        f"# HELP {duracion} Duración de operaciones del almacenamiento.",
+        f"# TYPE {duracion} histogram",
+    ]
+    with _lock:
+        histogramas = {nombre: h for nombre, h in sorted(_histogramas.items())}
+        percentiles = {
+            nombre: [(q, h.percentil(q * 100)) for q in (0.5, 0.95, 0.99)]
+            for nombre, h in histogramas.items()
+        }
+        copias = {nombre: (list(h.buckets), h.suma, h.cuenta) for nombre, h in histogramas.items()}
+        contadores = dict(sorted(_contadores.items()))
+
+    for nombre, (buckets, suma, cuenta) in copias.items():
+        etiquetas = f'operacion="{_etiqueta(nombre)}",pid="{pid}"'
+        acumulado = 0
+        for limite, n in zip(list(BUCKETS) + ["+Inf"], buckets):
+            acumulado += n
+            lineas.append(f'{duracion}_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+        lineas.append(f"{duracion}_sum{{{etiquetas}}} {suma:.6f}")
+        lineas.append(f"{duracion}_count{{{etiquetas}}} {cuenta}")
+
+    lineas += [
+        f"# HELP {cuantil} Percentiles de las últimas {MUESTRAS_RECIENTES} muestras.",
+        f"# TYPE {cuantil} gauge",
+    ]
+    for nombre, valores in percentiles.items():
+        for q, valor in valores:
+            lineas.append(f'{cuantil}{{operacion="{_etiqueta(nombre)}",pid="{pid}",quantile="{q}"}} {valor:.6f}')
+
+    lineas += [
+        f"# HELP {eventos} Eventos contados (locks fallidos, reintentos...).",
+        f"# TYPE {eventos} counter",
+    ]
+    for nombre, valor in contadores.items():
+        lineas.append(f'{eventos}{{evento="{_etiqueta(nombre)}",pid="{pid}"}} {valor}')
+
+    return "\n".join(lineas) + "\n"
+
+def _escribir(ruta, texto):
+    tmp_path = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(texto)
+    os.replace(tmp_path, ruta)
+
+def _limpiar_volcados(metricas_dir):
+    # Procesos que ya terminaron: sus archivos dejan de actualizarse
+    limite = time.time() - VIGENCIA_VOLCADOS
+    for ruta in glob.glob(os.path.join(metricas_dir, "metricas_*")):
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError:
+            pass
+
+def volcar(metricas_dir=METRICAS_DIR):
+    """
+    Escribe metricas_<pid>.json y metricas_<pid>.prom de este proceso
+    (reemplazo atómico; un scraper nunca lee un archivo a medias) y borra
+    los de procesos viejos. Regresa las dos rutas.
+    """
+    os.makedirs(metricas_dir, exist_ok=True)
+    pid = os.getpid()
+    ruta_json = os.path.join(metricas_dir, f"metricas_{pid}.json")
+    ruta_prom = os.path.join(metricas_dir, f"metricas_{pid}.prom")
+    _escribir(ruta_json, json.dumps(a_json(), indent=2, ensure_ascii=False))
+    _escribir(ruta_prom, a_prometheus())
+    _limpiar_volcados(metricas_dir)
+    return ruta_json, ruta_prom
+
+# ==========================
+# VOLCADO PERIÓDICO
+# ==========================
+
+_hilo = None
+_hilo_lock = threading.Lock()
+
+def iniciar_volcado(intervalo=None, metricas_dir=METRICAS_DIR):
+    """
+    Arranca (una vez por proceso) el hilo que vuelca las métricas cada `intervalo`.
+    """
+    global _hilo
+    intervalo = intervalo or INTERVALO_VOLCADO
+
+    def ciclo():
+        while True:
+            time.sleep(intervalo)
+            try:
+                volcar(metricas_dir)
+            except OSError:
+                # Disco lleno / permisos: se reintenta en el siguiente ciclo
+                pass
+
+    with _hilo_lock:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=ciclo, name="volcado-metricas", daemon=True)
+            _hilo.start()
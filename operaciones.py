@@ -0,0 +1,140 @@
+"""
+Lógica de la app sin Streamlit: armar altas, traducir filtros de la UI,
+paginar y editar. La app solo pinta widgets y llama a estas funciones,
+así cada fragmento (registro, tabla, edición, admin) hace únicamente su
+parte y esto se puede usar desde scripts o pruebas sin levantar la UI.
+"""
+
+import os
+import uuid
+
+import indicadores
+import respaldos
+from almacenamiento import BACKUP_DIR, hora_local
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+OPCIONES_ISSUE = ["Todos", "Sí", "No"]
+POR_PAGINA_OPCIONES = [25, 50, 100, 200]
+RESPALDOS_POR_PAGINA = 20
+
+# Columnas internas que no se muestran en la tabla
+COLUMNAS_OCULTAS = ["fecha_hora_dt", "min_final", "uuid"]
+
+# ==========================
+# REGISTRO
+# ==========================
+
+def nueva_requisicion(cuarto, work_order, numero_parte, numero_lote, cantidad, motivo, uuid_val=None, ahora=None):
+    """
+    Fila de una requisición nueva (Pendiente, sin folio: el ID lo asigna
+    el almacenamiento dentro del mismo lock del alta).
+    """
+    return {
+        "ID": "",
+        "uuid": uuid_val or str(uuid.uuid4()),
+        "fecha_hora": (ahora or hora_local()).strftime("%Y-%m-%d %H:%M:%S"),
+        "cuarto": cuarto,
+        "work_order": work_order,
+        "numero_parte": numero_parte,
+        "numero_lote": numero_lote,
+        "cantidad": int(cantidad),
+        "motivo": motivo,
+        "status": "Pendiente",
+        "almacenista": "",
+        "issue": False,
+        "min_final": "",
+    }
+
+def registrar(almacen, fila):
+    """
+    Guarda la requisición y pide un respaldo. Regresa (folio, insertada).
+    """
+    folio, insertada = almacen.agregar(fila)
+    respaldos.obtener_gestor(almacen).solicitar("alta")
+    return folio, insertada
+
+# ==========================
+# TABLA DEL ALMACÉN
+# ==========================
+
+def filtro_issue(seleccion):
+    """
+    Multiselect de issue ("Todos" / "Sí" / "No") -> True, False o None (sin filtro).
+    """
+    if "Todos" in seleccion:
+        return None
+    if "Sí" in seleccion and "No" not in seleccion:
+        return True
+    if "No" in seleccion and "Sí" not in seleccion:
+        return False
+    return None
+
+def armar_filtros(cuartos, estados, issue, desde, hasta, historico=False):
+    return {
+        "cuartos": list(cuartos),
+        "estados": list(estados),
+        "issue": filtro_issue(issue),
+        "desde": desde,
+        "hasta": hasta,
+        "historico": historico,
+    }
+
+def total_paginas(total, por_pagina):
+    return max((total - 1) // por_pagina + 1, 1)
+
+def consultar_pagina(almacen, filtros, orden, descendente, pagina, por_pagina, ahora=None):
+    """
+    Página de la tabla con minutos / semáforo ya calculados.
+    Si la página ya no existe (cambiaron datos o filtros) se regresa la última.
+    Regresa (df, total, pagina).
+    """
+    df, total = almacen.consultar(filtros, orden, descendente, pagina, por_pagina)
+    ultima = total_paginas(total, por_pagina)
+    if pagina > ultima:
+        pagina = ultima
+        df, total = almacen.consultar(filtros, orden, descendente, pagina, por_pagina)
+    return indicadores.calcular_columnas_tiempo(df, ahora), total, pagina
+
+def para_mostrar(df):
+    return df.drop(columns=COLUMNAS_OCULTAS, errors="ignore")
+
+# ==========================
+# EDICIÓN
+# ==========================
+
+def editar(almacen, fila, id_val, status, almacenista, issue):
+    """
+    Cambia status / almacenista / issue de la fila (de la página visible).
+    Regresa False si ya no existe; si se guardó pide un respaldo.
+    """
+    uuid_val = str(fila.get("uuid", "")).strip() if "uuid" in fila.index else ""
+    encontrada = almacen.actualizar_requisicion(uuid_val, id_val, status, almacenista, issue)
+    if encontrada:
+        respaldos.obtener_gestor(almacen).solicitar("edicion")
+    return encontrada
+
+# ==========================
+# RESPALDOS
+# ==========================
+
+def mime_respaldo(ruta):
+    if ruta.endswith(".csv"):
+        return "text/csv"
+    if ruta.endswith(".gz"):
+        return "application/gzip"
+    return "application/octet-stream"
+
+def ruta_respaldo(nombre, backup_dir=BACKUP_DIR):
+    """
+    Ruta del respaldo `nombre` si existe (solo nombres del catálogo, sin rutas).
+    """
+    if not nombre or os.path.basename(nombre) != nombre:
+        return None
+    ruta = os.path.join(backup_dir, nombre)
+    return ruta if os.path.exists(ruta) else None
+
+def pagina_respaldos(catalogo, pagina, por_pagina=RESPALDOS_POR_PAGINA):
+    return catalogo.iloc[(pagina - 1) * por_pagina: pagina * por_pagina]
@@ -0,0 +1,404 @@
+"""
+Respaldos incrementales comprimidos con política de retención.
+
+Un hilo de fondo por proceso revisa almacen.version(); cuando los datos
+cambian guarda solo las filas nuevas / modificadas (incremental) y cada
+INTERVALO_COMPLETO un respaldo completo. Todo va en .csv.gz y fuera del
+lock de escritura: los escritores ya no copian archivos.
+"""
+
+import os
+import glob
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+from filelock import FileLock, Timeout
+
+import metricas
+from almacenamiento import BACKUP_DIR, COLUMNAS_BASE, _avisar, fusionar_cambios, preparar_base
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+INTERVALO_REVISION = 30          # segundos entre revisiones de versión
+INTERVALO_COMPLETO = 60 * 60     # un respaldo completo por hora (si hubo cambios)
+INTERVALO_ARCHIVO = 24 * 60 * 60 # una pasada al archivo histórico por día
+RETENCION_HORAS = 24             # uno por hora durante las últimas 24 h
+RETENCION_DIAS = 30              # uno por día durante los últimos 30 días
+
+CATALOGO = "catalogo.jsonl"
+
+PREFIJO_COMPLETO = "requisiciones_backup_"
+PREFIJO_INCREMENTAL = "requisiciones_incr_"
+FORMATO_TS = "%Y-%m-%d_%H-%M-%S-%f"
+
+# ==========================
+# NOMBRES DE ARCHIVO
+# ==========================
+
+def fecha_de_respaldo(ruta):
+    """
+    Fecha codificada en el nombre (requisiciones_backup_2025-11-20_16-54-27[-micro]_motivo...).
+    """
+    nombre = os.path.basename(ruta)
+    for prefijo in (PREFIJO_COMPLETO, PREFIJO_INCREMENTAL):
+        if nombre.startswith(prefijo):
+            partes = nombre[len(prefijo):].split("_")
+            if len(partes) < 2:
+                return None
+            ts = f"{partes[0]}_{partes[1]}"
+            for fmt in (FORMATO_TS, "%Y-%m-%d_%H-%M-%S"):
+                try:
+                    return datetime.strptime(ts, fmt)
+                except ValueError:
+                    pass
+    return None
+
+def es_incremental(ruta):
+    return os.path.basename(ruta).startswith(PREFIJO_INCREMENTAL)
+
+def motivo_de_respaldo(ruta):
+    nombre = os.path.basename(ruta)
+    for prefijo in (PREFIJO_COMPLETO, PREFIJO_INCREMENTAL):
+        if nombre.startswith(prefijo):
+            partes = nombre[len(prefijo):].split("_", 2)
+            if len(partes) == 3:
+                return partes[2].split(".", 1)[0]
+    return ""
+
+def listar_respaldos(backup_dir=BACKUP_DIR):
+    """
+    Respaldos (completos, incrementales y los .csv / .sqlite anteriores), más recientes primero.
+    """
+    rutas = [
+        r for r in glob.glob(os.path.join(backup_dir, "requisiciones_*"))
+        if not r.endswith(".tmp") and fecha_de_respaldo(r) is not None
+    ]
+    return sorted(rutas, key=fecha_de_respaldo, reverse=True)
+
+# ==========================
+# RETENCIÓN
+# ==========================
+
+def aplicar_retencion(backup_dir=BACKUP_DIR, ahora=None,
+                      horas=RETENCION_HORAS, dias=RETENCION_DIAS):
+    """
+    Conserva el respaldo completo más reciente de cada hora (últimas `horas`)
+    y de cada día (últimos `dias`). Los incrementales van por cadena (su
+    completo anterior + los incrementales entre ambos, como los recorre
+    reconstruir()): si alguno de la cadena cae en la ventana horaria se
+    conserva la cadena entera, incluido su completo; si no, se borra
+    completa. Regresa la lista de archivos borrados. Se llama con
+    .respaldos.lock tomado (GestorRespaldos.respaldar).
+    """
+    ahora = ahora or datetime.now()
+    limite_horas = ahora - timedelta(hours=horas)
+    limite_dias = ahora - timedelta(days=dias)
+
+    respaldos = listar_respaldos(backup_dir)
+    completos = [r for r in respaldos if not es_incremental(r)]
+
+    conservar = set()
+    horas_vistas, dias_vistos = set(), set()
+    for r in completos:  # más recientes primero
+        fecha = fecha_de_respaldo(r)
+        hora = fecha.strftime("%Y-%m-%d %H")
+        dia = fecha.strftime("%Y-%m-%d")
+        if fecha >= limite_horas and hora not in horas_vistas:
+            horas_vistas.add(hora)
+            conservar.add(r)
+        if fecha >= limite_dias and dia not in dias_vistos:
+            dias_vistos.add(dia)
+            conservar.add(r)
+
+    # El completo más reciente siempre se queda (base de la cadena actual)
+    if completos:
+        conservar.add(completos[0])
+
+    # Cadenas en orden cronológico: [completo, incr, incr, ...]. Los incrementales
+    # sin completo anterior no se pueden reconstruir y se borran.
+    cadenas, actual = [], None
+    for r in reversed(respaldos):
+        if not es_incremental(r):
+            actual = [r]
+            cadenas.append(actual)
+        elif actual is not None:
+            actual.append(r)
+
+    for completo, *incrementales in cadenas:
+        if any(fecha_de_respaldo(r) >= limite_horas for r in incrementales):
+            conservar.add(completo)
+            conservar.update(incrementales)
+
+    borrados = []
+    for r in respaldos:
+        if r not in conservar:
+            try:
+                os.remove(r)
+                borrados.append(r)
+            except OSError:
+                pass
+
+    if borrados:
+        _reescribir_catalogo(backup_dir)
+    return borrados
+
+# ==========================
+# CATÁLOGO
+# ==========================
+
+COLUMNAS_CATALOGO = ["archivo", "fecha", "tipo", "motivo", "filas", "bytes"]
+
+def _entrada_catalogo(ruta, filas=None):
+    return {
+        "archivo": os.path.basename(ruta),
+        "fecha": fecha_de_respaldo(ruta).strftime("%Y-%m-%d %H:%M:%S"),
+        "tipo": "incremental" if es_incremental(ruta) else "completo",
+        "motivo": motivo_de_respaldo(ruta),
+        "filas": filas,
+        "bytes": os.path.getsize(ruta),
+    }
+
+def registrar_en_catalogo(ruta, filas=None, backup_dir=BACKUP_DIR):
+    """
+    Agrega la metadata de un respaldo recién escrito (una línea JSON).
+    """
+    with open(os.path.join(backup_dir, CATALOGO), "a", encoding="utf-8") as f:
+        f.write(json.dumps(_entrada_catalogo(ruta, filas), ensure_ascii=False) + "\n")
+
+def _leer_entradas(backup_dir):
+    entradas = {}
+    try:
+        with open(os.path.join(backup_dir, CATALOGO), "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    e = json.loads(linea)
+                except ValueError:
+                    continue
+                entradas[e["archivo"]] = e
+    except FileNotFoundError:
+        pass
+    return entradas
+
+def _entradas_en_disco(backup_dir):
+    """
+    Entradas del catálogo para lo que hay en disco: sin los archivos borrados
+    y con los que se crearon por fuera (respaldos 'corrupto', anteriores...).
+    Solo lee nombres y tamaños, nunca el contenido.
+    """
+    entradas = _leer_entradas(backup_dir)
+    return [entradas.get(os.path.basename(r)) or _entrada_catalogo(r)
+            for r in listar_respaldos(backup_dir)]
+
+def _reescribir_catalogo(backup_dir):
+    """
+    Deja el catálogo igual a lo que hay en disco. Hay que llamarla con
+    .respaldos.lock tomado: otro proceso puede estar anexando al catálogo.
+    """
+    nuevas = _entradas_en_disco(backup_dir)
+
+    ruta_catalogo = os.path.join(backup_dir, CATALOGO)
+    tmp_path = f"{ruta_catalogo}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for e in nuevas:
+            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, ruta_catalogo)
+
+_catalogo_cache = {}
+_catalogo_lock = threading.Lock()
+
+def leer_catalogo(backup_dir=BACKUP_DIR):
+    """
+    Catálogo de respaldos (más recientes primero) como DataFrame.
+    Se cachea por proceso y solo se vuelve a leer si cambia la carpeta
+    (alta / baja de archivos) o el propio catálogo.
+    """
+    if not os.path.isdir(backup_dir):
+        return pd.DataFrame(columns=COLUMNAS_CATALOGO)
+
+    ruta_catalogo = os.path.join(backup_dir, CATALOGO)
+    firma = (
+        os.stat(backup_dir).st_mtime_ns,
+        os.stat(ruta_catalogo).st_mtime_ns if os.path.exists(ruta_catalogo) else None,
+    )
+
+    with _catalogo_lock:
+        cache = _catalogo_cache.get(backup_dir)
+        if cache and cache[0] == firma:
+            return cache[1]
+
+        entradas = _leer_entradas(backup_dir)
+        nombres = {os.path.basename(r) for r in glob.glob(os.path.join(backup_dir, "requisiciones_*"))
+                   if fecha_de_respaldo(r) is not None and not r.endswith(".tmp")}
+        if set(entradas) != nombres:
+            # Solo se reescribe con el lock de respaldos; si está ocupado, el
+            # respaldo en curso lo deja al día y aquí se arma en memoria sin cachear
+            try:
+                with FileLock(os.path.join(backup_dir, ".respaldos.lock"), timeout=0):
+                    _reescribir_catalogo(backup_dir)
+                entradas = _leer_entradas(backup_dir)
+                firma = (os.stat(backup_dir).st_mtime_ns, os.stat(ruta_catalogo).st_mtime_ns)
+            except Timeout:
+                entradas = {e["archivo"]: e for e in _entradas_en_disco(backup_dir)}
+                firma = None
+
+        df = pd.DataFrame(list(entradas.values()), columns=COLUMNAS_CATALOGO)
+        df = df.sort_values(by="fecha", ascending=False, kind="stable").reset_index(drop=True)
+        if firma is not None:
+            _catalogo_cache[backup_dir] = (firma, df)
+        return df
+
+# ==========================
+# RECONSTRUCCIÓN
+# ==========================
+
+def reconstruir(ruta, backup_dir=BACKUP_DIR):
+    """
+    Estado de los datos al momento del respaldo `ruta`: si es incremental,
+    parte del completo anterior y aplica los incrementales hasta él.
+    """
+    if not es_incremental(ruta):
+        return pd.read_csv(ruta, dtype=str, encoding="utf-8-sig").fillna("")
+
+    fecha_objetivo = fecha_de_respaldo(ruta)
+    cadena = []
+    for r in listar_respaldos(backup_dir):
+        fecha = fecha_de_respaldo(r)
+        if fecha > fecha_objetivo:
+            continue
+        cadena.append(r)
+        if not es_incremental(r):
+            break
+    else:
+        raise FileNotFoundError("No hay respaldo completo anterior a este incremental.")
+
+    cadena.reverse()
+    df = preparar_base(pd.read_csv(cadena[0], dtype=str, encoding="utf-8-sig").fillna(""))
+    for r in cadena[1:]:
+        delta = preparar_base(pd.read_csv(r, dtype=str, encoding="utf-8-sig").fillna(""))
+        df = fusionar_cambios(df, delta)
+    return df.drop(columns=["fecha_hora_dt"], errors="ignore")
+
+# ============================================================
+# GESTOR EN SEGUNDO PLANO
+# ============================================================
+
+class GestorRespaldos:
+    """
+    Hilo de fondo que respalda el almacén sin tocar el camino de escritura.
+    Reutiliza la recarga incremental del almacén: cada ciclo pide solo los
+    cambios desde el último respaldo. Una vez al día también mueve las
+    cerradas viejas al archivo histórico (almacen.archivar); después de
+    eso la recarga sale completa y el siguiente respaldo también.
+    """
+
+    def __init__(self, almacen, backup_dir=BACKUP_DIR):
+        self.almacen = almacen
+        self.backup_dir = backup_dir
+        self._evento = threading.Event()
+        self._motivo = "auto"
+        self._estado = None
+        self._version = None
+        self._ultimo_completo = 0.0
+        self._ultimo_archivo = time.time()
+        self._hilo = None
+        self._lock_hilo = threading.Lock()
+        # Último fallo de cada tarea del hilo (se muestran en Admin); None si la última vez salió bien
+        self.ultimo_error = None
+        self.ultimo_error_archivo = None
+
+    def iniciar(self):
+        with self._lock_hilo:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(
+                    target=self._ciclo, name="respaldos-requisiciones", daemon=True
+                )
+                self._hilo.start()
+        return self
+
+    def solicitar(self, motivo="auto"):
+        """
+        Pide un respaldo en cuanto sea posible (no bloquea al que llama).
+        """
+        self._motivo = motivo
+        self._evento.set()
+
+    def _ciclo(self):
+        while True:
+            self._evento.wait(INTERVALO_REVISION)
+            self._evento.clear()
+            # Un fallo no debe tumbar el hilo: se anota, se avisa y se reintenta en el siguiente ciclo
+            if time.time() - self._ultimo_archivo >= INTERVALO_ARCHIVO:
+                self._ultimo_archivo = time.time()
+                try:
+                    self.almacen.archivar()
+                    self.ultimo_error_archivo = None
+                except Exception as e:
+                    self.ultimo_error_archivo = f"{datetime.now():%Y-%m-%d %H:%M:%S} {e}"
+                    _avisar(f"⚠️ No se pudo archivar las requisiciones cerradas: {e}")
+            try:
+                self.respaldar(self._motivo)
+                self.ultimo_error = None
+            except Exception as e:
+                self.ultimo_error = f"{datetime.now():%Y-%m-%d %H:%M:%S} {e}"
+                _avisar(f"⚠️ No se pudo crear el respaldo: {e}")
+            self._motivo = "auto"
+
+    def respaldar(self, motivo="auto", completo=False):
+        """
+        Un ciclo de respaldo. Solo un proceso a la vez lo ejecuta; los demás
+        lo omiten (el que tiene el lock ya está respaldando).
+        Regresa la ruta escrita o None si no había cambios.
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        try:
+            with FileLock(os.path.join(self.backup_dir, ".respaldos.lock"), timeout=0):
+                return self._respaldar(motivo, completo)
+        except Timeout:
+            return None
+
+    @metricas.cronometrado("respaldos.respaldar")
+    def _respaldar(self, motivo, completo):
+        version = self.almacen.version()
+        toca_completo = completo or (time.time() - self._ultimo_completo) >= INTERVALO_COMPLETO
+        if version == self._version and not toca_completo:
+            return None
+
+        estado = None if toca_completo else self._estado
+        df, estado_nuevo, es_delta = self.almacen.cargar_cambios(estado)
+        if es_delta and df.empty:
+            self._estado, self._version = estado_nuevo, version
+            return None
+
+        prefijo = PREFIJO_INCREMENTAL if es_delta else PREFIJO_COMPLETO
+        timestamp = datetime.now().strftime(FORMATO_TS)
+        ruta = os.path.join(self.backup_dir, f"{prefijo}{timestamp}_{motivo}.csv.gz")
+
+        df_out = df.drop(columns=["fecha_hora_dt"], errors="ignore")
+        df_out = df_out[[c for c in COLUMNAS_BASE if c in df_out.columns]]
+        tmp_path = ruta + ".tmp"
+        df_out.to_csv(tmp_path, index=False, encoding="utf-8-sig", compression="gzip")
+        os.replace(tmp_path, ruta)
+        registrar_en_catalogo(ruta, filas=len(df_out), backup_dir=self.backup_dir)
+
+        self._estado, self._version = estado_nuevo, version
+        if not es_delta:
+            self._ultimo_completo = time.time()
+            aplicar_retencion(self.backup_dir)
+        return ruta
+
+_gestores = {}
+_gestores_lock = threading.Lock()
+
+def obtener_gestor(almacen):
+    """
+    Gestor único por proceso para el almacén (arranca su hilo la primera vez).
+    """
+    with _gestores_lock:
+        if almacen.nombre not in _gestores:
+            _gestores[almacen.nombre] = GestorRespaldos(almacen).iniciar()
+        return _gestores[almacen.nombre]
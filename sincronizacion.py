@@ -0,0 +1,551 @@
+"""
+Sincronización en segundo plano con una hoja de Smartsheet.
+
+Un hilo por proceso (como los respaldos) toma las requisiciones nuevas o
+modificadas con la recarga incremental del almacén y las anota en una
+bitácora de cambios (SQLite en SMARTSHEET_DIR). De ahí salen por lotes:
+las que la hoja aún no tiene van en una llamada de alta de filas y las
+demás en una de actualización. Un lote fallido se reintenta con espera
+exponencial; nada de esto corre en el hilo de una sesión de Streamlit.
+
+La bitácora guarda por uuid el id de fila de Smartsheet y una huella de
+lo último enviado, así una recarga completa (compactación, reinicio del
+proceso) solo reenvía lo que de verdad cambió. Las filas que se archivan
+o se borran del almacén se quedan en la hoja.
+
+ClienteLocal imita la API con una hoja en memoria (y fallas a pedido)
+para probar sin red ni token.
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+import importlib.util
+from itertools import count
+
+import pandas as pd
+from filelock import FileLock, Timeout
+
+import metricas
+from almacenamiento import COLUMNAS_BASE, obtener_vigilante
+
+# ============================================================
+# CONFIGURACIÓN
+# ============================================================
+
+SMARTSHEET_DIR = "data/smartsheet"
+TAMANO_LOTE = 200                # filas por llamada de alta / actualización
+INTERVALO_REVISION = 30          # segundos; también despierta con cada cambio
+MAX_REINTENTOS = 6               # después la fila queda atascada hasta que cambie
+ESPERA_BASE = 2.0                # segundos; se duplica en cada reintento
+ESPERA_MAXIMA = 300.0
+
+# Columna del almacén -> título de la columna en la hoja
+COLUMNAS_SMARTSHEET = {c: c for c in COLUMNAS_BASE}
+
+def disponible():
+    return importlib.util.find_spec("smartsheet") is not None
+
+def espera(intentos):
+    """
+    Segundos antes del siguiente intento: exponencial con tope y jitter
+    (varios procesos no reintentan todos en el mismo instante).
+    """
+    base = min(ESPERA_MAXIMA, ESPERA_BASE * (2 ** max(0, intentos - 1)))
+    return base * random.uniform(0.5, 1.0)
+
+# ==========================
+# ERRORES
+# ==========================
+
+class ErrorTransitorio(Exception):
+    """Límite de llamadas, error 5xx o de red: se reintenta el lote."""
+
+class ErrorPermanente(Exception):
+    """La hoja rechazó los datos (4xx): reintentar igual no sirve."""
+
+# ==========================
+# CLIENTES
+# ==========================
+
+def _valor_celda(v):
+    if v is None or (isinstance(v, float) and pd.isna(v)):
+        return ""
+    if hasattr(v, "item"):
+        # numpy -> tipo de Python (el SDK serializa a JSON)
+        return v.item()
+    return v
+
+class ClienteSmartsheet:
+    """
+    Envoltura mínima del SDK oficial (smartsheet-python-sdk): alta y
+    actualización de filas por lote y el mapa uuid -> id de fila.
+    Las columnas se buscan por título (COLUMNAS_SMARTSHEET) una vez.
+    """
+
+    def __init__(self, token, sheet_id):
+        import smartsheet
+
+        self._smartsheet = smartsheet
+        self.sheet_id = int(sheet_id)
+        self.cliente = smartsheet.Smartsheet(token)
+        self.cliente.errors_as_exceptions(True)
+        self._columnas = None
+
+    def _llamar(self, funcion, *args):
+        exc = self._smartsheet.exceptions
+        try:
+            return funcion(*args)
+        except exc.ApiError as e:
+            resultado = getattr(getattr(e, "error", None), "result", None)
+            estado = getattr(resultado, "status_code", None) or 0
+            if estado == 429 or estado >= 500 or getattr(resultado, "should_retry", False):
+                raise ErrorTransitorio(str(e)) from e
+            raise ErrorPermanente(str(e)) from e
+        except (exc.HttpError, exc.UnexpectedRequestError, OSError) as e:
+            raise ErrorTransitorio(str(e)) from e
+        except Exception as e:
+            # Errores de red de requests (ConnectionError, Timeout...)
+            if type(e).__module__.startswith("requests"):
+                raise ErrorTransitorio(str(e)) from e
+            raise
+
+    def columnas(self):
+        if self._columnas is None:
+            respuesta = self._llamar(
+                lambda: self.cliente.Sheets.get_columns(self.sheet_id, include_all=True)
+            )
+            por_titulo = {c.title: c.id for c in respuesta.data}
+            faltantes = [t for t in COLUMNAS_SMARTSHEET.values() if t not in por_titulo]
+            if faltantes:
+                raise ErrorPermanente(f"La hoja no tiene las columnas: {', '.join(faltantes)}")
+            self._columnas = {c: por_titulo[t] for c, t in COLUMNAS_SMARTSHEET.items()}
+        return self._columnas
+
+    def _fila(self, fila, row_id=None):
+        modelos = self._smartsheet.models
+        row = modelos.Row()
+        if row_id is None:
+            row.to_bottom = True
+        else:
+            row.id = row_id
+        for columna, column_id in self.columnas().items():
+            celda = modelos.Cell()
+            celda.column_id = column_id
+            celda.value = _valor_celda(fila.get(columna, ""))
+            row.cells.append(celda)
+        return row
+
+    def agregar_filas(self, filas):
+        """
+        Alta de filas en una llamada; regresa los ids de fila en el mismo orden.
+        """
+        rows = [self._fila(fila) for fila in filas]
+        respuesta = self._llamar(lambda: self.cliente.Sheets.add_rows(self.sheet_id, rows))
+        return [row.id for row in respuesta.result]
+
+    def actualizar_filas(self, pares):
+        """
+        Actualización de filas en una llamada; pares = [(row_id, fila)].
+        """
+        rows = [self._fila(fila, row_id) for row_id, fila in pares]
+        self._llamar(lambda: self.cliente.Sheets.update_rows(self.sheet_id, rows))
+
+    def uuids(self):
+        """
+        {uuid: row_id} de lo que ya está en la hoja (reconciliación inicial).
+        """
+        column_id = self.columnas()["uuid"]
+        hoja = self._llamar(
+            lambda: self.cliente.Sheets.get_sheet(self.sheet_id, column_ids=[column_id])
+        )
+        resultado = {}
+        for row in hoja.rows:
+            for celda in row.cells:
+                if celda.column_id == column_id and celda.value:
+                    resultado[str(celda.value)] = row.id
+        return resultado
+
+class ClienteLocal:
+    """
+    Hoja en memoria con la misma interfaz que ClienteSmartsheet.
+    `fallas` es una lista de excepciones que se levantan, una por
+    llamada, antes de atender las siguientes (para probar reintentos).
+    """
+
+    def __init__(self, fallas=None):
+        self.filas = {}
+        self.llamadas = []
+        self.fallas = list(fallas or [])
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    def _llamada(self, nombre, n):
+        self.llamadas.append((nombre, n))
+        if self.fallas:
+            raise self.fallas.pop(0)
+
+    def agregar_filas(self, filas):
+        with self._lock:
+            self._llamada("agregar", len(filas))
+            ids = []
+            for fila in filas:
+                row_id = next(self._ids)
+                self.filas[row_id] = {c: _valor_celda(fila.get(c, "")) for c in COLUMNAS_SMARTSHEET}
+                ids.append(row_id)
+            return ids
+
+    def actualizar_filas(self, pares):
+        with self._lock:
+            self._llamada("actualizar", len(pares))
+            if any(row_id not in self.filas for row_id, _ in pares):
+                raise ErrorPermanente("Fila no encontrada")
+            for row_id, fila in pares:
+                self.filas[row_id] = {c: _valor_celda(fila.get(c, "")) for c in COLUMNAS_SMARTSHEET}
+
+    def uuids(self):
+        with self._lock:
+            self._llamada("uuids", 0)
+            return {str(f["uuid"]): row_id for row_id, f in self.filas.items() if f.get("uuid")}
+
+# ============================================================
+# BITÁCORA DE CAMBIOS
+# ============================================================
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS sincronizadas (
+    uuid TEXT PRIMARY KEY,
+    row_id INTEGER NOT NULL,
+    huella INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pendientes (
+    uuid TEXT PRIMARY KEY,
+    fila TEXT NOT NULL,
+    huella INTEGER NOT NULL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo REAL NOT NULL DEFAULT 0,
+    error TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS estado (
+    nombre TEXT PRIMARY KEY,
+    valor TEXT NOT NULL
+);
+"""
+
+def huellas(df):
+    """
+    Huella (int64) por fila de las columnas que se sincronizan.
+    """
+    columnas = df[list(COLUMNAS_SMARTSHEET)].astype(str)
+    return pd.util.hash_pandas_object(columnas, index=False).to_numpy().view("int64")
+
+class SincronizadorSmartsheet:
+    """
+    Hilo de fondo que lleva los cambios del almacén a la hoja. Cada ciclo
+    (al ver un cambio con el vigilante o cada INTERVALO_REVISION) anota
+    en la bitácora lo nuevo / modificado y envía los pendientes por
+    lotes. Solo un proceso a la vez sincroniza (FileLock sin espera).
+    """
+
+    def __init__(self, almacen, cliente, smartsheet_dir=SMARTSHEET_DIR):
+        self.almacen = almacen
+        self.cliente = cliente
+        self.smartsheet_dir = smartsheet_dir
+        self.db_path = os.path.join(smartsheet_dir, f"bitacora_{almacen.nombre}.sqlite")
+        self._estado = None
+        self._hilo = None
+        self._lock_hilo = threading.Lock()
+        self.ultimo_error = None
+
+        os.makedirs(smartsheet_dir, exist_ok=True)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executescript(_ESQUEMA)
+
+    def _conn(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def iniciar(self):
+        with self._lock_hilo:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(
+                    target=self._ciclo, name="sincronizacion-smartsheet", daemon=True
+                )
+                self._hilo.start()
+        return self
+
+    def _ciclo(self):
+        vigilante = obtener_vigilante(self.almacen)
+        version = None
+        while True:
+            try:
+                self.sincronizar()
+            except Exception as e:
+                # Un ciclo fallido no tumba el hilo; se reintenta en el siguiente (se ve en Admin)
+                self.ultimo_error = str(e)
+            # Despierta con el siguiente cambio en los datos o por tiempo (reintentos pendientes)
+            version = vigilante.esperar_cambio(version, INTERVALO_REVISION)
+
+    def sincronizar(self):
+        """
+        Un ciclo completo: anotar cambios y enviar lo pendiente.
+        Regresa cuántas filas se enviaron (None si otro proceso lo está haciendo).
+        """
+        try:
+            with FileLock(os.path.join(self.smartsheet_dir, ".sincronizacion.lock"), timeout=0):
+                # Se limpia al empezar: lo que falle en este ciclo (_fallido) queda visible
+                self.ultimo_error = None
+                self._reconciliar()
+                self.registrar_cambios()
+                enviadas = self.enviar_pendientes()
+        except Timeout:
+            return None
+        return enviadas
+
+    # --------------------------
+    # Anotar cambios
+    # --------------------------
+
+    def _reconciliar(self):
+        """
+        Primera vez con esta bitácora: toma los ids de las filas que la hoja
+        ya tiene (por uuid) para no duplicarlas.
+        """
+        conn = self._conn()
+        try:
+            if conn.execute("SELECT 1 FROM estado WHERE nombre = 'reconciliada'").fetchone():
+                return
+            existentes = self.cliente.uuids()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO sincronizadas (uuid, row_id, huella) VALUES (?, ?, 0)",
+                existentes.items(),
+            )
+            conn.execute("INSERT OR REPLACE INTO estado (nombre, valor) VALUES ('reconciliada', '1')")
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @metricas.cronometrado("smartsheet.registrar")
+    def registrar_cambios(self):
+        """
+        Pasa a `pendientes` las filas cuya huella no coincide con la última
+        enviada. Usa la recarga incremental del almacén; la primera vez (o
+        tras una compactación / reinicio) compara todo, pero solo por huella.
+        Regresa cuántas filas quedaron pendientes en este ciclo.
+        """
+        df, estado_nuevo, es_delta = self.almacen.cargar_cambios(self._estado)
+        df = df[df["uuid"].astype(str).ne("")]
+        if df.empty:
+            self._estado = estado_nuevo
+            return 0
+
+        df = df.drop_duplicates(subset=["uuid"], keep="last")
+        df = df.assign(_huella=huellas(df))
+
+        conn = self._conn()
+        try:
+            enviadas = pd.read_sql_query("SELECT uuid, huella FROM sincronizadas", conn)
+            # Int64 (con <NA>) para no perder precisión de la huella al reindexar
+            previas = pd.Series(enviadas["huella"].to_numpy(), index=enviadas["uuid"].to_numpy(), dtype="Int64")
+            previas = previas.reindex(df["uuid"].astype(str).to_numpy()).reset_index(drop=True)
+            cambiadas = df[previas.ne(df["_huella"].to_numpy()).fillna(True).to_numpy(dtype=bool)]
+
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO pendientes (uuid, fila, huella) VALUES (?, ?, ?) "
+                "ON CONFLICT(uuid) DO UPDATE SET fila = excluded.fila, huella = excluded.huella, "
+                "intentos = 0, proximo = 0, error = '' WHERE pendientes.huella <> excluded.huella",
+                [
+                    (str(fila["uuid"]), json.dumps(fila, default=str), int(huella))
+                    for fila, huella in zip(
+                        cambiadas[list(COLUMNAS_SMARTSHEET)].to_dict("records"), cambiadas["_huella"]
+                    )
+                ],
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        self._estado = estado_nuevo
+        return len(cambiadas)
+
+    # --------------------------
+    # Enviar
+    # --------------------------
+
+    def enviar_pendientes(self, ahora=None):
+        """
+        Envía por lotes de TAMANO_LOTE los pendientes cuyo reintento ya toca.
+        Regresa cuántas filas quedaron sincronizadas.
+        """
+        enviadas = 0
+        excluir = set()
+        while True:
+            lote = self._tomar_lote(ahora or time.time(), excluir)
+            if not lote:
+                return enviadas
+            excluir.update(p["uuid"] for p in lote)
+            enviadas += self._enviar_lote(lote)
+
+    def _tomar_lote(self, ahora, excluir):
+        conn = self._conn()
+        try:
+            filas = conn.execute(
+                "SELECT p.uuid, p.fila, p.huella, p.intentos, s.row_id FROM pendientes p "
+                "LEFT JOIN sincronizadas s ON s.uuid = p.uuid "
+                "WHERE p.proximo <= ? AND p.intentos < ? ORDER BY p.rowid",
+                (ahora, MAX_REINTENTOS),
+            ).fetchall()
+        finally:
+            conn.close()
+        lote = []
+        for u, fila, huella, intentos, row_id in filas:
+            if u in excluir:
+                continue
+            lote.append({"uuid": u, "fila": json.loads(fila), "huella": huella,
+                         "intentos": intentos, "row_id": row_id})
+            if len(lote) >= TAMANO_LOTE:
+                break
+        return lote
+
+    def _enviar_lote(self, lote):
+        """
+        Altas y actualizaciones del lote (una llamada de cada tipo). Un
+        error permanente en un lote de varias filas se reintenta fila por
+        fila, para que una fila mala no detenga a las demás.
+        """
+        nuevas = [p for p in lote if p["row_id"] is None]
+        existentes = [p for p in lote if p["row_id"] is not None]
+        enviadas = 0
+
+        for grupo, llamada in ((nuevas, self._agregar), (existentes, self._actualizar)):
+            if not grupo:
+                continue
+            try:
+                with metricas.medir("smartsheet.lote"):
+                    llamada(grupo)
+            except ErrorPermanente as e:
+                if len(grupo) > 1:
+                    enviadas += sum(self._enviar_lote([p]) for p in grupo)
+                    continue
+                self._fallido(grupo, str(e), permanente=True)
+                continue
+            except ErrorTransitorio as e:
+                metricas.contar("smartsheet.reintentos")
+                self._fallido(grupo, str(e), permanente=False)
+                if llamada == self._agregar:
+                    # El alta pudo aplicarse sin que llegara la respuesta: antes de
+                    # reintentar se vuelven a leer los uuid de la hoja
+                    self._olvidar_reconciliacion()
+                continue
+            enviadas += len(grupo)
+            metricas.contar("smartsheet.filas", len(grupo))
+        return enviadas
+
+    def _agregar(self, grupo):
+        row_ids = self.cliente.agregar_filas([p["fila"] for p in grupo])
+        self._confirmar(grupo, row_ids)
+
+    def _actualizar(self, grupo):
+        self.cliente.actualizar_filas([(p["row_id"], p["fila"]) for p in grupo])
+        self._confirmar(grupo, [p["row_id"] for p in grupo])
+
+    def _confirmar(self, grupo, row_ids):
+        # Se quita de pendientes solo si no cambió mientras se enviaba (misma huella)
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO sincronizadas (uuid, row_id, huella) VALUES (?, ?, ?) "
+                "ON CONFLICT(uuid) DO UPDATE SET row_id = excluded.row_id, huella = excluded.huella",
+                [(p["uuid"], row_id, p["huella"]) for p, row_id in zip(grupo, row_ids)],
+            )
+            conn.executemany(
+                "DELETE FROM pendientes WHERE uuid = ? AND huella = ?",
+                [(p["uuid"], p["huella"]) for p in grupo],
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _olvidar_reconciliacion(self):
+        conn = self._conn()
+        try:
+            conn.execute("DELETE FROM estado WHERE nombre = 'reconciliada'")
+        finally:
+            conn.close()
+
+    def _fallido(self, grupo, error, permanente):
+        ahora = time.time()
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "UPDATE pendientes SET intentos = ?, proximo = ?, error = ? WHERE uuid = ? AND huella = ?",
+                [
+                    (
+                        MAX_REINTENTOS if permanente else p["intentos"] + 1,
+                        ahora + espera(p["intentos"] + 1),
+                        error[:500],
+                        p["uuid"],
+                        p["huella"],
+                    )
+                    for p in grupo
+                ],
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        self.ultimo_error = error
+
+    # --------------------------
+    # Estado para la UI
+    # --------------------------
+
+    def resumen(self):
+        conn = self._conn()
+        try:
+            sincronizadas = conn.execute("SELECT COUNT(*) FROM sincronizadas").fetchone()[0]
+            pendientes, atascadas = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(intentos >= ?), 0) FROM pendientes", (MAX_REINTENTOS,)
+            ).fetchone()
+            error = conn.execute(
+                "SELECT error FROM pendientes WHERE error <> '' ORDER BY proximo DESC LIMIT 1"
+            ).fetchone()
+        finally:
+            conn.close()
+        return {
+            "sincronizadas": sincronizadas,
+            "pendientes": pendientes - atascadas,
+            "atascadas": atascadas,
+            "ultimo_error": self.ultimo_error or (error[0] if error else None),
+        }
+
+    def reintentar_atascadas(self):
+        """
+        Vuelve a poner en fila las atascadas; salen en el siguiente ciclo.
+        """
+        conn = self._conn()
+        try:
+            conn.execute("UPDATE pendientes SET intentos = 0, proximo = 0, error = ''")
+        finally:
+            conn.close()
+
+_sincronizadores = {}
+_sincronizadores_lock = threading.Lock()
+
+def obtener_sincronizador(almacen, token, sheet_id):
+    """
+    Sincronizador único por proceso para el almacén (arranca su hilo la
+    primera vez). El cliente del SDK se crea una sola vez.
+    """
+    with _sincronizadores_lock:
+        if almacen.nombre not in _sincronizadores:
+            cliente = ClienteSmartsheet(token, sheet_id)
+            _sincronizadores[almacen.nombre] = SincronizadorSmartsheet(almacen, cliente).iniciar()
+        return _sincronizadores[almacen.nombre]